@@ -49,11 +49,7 @@ class MultiPeriodModifier(NPIBase):
         ):
             default_value = 0.0
 
-        self.npi = pd.DataFrame(
-            default_value,
-            index=self.subpops,
-            columns=pd.date_range(self.start_date, self.end_date),
-        )
+        self.default_value = default_value
 
         self.parameters = pd.DataFrame(
             data={
@@ -82,26 +78,23 @@ class MultiPeriodModifier(NPIBase):
                     "at least one period start or end date is not between global dates"
                 )
 
+        # The modifier is kept as periods, and only materialized by getReductionArray.
+        # All the subpops of a group share the periods of its first subpop.
+        rows = []
         for grp_config in npi_config["groups"]:
             affected_subpops_grp = self.__get_affected_subpops_grp(grp_config)
-            for sub_index in range(
-                len(self.parameters["start_date"][affected_subpops_grp[0]])
+            first_subpop = affected_subpops_grp[0]
+            for start_date, end_date in zip(
+                self.parameters["start_date"][first_subpop],
+                self.parameters["end_date"][first_subpop],
             ):
-                period_range = pd.date_range(
-                    self.parameters["start_date"][affected_subpops_grp[0]][sub_index],
-                    self.parameters["end_date"][affected_subpops_grp[0]][sub_index],
+                rows.extend(
+                    (subpop, start_date, end_date, self.parameters["value"][subpop])
+                    for subpop in affected_subpops_grp
                 )
-                self.npi.loc[affected_subpops_grp, period_range] = np.tile(
-                    self.parameters["value"][affected_subpops_grp],
-                    (len(period_range), 1),
-                ).T
-
-        # for index in self.parameters.index:
-        #    for sub_index in range(len(self.parameters["start_date"][index])):
-        #        period_range = pd.date_range(self.parameters["start_date"][index][sub_index], self.parameters["end_date"][index][sub_index])
-        #        ## This the line that does the work
-        #        self.npi_old.loc[index, period_range] = np.tile(self.parameters["value"][index], (len(period_range), 1)).T
-        # print(f'{self.name}, : {(self.npi_old == self.npi).all().all()}')
+        self.intervals = helpers.make_intervals(
+            rows, self.subpops, self.start_date, self.end_date
+        )
 
         # self.__checkErrors()
 
@@ -293,10 +286,26 @@ class MultiPeriodModifier(NPIBase):
         else:
             return 1.0
 
+    @property
+    def npi(self) -> pd.DataFrame:
+        "The modifier value, with subpops as rows and dates as columns"
+        return self.getReduction(self.param_name)
+
     def getReduction(self, param):
         "Return the reduction for this param, `default` if no reduction defined"
+        return helpers.reduction_to_df(
+            self.getReductionArray(param), self.subpops, self.start_date, self.end_date
+        )
+
+    def getReductionArray(self, param):
+        "Return the reduction for this param as a [ndays, nsubpops] array, `default` if no reduction defined"
         if param == self.param_name:
-            return self.npi
+            return helpers.intervals_to_array(
+                self.intervals,
+                (self.end_date - self.start_date).days + 1,
+                len(self.subpops),
+                self.default_value,
+            )
         return self.get_default(param)
 
     def getReductionToWrite(self):
@@ -47,11 +47,7 @@ class SinglePeriodModifier(NPIBase):
         ):
             default_value = 0.0
 
-        self.npi = pd.DataFrame(
-            default_value,
-            index=self.subpops,
-            columns=pd.date_range(self.start_date, self.end_date),
-        )
+        self.default_value = default_value
         self.parameters = pd.DataFrame(
             default_value,
             index=self.subpops,
@@ -72,17 +68,18 @@ class SinglePeriodModifier(NPIBase):
                 f"""{self.name} : at least one period start or end date is not between global dates"""
             )
 
-        # for index in self.parameters.index:
-        #    period_range = pd.date_range(self.parameters["start_date"][index], self.parameters["end_date"][index])
-        ## This the line that does the work
-        #    self.npi_old.loc[index, period_range] = np.tile(self.parameters["value"][index], (len(period_range), 1)).T
-
-        period_range = pd.date_range(
-            self.parameters["start_date"].iloc[0], self.parameters["end_date"].iloc[0]
+        # The modifier is kept as periods, and only materialized by getReductionArray
+        self.intervals = helpers.make_intervals(
+            zip(
+                self.parameters.index,
+                self.parameters["start_date"],
+                self.parameters["end_date"],
+                self.parameters["value"],
+            ),
+            self.subpops,
+            self.start_date,
+            self.end_date,
         )
-        self.npi.loc[self.parameters.index, period_range] = np.tile(
-            self.parameters["value"][:], (len(period_range), 1)
-        ).T
 
         # self.__checkErrors()
 
@@ -225,10 +222,26 @@ class SinglePeriodModifier(NPIBase):
         else:
             return 1.0
 
+    @property
+    def npi(self) -> pd.DataFrame:
+        "The modifier value, with subpops as rows and dates as columns"
+        return self.getReduction(self.param_name)
+
     def getReduction(self, param):
         "Return the reduction for this param, `default` if no reduction defined"
+        return helpers.reduction_to_df(
+            self.getReductionArray(param), self.subpops, self.start_date, self.end_date
+        )
+
+    def getReductionArray(self, param):
+        "Return the reduction for this param as a [ndays, nsubpops] array, `default` if no reduction defined"
         if param == self.param_name:
-            return self.npi
+            return helpers.intervals_to_array(
+                self.intervals,
+                (self.end_date - self.start_date).days + 1,
+                len(self.subpops),
+                self.default_value,
+            )
         return self.get_default(param)
 
     def getReductionToWrite(self):
@@ -6,6 +6,7 @@ import datetime
 import confuse
 import pandas as pd
 
+from . import helpers
 from .base import NPIBase
 
 debug_print = False
@@ -42,6 +43,7 @@ class StackedModifier(NPIBase):
         self.reduction_params = collections.deque()
         self.reduction_cap_exceeded = False
         self.reduction_number = 0
+        self.sub_npis = []
         sub_npis_unique_names = []
 
         for scenario in npi_config["modifiers"].get():
@@ -71,6 +73,7 @@ class StackedModifier(NPIBase):
                 pnames_overlap_operation_sum=pnames_overlap_operation_sum,
                 pnames_overlap_operation_reductionprod=pnames_overlap_operation_reductionprod,
             )
+            self.sub_npis.append(sub_npi)
 
             new_params = sub_npi.param_name  # either a list (if stacked) or a string
             new_params = (
@@ -89,7 +92,7 @@ class StackedModifier(NPIBase):
 
             for param in self.param_name:
                 # Get reduction return a neutral value for this overlap operation if no parameeter exists
-                reduction = sub_npi.getReduction(param)
+                reduction = sub_npi.getReductionArray(param)
                 if (
                     param in pnames_overlap_operation_sum
                 ):  # re.match("^transition_rate [1234567890]+$",param):
@@ -146,6 +149,11 @@ class StackedModifier(NPIBase):
             return 1.0
 
     def getReduction(self, param):
+        return helpers.reduction_to_df(
+            self.getReductionArray(param), self.subpops, self.start_date, self.end_date
+        )
+
+    def getReductionArray(self, param):
         return self.reductions.get(param, self.get_default(param))
 
     def getReductionToWrite(self):
@@ -6,8 +6,9 @@ from importlib import import_module
 from .helpers import *
 
 from .base import NPIBase
+from .compiled import CompiledModifier
 
-__all__ = ["NPIBase"]
+__all__ = ["NPIBase", "CompiledModifier"]
 
 
 def _load_npi_plugins():
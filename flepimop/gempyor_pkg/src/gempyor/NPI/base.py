@@ -1,6 +1,7 @@
 import abc
 import datetime
 
+import pandas as pd
 import pyarrow as pa
 import click
 
@@ -21,6 +22,28 @@ class NPIBase(abc.ABC):
     def getReduction(self, param, default=None):
         pass
 
+    def getReductionArray(self, param):
+        """
+        Return the reduction for this param as a `[ndays, nsubpops]` array.
+
+        Modifiers that keep their reductions as arrays override this to skip the
+        DataFrame returned by `getReduction`, which is otherwise resampled to daily
+        values like in `helpers.reduce_parameter`.
+
+        Args:
+            param: The name of the parameter.
+
+        Returns:
+            The reduction for each day and subpop, or the neutral value as a float if
+            this modifier does not change `param`.
+        """
+        reduction = self.getReduction(param)
+        if isinstance(reduction, pd.DataFrame):
+            reduction = reduction.T
+            reduction.index = pd.to_datetime(reduction.index.astype(str))
+            return reduction.resample("1D").ffill().to_numpy()
+        return reduction
+
     # Returns dataframe with columns: <subpops>, time, parameter, name. Index is sequential.
     @abc.abstractmethod
     def getReductionToWrite(self):
@@ -0,0 +1,259 @@
+"""
+Modifier trees compiled into a flat vector of modifier values.
+"""
+
+import numpy as np
+import pandas as pd
+
+from . import helpers
+from .base import NPIBase
+from .StackedModifier import StackedModifier
+
+
+class _Leaf:
+    "A modifier kept as periods, whose values are read from the slots of the tree"
+
+    def __init__(self, param_name, default_value, intervals, slots):
+        self.param_names = {param_name}
+        self.default_value = default_value
+        self.intervals = intervals
+        self.slots = slots
+
+
+class _Opaque:
+    "A modifier that cannot be compiled, whose reductions are kept as they were built"
+
+    def __init__(self, npi):
+        param_names = npi.param_name
+        self.param_names = (
+            {param_names} if isinstance(param_names, str) else set(param_names)
+        )
+        self.npi = npi
+        self.slots = np.array([], dtype=np.int64)
+
+
+class _Stack:
+    "Modifiers stacked on each other, as a `StackedModifier`"
+
+    def __init__(
+        self, children, pnames_overlap_operation_sum, pnames_overlap_operation_reductionprod
+    ):
+        self.children = children
+        self.param_names = set().union(*(child.param_names for child in children))
+        self.pnames_overlap_operation_sum = pnames_overlap_operation_sum
+        self.pnames_overlap_operation_reductionprod = pnames_overlap_operation_reductionprod
+
+
+class CompiledModifier:
+    """
+    A modifier tree compiled once into a flat vector of modifier values.
+
+    Each row of the tree's snpi/hnpi table, i.e. each modifier value of a subpop or of
+    a spatial group, gets a slot in `values`. Changing modifier values is then a write
+    to that vector, after which only the reductions of the parameters affected by the
+    changed slots are evaluated again, with the same stacking arithmetic as
+    `StackedModifier`. This avoids rebuilding the tree, with its config views and
+    DataFrames, for each new set of modifier values.
+
+    A compiled modifier offers the reduction interface of `NPIBase`, so it can be
+    used wherever a modifier built by `NPIBase.execute` is.
+
+    Attributes:
+        name: The name of the root modifier.
+        param_name: The parameter name(s) modified by the tree.
+        subpops: The subpops of the model, in order.
+        values: The modifier values, by slot.
+    """
+
+    def __init__(self, npi: NPIBase) -> None:
+        """
+        Compile a modifier tree.
+
+        Args:
+            npi: The root of the modifier tree, as built by `NPIBase.execute`.
+        """
+        self.name = npi.name
+        self.param_name = npi.param_name
+        self.subpops = list(npi.subpops)
+        self.start_date = npi.start_date
+        self.end_date = npi.end_date
+        self.ndays = (self.end_date - self.start_date).days + 1
+        self._pnames_overlap = [
+            *getattr(npi, "pnames_overlap_operation_sum", []),
+            *getattr(npi, "pnames_overlap_operation_reductionprod", []),
+        ]
+
+        self._slots = {}
+        self._opaque_rows = set()
+        self._tables = []
+        values = []
+        self._root = self._compile(npi, values)
+        self.values = np.array(values, dtype=np.float64)
+        self._reductions = {}
+        self._dependencies = {}
+
+    def _compile(self, npi, values):
+        if isinstance(npi, StackedModifier):
+            return _Stack(
+                [self._compile(sub_npi, values) for sub_npi in npi.sub_npis],
+                npi.pnames_overlap_operation_sum,
+                npi.pnames_overlap_operation_reductionprod,
+            )
+        if not hasattr(npi, "intervals"):
+            table = npi.getReductionToWrite()
+            self._tables.append((table, None))
+            if {"modifier_name", "subpop"} <= set(table.columns):
+                self._opaque_rows.update(zip(table["modifier_name"], table["subpop"]))
+            return _Opaque(npi)
+
+        # One slot per table row, the subpops of a spatial group share its slot
+        table = npi.getReductionToWrite()
+        subpop_slots = {}
+        row_slots = []
+        for subpop, modifier_name, value in zip(
+            table["subpop"], table["modifier_name"], table["value"]
+        ):
+            key = (modifier_name, subpop)
+            if key not in self._slots:
+                self._slots[key] = len(values)
+                values.append(np.asarray(value, dtype=np.float64).item())
+            row_slots.append(self._slots[key])
+            for member in str(subpop).split(","):
+                subpop_slots[member] = self._slots[key]
+        self._tables.append((table, np.array(row_slots, dtype=np.int64)))
+
+        slots = np.array(
+            [subpop_slots[npi.subpops[i]] for i in npi.intervals["subpop"]], dtype=np.int64
+        )
+        intervals = {k: v for k, v in npi.intervals.items() if k != "value"}
+        return _Leaf(npi.param_name, npi.default_value, intervals, slots)
+
+    def slot(self, modifier_name: str, subpop: str) -> int | None:
+        """
+        Find the slot of a modifier value.
+
+        Args:
+            modifier_name: The name of the modifier.
+            subpop: The subpop, or the comma separated subpops of a spatial group, as
+                in the snpi/hnpi table.
+
+        Returns:
+            The index of the value in `values`, or `None` if the tree has no such
+            modifier value, or if the value belongs to a modifier that cannot be
+            compiled (see `is_opaque`).
+        """
+        return self._slots.get((modifier_name, subpop))
+
+    def is_opaque(self, modifier_name: str, subpop: str) -> bool:
+        """
+        Check if a modifier value belongs to a modifier that cannot be compiled.
+
+        Such modifiers, without periods, keep the reductions they were built with, so
+        their values cannot be changed through slots.
+
+        Args:
+            modifier_name: The name of the modifier.
+            subpop: The subpop, or the comma separated subpops of a spatial group, as
+                in the snpi/hnpi table.
+
+        Returns:
+            `True` if the snpi/hnpi table of such a modifier has this value.
+        """
+        return (modifier_name, subpop) in self._opaque_rows
+
+    def set_values(self, slots: np.ndarray, values: np.ndarray) -> None:
+        """
+        Write modifier values, and forget the reductions they change.
+
+        Args:
+            slots: The slots to write, as returned by `slot`.
+            values: The new modifier values, one per slot.
+        """
+        slots = np.asarray(slots, dtype=np.int64)
+        values = np.asarray(values, dtype=np.float64)
+        changed = self.values[slots] != values
+        if not changed.any():
+            return
+        self.values[slots] = values
+        changed_slots = slots[changed]
+        for param in list(self._reductions):
+            if np.isin(self._dependencies[param], changed_slots).any():
+                del self._reductions[param]
+
+    def _param_slots(self, param):
+        "The slots that the reduction of `param` depends on"
+        nodes = [self._root]
+        slots = []
+        while nodes:
+            node = nodes.pop()
+            if param not in node.param_names:
+                continue
+            if isinstance(node, _Stack):
+                nodes.extend(node.children)
+            else:
+                slots.append(node.slots)
+        return np.concatenate([np.array([], dtype=np.int64)] + slots)
+
+    def _evaluate(self, node, param):
+        "The reduction of `param` by `node`, `None` if `node` does not modify `param`"
+        if param not in node.param_names:
+            return None
+        if isinstance(node, _Leaf):
+            intervals = dict(node.intervals, value=self.values[node.slots])
+            return helpers.intervals_to_array(
+                intervals, self.ndays, len(self.subpops), node.default_value
+            )
+        if isinstance(node, _Opaque):
+            return node.npi.getReductionArray(param)
+
+        if param in node.pnames_overlap_operation_sum:
+            reduction = 0
+        else:
+            reduction = 1
+        for child in node.children:
+            child_reduction = self._evaluate(child, param)
+            if child_reduction is None:
+                continue
+            if param in node.pnames_overlap_operation_sum:
+                reduction += child_reduction
+            elif param in node.pnames_overlap_operation_reductionprod:
+                reduction *= 1 - child_reduction
+            else:
+                reduction *= child_reduction
+        if param in node.pnames_overlap_operation_reductionprod:
+            reduction = 1 - reduction
+        return reduction
+
+    def get_default(self, param):
+        if param in self._pnames_overlap:
+            return 0.0
+        else:
+            return 1.0
+
+    def getReduction(self, param):
+        "Return the reduction for this param, `default` if no reduction defined"
+        return helpers.reduction_to_df(
+            self.getReductionArray(param), self.subpops, self.start_date, self.end_date
+        )
+
+    def getReductionArray(self, param):
+        "Return the reduction for this param as a [ndays, nsubpops] array, `default` if no reduction defined"
+        if param not in self._reductions:
+            reduction = self._evaluate(self._root, param)
+            self._reductions[param] = (
+                self.get_default(param) if reduction is None else reduction
+            )
+            self._dependencies[param] = self._param_slots(param)
+        return self._reductions[param]
+
+    def getReductionToWrite(self):
+        tables = []
+        for table, row_slots in self._tables:
+            if row_slots is not None:
+                table = table.copy()
+                table["value"] = self.values[row_slots]
+            tables.append(table)
+        return pd.concat(tables, ignore_index=True)
+
+    def getReductionDF(self):
+        return self.getReductionToWrite()
@@ -1,3 +1,5 @@
+import datetime
+
 import pandas as pd
 import numpy as np
 import typing
@@ -6,7 +8,7 @@ import typing
 # Helper function
 def reduce_parameter(
     parameter: np.ndarray,
-    modification: typing.Union[pd.DataFrame, float],
+    modification: typing.Union[np.ndarray, pd.DataFrame, float],
     method: str = "product",
 ) -> np.ndarray:
     if isinstance(modification, pd.DataFrame):
@@ -23,6 +25,96 @@ def reduce_parameter(
         raise ValueError(f"Unknown method to do NPI reduction, got {method}")
 
 
+def make_intervals(
+    rows: typing.Iterable[tuple],
+    subpops: list[str],
+    start_date: datetime.date,
+    end_date: datetime.date,
+) -> dict[str, np.ndarray]:
+    """
+    Build the compact interval representation of a modifier.
+
+    Args:
+        rows: `(subpop, period start date, period end date, value)` tuples, periods
+            including both their start and end dates.
+        subpops: The subpops of the model, in order.
+        start_date: The first date of the simulation.
+        end_date: The last date of the simulation.
+
+    Returns:
+        A dictionary of equal length arrays: the index of the subpop in `subpops`
+        ('subpop'), the first and last day of each period counted from `start_date`
+        ('start' and 'end'), and the modifier value over the period ('value').
+
+    Raises:
+        ValueError: If a period starts before or ends after the simulation.
+    """
+    subpop_index = {subpop: i for i, subpop in enumerate(subpops)}
+    intervals = {"subpop": [], "start": [], "end": [], "value": []}
+    for subpop, period_start, period_end, value in rows:
+        intervals["subpop"].append(subpop_index[subpop])
+        intervals["start"].append(
+            (pd.Timestamp(period_start) - pd.Timestamp(start_date)).days
+        )
+        intervals["end"].append((pd.Timestamp(period_end) - pd.Timestamp(start_date)).days)
+        intervals["value"].append(np.asarray(value, dtype=np.float64).item())
+    intervals = {
+        "subpop": np.array(intervals["subpop"], dtype=np.int64),
+        "start": np.array(intervals["start"], dtype=np.int64),
+        "end": np.array(intervals["end"], dtype=np.int64),
+        "value": np.array(intervals["value"], dtype=np.float64),
+    }
+    active = intervals["start"] <= intervals["end"]
+    ndays = (pd.Timestamp(end_date) - pd.Timestamp(start_date)).days + 1
+    if (intervals["start"][active] < 0).any() or (intervals["end"][active] >= ndays).any():
+        raise ValueError(
+            "at least one period start or end date is not between global dates"
+        )
+    return intervals
+
+
+def intervals_to_array(
+    intervals: dict[str, np.ndarray], ndays: int, nsubpops: int, default_value: float
+) -> np.ndarray:
+    """
+    Materialize the intervals of a modifier into a `[ndays, nsubpops]` array.
+
+    All the periods are written at once with a single scatter, entries that no period
+    covers take `default_value`.
+
+    Args:
+        intervals: The modifier intervals, as returned by `make_intervals`.
+        ndays: The number of days of the simulation.
+        nsubpops: The number of subpops of the model.
+        default_value: The value of the modifier outside of its periods.
+
+    Returns:
+        The modifier value for each day and subpop.
+    """
+    result = np.full((ndays, nsubpops), default_value, dtype=np.float64)
+    lengths = np.maximum(intervals["end"] - intervals["start"] + 1, 0)
+    offsets = np.repeat(np.cumsum(lengths) - lengths, lengths)
+    days = np.repeat(intervals["start"], lengths) + np.arange(lengths.sum()) - offsets
+    result[days, np.repeat(intervals["subpop"], lengths)] = np.repeat(
+        intervals["value"], lengths
+    )
+    return result
+
+
+def reduction_to_df(
+    reduction: typing.Union[np.ndarray, float],
+    subpops: list[str],
+    start_date: datetime.date,
+    end_date: datetime.date,
+) -> typing.Union[pd.DataFrame, float]:
+    """Convert a `[ndays, nsubpops]` reduction array to the subpop by date DataFrame."""
+    if not isinstance(reduction, np.ndarray):
+        return reduction
+    return pd.DataFrame(
+        reduction.T, index=subpops, columns=pd.date_range(start_date, end_date)
+    )
+
+
 def get_spatial_groups(grp_config, affected_subpops: list) -> dict:
     """
     Spatial groups are defined in the config file as a list (of lists).
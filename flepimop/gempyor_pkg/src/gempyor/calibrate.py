@@ -20,7 +20,9 @@ import numpy as np
 
 import gempyor
 from gempyor import model_info, file_paths, config, inference_parameter
+from gempyor.chain_store import ChainStore
 from gempyor.inference import GempyorInference
+from gempyor.inference_pool import InferencePool
 from gempyor.utils import config, as_list
 import gempyor.postprocess_inference
 
@@ -124,6 +126,14 @@ os.environ["OMP_NUM_THREADS"] = "1"
     envvar="RESUME_LOCATION",
     help="The location (folder or an S3 bucket) to use as the initial to the first block of the current run",
 )
+@click.option(
+    "--worker-memory-limit",
+    "worker_memory_limit",
+    envvar="FLEPI_WORKER_MEMORY_LIMIT",
+    type=click.IntRange(min=1),
+    default=None,
+    help="the memory in MB over which the calibration workers are recycled, defaults to twice the memory of a worker once the model is loaded",
+)
 # @profile_options
 # @profile()
 def calibrate(
@@ -138,6 +148,7 @@ def calibrate(
     prefix: str | None,
     resume: bool,
     resume_location: str | None,
+    worker_memory_limit: int | None,
 ) -> None:
     """
     Calibrate using an `emcee` sampler to initialize a model based on a config.
@@ -186,7 +197,8 @@ def calibrate(
     )
 
     # Draw/get initial parameters:
-    backend = emcee.backends.HDFBackend(filename)
+    # The per-statistic log-likelihoods are stored as blobs, alongside the chains
+    backend = ChainStore(filename, blob_names=list(gempyor_inference.logloss.statistics))
     if resume or resume_location is not None:
         # Normally one would put p0 = None to get the last State from the sampler, but that poses problems when the likelihood change
         # and then acceptances are not guaranted, see issue #316. This solves this issue and greates a new chain with llik evaluation
@@ -206,129 +218,112 @@ def calibrate(
 
     test_run = True
 
-    if test_run:
-        p_test = gempyor_inference.inferpar.draw_initial(n_draw=2)
-        # test on single core so that errors are well reported
-        gempyor_inference.perform_test_run()
-        with multiprocessing.Pool(ncpu) as pool:
-            lliks = pool.starmap(
-                gempyor_inference.get_logloss_as_single_number,
-                [
-                    (p_test[0],),
-                    (p_test[0],),
-                    (p_test[1],),
-                ],
-            )
-        if lliks[0] != lliks[1]:
-            print(
-                f"Test run failed, logloss with the same parameters "
-                f"is different: {lliks[0]} != {lliks[1]} ❌"
-            )
+    # The workers load the model once and are kept for the whole calibration
+    with InferencePool(
+        gempyor_inference,
+        ncpu,
+        memory_limit=(
+            None if worker_memory_limit is None else worker_memory_limit * 1024**2
+        ),
+    ) as pool:
+        if test_run:
+            p_test = gempyor_inference.inferpar.draw_initial(n_draw=2)
+            # The test run is serial, in this process, so that errors are well
+            # reported; the logloss comparison below then runs on the pool workers
+            gempyor_inference.perform_test_run()
+            lliks = pool.log_prob(np.array([p_test[0], p_test[0], p_test[1]]))
+            if lliks[0] != lliks[1]:
+                print(
+                    f"Test run failed, logloss with the same parameters "
+                    f"is different: {lliks[0]} != {lliks[1]} ❌"
+                )
+                print(
+                    "This means that there is config variability not captured in the emcee fits"
+                )
+                return
             print(
-                "This means that there is config variability not captured in the emcee fits"
+                f"Test run done, logloss with same parameters: "
+                f"{lliks[0]}=={lliks[1]} ✅ "
             )
-            return
-        print(
-            f"Test run done, logloss with same parameters: " f"{lliks[0]}=={lliks[1]} ✅ "
-        )
-
-        # assert lliks[1] != lliks[2]:
-        # "Test run failed, logloss with different parameters is the same,
-        # perturbation are not taken into account"
 
-    # Make a plot of the runs directly from config
-    n_config_samples = min(30, nwalkers // 2)
-    print(f"Making {n_config_samples} simulations from config to plot")
-    with multiprocessing.Pool(ncpu) as pool:
-        results = pool.starmap(
-            gempyor_inference.simulate_proposal, [(p0[i],) for i in range(n_config_samples)]
+            # assert lliks[1] != lliks[2]:
+            # "Test run failed, logloss with different parameters is the same,
+            # perturbation are not taken into account"
+
+        # Make a plot of the runs directly from config
+        n_config_samples = min(30, nwalkers // 2)
+        print(f"Making {n_config_samples} simulations from config to plot")
+        results = pool.simulate(p0[:n_config_samples])
+        gempyor.postprocess_inference.plot_fit(
+            modinf=gempyor_inference.modinf,
+            loss=gempyor_inference.logloss,
+            plot_projections=True,
+            list_of_df=results,
+            save_to=f"{run_id}_config.pdf",
         )
-    gempyor.postprocess_inference.plot_fit(
-        modinf=gempyor_inference.modinf,
-        loss=gempyor_inference.logloss,
-        plot_projections=True,
-        list_of_df=results,
-        save_to=f"{run_id}_config.pdf",
-    )
-
-    # >>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>
-    # @JOSEPH: find below a "cocktail" move proposal
-    moves = [
-        (emcee.moves.DEMove(live_dangerously=True), 0.5 * 0.5 * 0.5),
-        (emcee.moves.DEMove(gamma0=1.0, live_dangerously=True), 0.5 * 0.5 * 0.5),
-        (
-            emcee.moves.DESnookerMove(live_dangerously=True),
-            0.5 * 0.5,
-        ),  # First three moves: DEMove --> DE is good at "optimizing". Moves based on the (really great!) discussion in https://groups.google.com/g/emcee-users/c/FCAq459Y9OE
-        (
-            emcee.moves.StretchMove(live_dangerously=True),
-            0.5,
-        ),  # Stretch gives good chain movement
-        # (emcee.moves.KDEMove(live_dangerously=True, bw_method='scott'), 0.25)
-    ]  # Based on personal experience with pySODM (Tijs) - KDEMove works really well but I think it's important for this one to have at least 3x more walkers than parameters.
-    # >>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>
-    # moves = [(emcee.moves.StretchMove(live_dangerously=True), 1)]
-
-    gempyor_inference.set_silent(False)
-
-    # with multiprocessing.Pool(ncpu) as pool:
-    #    sampler = emcee.EnsembleSampler(
-    #        nwalkers,
-    #        gempyor_inference.inferpar.get_dim(),
-    #        gempyor_inference.get_logloss_as_single_number,
-    #        pool=pool,
-    #        backend=backend,
-    #        moves=moves,
-    #    )
-    #    state = sampler.run_mcmc(p0, niter, progress=True, skip_initial_state_check=True)
-
-    # hack around memory management: run by batch of 10 iterations
-    # TODO this fails for less thant 10 iterations
-    nbatch = 10
-    for i in range(niter // nbatch):
-        if i == 0:
-            start_val = p0
-        else:
-            start_val = None
 
-        with multiprocessing.Pool(ncpu) as pool:
-            sampler = emcee.EnsembleSampler(
-                nwalkers,
-                gempyor_inference.inferpar.get_dim(),
-                gempyor_inference.get_logloss_as_single_number,
-                pool=pool,
-                backend=backend,
-                moves=moves,
-            )
-            state = sampler.run_mcmc(
-                start_val, nbatch, progress=True, skip_initial_state_check=True
-            )
-    print(f"Done, mean acceptance fraction: {np.mean(sampler.acceptance_fraction):.3f}")
-
-    # plotting the chain
-    sampler = emcee.backends.HDFBackend(filename, read_only=True)
-    gempyor.postprocess_inference.plot_chains(
-        inferpar=gempyor_inference.inferpar,
-        chains=sampler.get_chain(),
-        llik=sampler.get_log_prob(),
-        sampled_slots=None,
-        save_to=f"{run_id}_chains.pdf",
-    )
-    print("EMCEE Run done, doing sampling")
-
-    shutil.rmtree("model_output/", ignore_errors=True)
-    shutil.rmtree(os.path.join(project_path, "model_output/"), ignore_errors=True)
-
-    max_indices = np.argsort(sampler.get_log_prob()[-1, :])[-nsamples:]
-    samples = sampler.get_chain()[
-        -1, max_indices, :
-    ]  # the last iteration, for selected slots
-    gempyor_inference.set_save(True)
-    with multiprocessing.Pool(ncpu) as pool:
-        results = pool.starmap(
-            gempyor_inference.get_logloss_as_single_number,
-            [(samples[i, :],) for i in range(len(max_indices))],
+        # >>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>
+        # @JOSEPH: find below a "cocktail" move proposal
+        moves = [
+            (emcee.moves.DEMove(live_dangerously=True), 0.5 * 0.5 * 0.5),
+            (emcee.moves.DEMove(gamma0=1.0, live_dangerously=True), 0.5 * 0.5 * 0.5),
+            (
+                emcee.moves.DESnookerMove(live_dangerously=True),
+                0.5 * 0.5,
+            ),  # First three moves: DEMove --> DE is good at "optimizing". Moves based on the (really great!) discussion in https://groups.google.com/g/emcee-users/c/FCAq459Y9OE
+            (
+                emcee.moves.StretchMove(live_dangerously=True),
+                0.5,
+            ),  # Stretch gives good chain movement
+            # (emcee.moves.KDEMove(live_dangerously=True, bw_method='scott'), 0.25)
+        ]  # Based on personal experience with pySODM (Tijs) - KDEMove works really well but I think it's important for this one to have at least 3x more walkers than parameters.
+        # >>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>
+        # moves = [(emcee.moves.StretchMove(live_dangerously=True), 1)]
+
+        gempyor_inference.set_silent(False)
+
+        # Each batch of walkers is evaluated by the pool, which recycles its workers
+        # when they grow over their memory limit. Chains resumed from a file without
+        # blobs are continued without them.
+        sampler = emcee.EnsembleSampler(
+            nwalkers,
+            gempyor_inference.inferpar.get_dim(),
+            (
+                pool.log_prob_with_blobs
+                if backend.iteration == 0 or backend.has_blobs()
+                else pool.log_prob
+            ),
+            vectorize=True,
+            backend=backend,
+            moves=moves,
+        )
+        state = sampler.run_mcmc(p0, niter, progress=True, skip_initial_state_check=True)
+        print(f"Done, mean acceptance fraction: {np.mean(sampler.acceptance_fraction):.3f}")
+        if pool.restarts:
+            print(f"Calibration workers were recycled {pool.restarts} time(s)")
+
+        # plotting the chain, read from the file by parameter
+        gempyor.postprocess_inference.plot_chains(
+            inferpar=gempyor_inference.inferpar,
+            chains=backend.view("chain"),
+            llik=backend.get_log_prob(),
+            sampled_slots=None,
+            save_to=f"{run_id}_chains.pdf",
         )
+        print("EMCEE Run done, doing sampling")
+
+        shutil.rmtree("model_output/", ignore_errors=True)
+        shutil.rmtree(os.path.join(project_path, "model_output/"), ignore_errors=True)
+
+        max_indices = np.argsort(backend.get_last("log_prob")[0])[-nsamples:]
+        samples = backend.get_last("chain")[
+            0, max_indices, :
+        ]  # the last iteration, for selected slots
+        backend.close()
+        gempyor_inference.set_save(True)
+        # Only run for its side effect of writing the samples to model_output, the
+        # lliks it returns are not used
+        pool.log_prob(samples)
 
     results = []
     for fn in gempyor.utils.list_filenames(
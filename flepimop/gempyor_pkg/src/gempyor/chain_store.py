@@ -0,0 +1,375 @@
+"""
+An HDF5 store of MCMC chains, written asynchronously in chunks of iterations.
+
+Classes:
+    ChainStore:
+        An `emcee` backend buffering the walkers' positions, log-probabilities and
+        blobs in memory and writing them to an HDF5 file in the background.
+"""
+
+__all__ = ["ChainStore"]
+
+
+import os
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Any
+
+import emcee
+import h5py
+import numpy as np
+
+
+class ChainStore(emcee.backends.Backend):
+    """
+    An HDF5 store of MCMC chains, written asynchronously in chunks of iterations.
+
+    The store is an `emcee` backend, so it can be passed to `emcee.EnsembleSampler`.
+    Iterations are buffered in memory and written every `chunk_iterations`
+    iterations by a background thread, while the sampler carries on, instead of the
+    file being opened and written after every iteration. The datasets are chunked
+    by blocks of iterations and walkers, so that reading the last iterations or a
+    few walkers only reads the chunks holding them.
+
+    The file has the same layout as the file of `emcee.backends.HDFBackend`, so
+    either can read a file written by the other. Blobs are stored alongside the
+    chain, with their names in the `blob_names` attribute of the group.
+
+    Attributes:
+        filename: The path to the HDF5 file.
+        name: The name of the group holding the chains in the file.
+        chunk_iterations: The number of iterations buffered before being written.
+        read_only: If the store can only be read.
+        blob_names: The names of the blob values, or `None` if they are not named.
+
+    Examples:
+        >>> with ChainStore("run_backend.h5", blob_names=["incidCase"]) as store:
+        ...     store.reset(nwalkers, ndim)
+        ...     sampler = emcee.EnsembleSampler(
+        ...         nwalkers, ndim, log_prob, backend=store
+        ...     )
+        ...     sampler.run_mcmc(p0, niter)
+        ...     last_positions = store.get_last("chain", 1)[0]
+    """
+
+    def __init__(
+        self,
+        filename: str | os.PathLike,
+        name: str = "mcmc",
+        chunk_iterations: int = 16,
+        read_only: bool = False,
+        blob_names: list[str] | None = None,
+    ) -> None:
+        """
+        Open a chain store, reading the state of the chains already in the file.
+
+        Args:
+            filename: The path to the HDF5 file.
+            name: The name of the group holding the chains in the file.
+            chunk_iterations: The number of iterations buffered before being
+                written.
+            read_only: If the store can only be read.
+            blob_names: The names of the blob values, written to the file when the
+                chains are reset.
+        """
+        self.filename = filename
+        self.name = name
+        self.chunk_iterations = chunk_iterations
+        self.read_only = read_only
+        self.blob_names = blob_names
+        self.dtype = np.float64
+        self.initialized = False
+        self.blobs_dtype = None
+
+        self._file = None
+        self._executor = None
+        self._pending = None
+        self._buffers = []
+        self._buffered = 0
+
+        if os.path.exists(filename):
+            with h5py.File(filename, "r") as f:
+                if name in f:
+                    self._load(f[name])
+
+    def _load(self, group: h5py.Group) -> None:
+        self.nwalkers = int(group.attrs["nwalkers"])
+        self.ndim = int(group.attrs["ndim"])
+        self.iteration = int(group.attrs["iteration"])
+        self.accepted = group["accepted"][...]
+        self.dtype = group["chain"].dtype
+        if group.attrs["has_blobs"]:
+            self.blobs_dtype = group["blobs"].dtype
+        random_state = [
+            v for k, v in sorted(group.attrs.items()) if k.startswith("random_state_")
+        ]
+        self.random_state = random_state if len(random_state) else None
+        if "blob_names" in group.attrs:
+            self.blob_names = [str(blob_name) for blob_name in group.attrs["blob_names"]]
+        self.initialized = True
+
+    def _group(self) -> h5py.Group:
+        if self._file is None:
+            self._file = h5py.File(self.filename, "r" if self.read_only else "a")
+        return self._file[self.name]
+
+    def _check_writable(self) -> None:
+        if self.read_only:
+            raise RuntimeError(
+                "The chain store has been opened in read-only mode, "
+                "set `read_only = False` to make changes."
+            )
+
+    def _chunks(self, *shape: int) -> tuple[int, ...]:
+        "Chunks of `chunk_iterations` iterations and about 1MB, by blocks of walkers"
+        item_size = np.dtype(self.dtype).itemsize * int(np.prod(shape, dtype=np.int64))
+        walkers = max(1, min(self.nwalkers, 2**20 // (item_size * self.chunk_iterations)))
+        return (self.chunk_iterations, walkers, *shape)
+
+    def reset(self, nwalkers: int, ndim: int) -> None:
+        """
+        Clear the chains and empty the store.
+
+        Args:
+            nwalkers: The size of the ensemble.
+            ndim: The number of dimensions.
+        """
+        self._check_writable()
+        self._wait()
+        self.nwalkers = int(nwalkers)
+        self.ndim = int(ndim)
+        self.iteration = 0
+        self.accepted = np.zeros(self.nwalkers, dtype=self.dtype)
+        self.random_state = None
+        self.blobs_dtype = None
+        self._buffers = []
+        self._buffered = 0
+
+        if self._file is None:
+            self._file = h5py.File(self.filename, "a")
+        if self.name in self._file:
+            del self._file[self.name]
+        group = self._file.create_group(self.name)
+        group.attrs["version"] = emcee.__version__
+        group.attrs["nwalkers"] = self.nwalkers
+        group.attrs["ndim"] = self.ndim
+        group.attrs["has_blobs"] = False
+        group.attrs["iteration"] = 0
+        if self.blob_names is not None:
+            group.attrs["blob_names"] = list(self.blob_names)
+        group.create_dataset("accepted", data=self.accepted)
+        group.create_dataset(
+            "chain",
+            (0, self.nwalkers, self.ndim),
+            maxshape=(None, self.nwalkers, self.ndim),
+            dtype=self.dtype,
+            chunks=self._chunks(self.ndim),
+        )
+        group.create_dataset(
+            "log_prob",
+            (0, self.nwalkers),
+            maxshape=(None, self.nwalkers),
+            dtype=self.dtype,
+            chunks=self._chunks(),
+        )
+        self._file.flush()
+        self.initialized = True
+
+    def has_blobs(self) -> bool:
+        """Returns `True` if the model includes blobs."""
+        return self.blobs_dtype is not None
+
+    def grow(self, ngrow: int, blobs: np.ndarray | None) -> None:
+        """
+        Prepare the store for more iterations.
+
+        The datasets grow as iterations are written, so this only creates the blobs
+        dataset from the first blobs.
+
+        Args:
+            ngrow: The number of iterations to come.
+            blobs: The current blobs, to get the dtype of the blobs from.
+        """
+        self._check_blobs(blobs)
+        if blobs is None or self.has_blobs():
+            return
+        self._check_writable()
+        self._wait()
+        self.blobs_dtype = np.dtype((blobs.dtype, blobs.shape[1:]))
+        group = self._group()
+        group.create_dataset(
+            "blobs",
+            (self.iteration, self.nwalkers),
+            maxshape=(None, self.nwalkers),
+            dtype=self.blobs_dtype,
+            chunks=self._chunks(*blobs.shape[1:])[:2],
+        )
+        group.attrs["has_blobs"] = True
+
+    def save_step(self, state: emcee.State, accepted: np.ndarray) -> None:
+        """
+        Save an iteration to the store.
+
+        Args:
+            state: The state of the ensemble.
+            accepted: If the proposal of each walker was accepted.
+        """
+        self._check(state, accepted)
+        if not self._buffers:
+            self._buffers = [self._new_buffer(), self._new_buffer()]
+        buffer = self._buffers[0]
+        buffer["chain"][self._buffered] = state.coords
+        buffer["log_prob"][self._buffered] = state.log_prob
+        if state.blobs is not None:
+            buffer["blobs"][self._buffered] = state.blobs
+        self._buffered += 1
+        self.accepted += accepted
+        self.random_state = state.random_state
+        self.iteration += 1
+        if self._buffered == self.chunk_iterations:
+            self._write_buffer()
+
+    def _new_buffer(self) -> dict[str, np.ndarray]:
+        buffer = {
+            "chain": np.empty(
+                (self.chunk_iterations, self.nwalkers, self.ndim), dtype=self.dtype
+            ),
+            "log_prob": np.empty((self.chunk_iterations, self.nwalkers), dtype=self.dtype),
+        }
+        if self.has_blobs():
+            buffer["blobs"] = np.empty(
+                (self.chunk_iterations, self.nwalkers), dtype=self.blobs_dtype
+            )
+        return buffer
+
+    def _write_buffer(self) -> None:
+        "Hand the buffered iterations to the background writer"
+        if not self._buffered:
+            return
+        self._check_writable()
+        # The other buffer is free once the previous write is done
+        self._wait()
+        buffer = self._buffers[0]
+        self._buffers.reverse()
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=1)
+        self._pending = self._executor.submit(
+            self._write,
+            buffer,
+            self._buffered,
+            self.iteration,
+            self.accepted.copy(),
+            self.random_state,
+        )
+        self._buffered = 0
+
+    def _write(
+        self,
+        buffer: dict[str, np.ndarray],
+        nbuffered: int,
+        iteration: int,
+        accepted: np.ndarray,
+        random_state: Any,
+    ) -> None:
+        "Write buffered iterations ending at `iteration`, in the background writer"
+        group = self._group()
+        start = iteration - nbuffered
+        for key, values in buffer.items():
+            group[key].resize(iteration, axis=0)
+            group[key][start:iteration] = values[:nbuffered]
+        group["accepted"][...] = accepted
+        if random_state is not None:
+            for i, v in enumerate(random_state):
+                group.attrs[f"random_state_{i}"] = v
+        group.attrs["iteration"] = iteration
+        self._file.flush()
+
+    def _wait(self) -> None:
+        "Wait for the background writer, raising its errors if any"
+        if self._pending is not None:
+            pending, self._pending = self._pending, None
+            pending.result()
+
+    def flush(self) -> None:
+        """Write all the buffered iterations to the file, and wait for it."""
+        self._write_buffer()
+        self._wait()
+
+    def close(self) -> None:
+        """Write all the buffered iterations and close the file."""
+        if not self.read_only:
+            self.flush()
+        else:
+            self._wait()
+        if self._executor is not None:
+            self._executor.shutdown()
+            self._executor = None
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def __exit__(self, exception_type, exception_value, traceback) -> None:
+        self.close()
+
+    def get_value(
+        self, name: str, flat: bool = False, thin: int = 1, discard: int = 0
+    ) -> np.ndarray | None:
+        if self.iteration <= 0:
+            raise AttributeError(
+                "You must run the sampler with 'store == True' before accessing the "
+                "results"
+            )
+        if name == "blobs" and not self.has_blobs():
+            return None
+        v = self.view(name)[discard + thin - 1 : self.iteration : thin]
+        if flat:
+            s = list(v.shape[1:])
+            s[0] = np.prod(v.shape[:2])
+            return v.reshape(s)
+        return v
+
+    def view(self, name: str) -> h5py.Dataset:
+        """
+        Get a lazy view of a stored array, read from the file only where sliced.
+
+        Args:
+            name: The name of the array, one of "chain", "log_prob" or "blobs".
+
+        Returns:
+            The dataset of the array, with the iterations as first dimension and the
+            walkers as second dimension. It should not be modified.
+        """
+        if not self.read_only:
+            self.flush()
+        else:
+            self._wait()
+        return self._group()[name]
+
+    def get_last(self, name: str = "chain", n: int = 1) -> np.ndarray:
+        """
+        Read the last iterations of a stored array.
+
+        Args:
+            name: The name of the array, one of "chain", "log_prob" or "blobs".
+            n: The number of iterations to read.
+
+        Returns:
+            The last `n` iterations of the array, or all of them if there are fewer.
+        """
+        return self.view(name)[max(0, self.iteration - n) : self.iteration]
+
+    def get_walkers(
+        self, walkers: slice | list[int] | np.ndarray, name: str = "chain", discard: int = 0
+    ) -> np.ndarray:
+        """
+        Read the iterations of some of the walkers of a stored array.
+
+        Args:
+            walkers: A slice, or increasing indices, of the walkers to read.
+            name: The name of the array, one of "chain", "log_prob" or "blobs".
+            discard: The number of first iterations to skip.
+
+        Returns:
+            The iterations of the walkers, with the iterations as first dimension and
+            the selected walkers as second dimension.
+        """
+        return self.view(name)[discard : self.iteration, walkers]
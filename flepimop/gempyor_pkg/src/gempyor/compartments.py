@@ -14,9 +14,13 @@ Functions:
     export: Export compartment data to a CSV file.
 """
 
+import hashlib
+import itertools
 import logging
-from functools import reduce
-from typing import Any
+import os
+import pathlib
+from functools import lru_cache, reduce
+from typing import Any, Callable
 
 import numpy as np
 import pandas as pd
@@ -29,6 +33,11 @@ from .shared_cli import config_files_argument, config_file_options, parse_config
 
 logger = logging.getLogger(__name__)
 
+# Version of the transition array files saved by `Compartments.get_transition_array`,
+# to be increased whenever `_build_transition_array` or the file layout change so
+# that files saved by older versions are not loaded
+_TRANSITION_CACHE_VERSION = 1
+
 
 class Compartments:
     """
@@ -45,6 +54,7 @@ class Compartments:
         compartments_config=None,
         compartments_file=None,
         transitions_file=None,
+        cache_dir=None,
     ):
         """
         Initializes a `Compartments` object.
@@ -54,8 +64,12 @@ class Compartments:
             compartments_config: Config file for compartment information.
             compartments_file: File to specify compartment information.
             transitions_file: File to specify transition information.
+            cache_dir: Directory where `get_transition_array` saves and looks up its
+                result, or `None` to only keep it in memory.
         """
         self.times_set = 0
+        self.cache_dir = cache_dir
+        self._transition_array = None
 
         ## Something like this is needed for check script:
         if (not compartments_file is None) and (not transitions_file is None):
@@ -77,6 +91,7 @@ class Compartments:
         """
         self.compartments = self.parse_compartments(seir_config, compartment_config)
         self.transitions = self.parse_transitions(seir_config, False)
+        self._transition_array = None
 
     def __eq__(self, other):
         return (self.transitions == other.transitions).all().all() and (
@@ -501,6 +516,7 @@ class Compartments:
         self.transitions["proportion_exponent"] = self.unformat_proportion_exponent(
             self.transitions["proportion_exponent"], compartment_dimension
         )
+        self._transition_array = None
 
         return
 
@@ -542,6 +558,12 @@ class Compartments:
         """
         Constructs the transition matrix for the model.
 
+        The result is memoized on the object, and when `cache_dir` is set it is also
+        saved there keyed by a hash of the compartments and transitions, so that other
+        processes running the same model (e.g. the jobs of an array) load it instead
+        of rebuilding it. The returned arrays are shared between calls and should
+        not be modified.
+
         Returns:
             tuple[list[str], np.ndarray, np.ndarray, np.ndarray]:
                 - unique_strings: unique strings from `proportion_exponent` and `rate`
@@ -553,158 +575,141 @@ class Compartments:
             ValueError: If term is not found in list of valid compartments.
             ValueErrror: If any string in `rate` or `proportional_to` is an invalid candidate.
         """
+        if self._transition_array is not None:
+            return self._transition_array
         with Timer("SEIR.compartments"):
-            transition_array = np.zeros(
-                (self.transitions.shape[1], self.transitions.shape[0]), dtype="int64"
+            if self.cache_dir is None:
+                self._transition_array = self._build_transition_array()
+                return self._transition_array
+            cache_file = (
+                pathlib.Path(self.cache_dir)
+                / f"transition_array.{self._structure_hash()}.npz"
             )
-            for cit, colname in enumerate(("source", "destination")):
-                for it, elem in enumerate(self.transitions[colname]):
-                    elem = reduce(lambda a, b: a + "_" + b, elem)
-                    rc = -1
-                    for compartment in range(self.compartments.shape[0]):
-                        if self.compartments["name"][compartment] == elem:
-                            rc = compartment
-                    if rc == -1:
-                        raise ValueError(
-                            f"Could not find '{colname}' defined by '{elem}' in '{self.compartments}'."
-                        )
-                    transition_array[cit, it] = rc
-
-            unique_strings = []
-            for x in self.transitions["proportion_exponent"]:
-                for y in x:
-                    candidate = reduce(lambda a, b: a + "*" + b, y)
-                    candidate = candidate.replace(" ", "")
-                    # candidate = candidate.replace("*1", "")
-                    if not candidate in unique_strings:
-                        unique_strings.append(candidate)
-
-            for x in self.transitions["rate"]:
-                candidate = reduce(lambda a, b: a + "*" + b, x)
-                candidate = candidate.replace(" ", "")
-                # candidate = candidate.replace("*1", "")
-                if not candidate in unique_strings:
-                    unique_strings.append(candidate)
-
-            # parenthesis are now supported
-            # assert reduce(lambda a, b: a and b, [(x.find("(") == -1) for x in unique_strings])
-            # assert reduce(lambda a, b: a and b, [(x.find(")") == -1) for x in unique_strings])
-            assert reduce(
-                lambda a, b: a and b, [(x.find("%") == -1) for x in unique_strings]
+            if cache_file.exists():
+                with np.load(cache_file) as bundle:
+                    self._transition_array = (
+                        bundle["unique_strings"].tolist(),
+                        bundle["transition_array"],
+                        bundle["proportion_array"],
+                        bundle["proportion_info"],
+                    )
+                logger.debug("Loaded the transition array from '%s'.", cache_file)
+                return self._transition_array
+            self._transition_array = self._build_transition_array()
+            unique_strings, transition_array, proportion_array, proportion_info = (
+                self._transition_array
+            )
+            # Written under a temporary name and moved in place, so that concurrent
+            # jobs never read a partially written file.
+            cache_file.parent.mkdir(parents=True, exist_ok=True)
+            tmp_file = cache_file.with_name(f"{cache_file.stem}.{os.getpid()}.tmp.npz")
+            np.savez(
+                tmp_file,
+                unique_strings=np.array(unique_strings, dtype=str),
+                transition_array=transition_array,
+                proportion_array=proportion_array,
+                proportion_info=proportion_info,
             )
-            assert reduce(
-                lambda a, b: a and b, [(x.find(" ") == -1) for x in unique_strings]
+            os.replace(tmp_file, cache_file)
+            logger.debug("Saved the transition array to '%s'.", cache_file)
+        return self._transition_array
+
+    def _structure_hash(self) -> str:
+        """
+        Hash the compartments and transitions, the inputs of `get_transition_array`.
+
+        The version of the transition array files is hashed with them, so that a
+        change to how the arrays are built or saved gives new file names.
+
+        Returns:
+            The hexadecimal SHA-256 digest of the compartments, transitions and
+            transition array file version.
+        """
+        structure = repr(
+            (
+                _TRANSITION_CACHE_VERSION,
+                self.compartments.to_dict("list"),
+                self.transitions.to_dict("list"),
             )
+        )
+        return hashlib.sha256(structure.encode()).hexdigest()
+
+    def _build_transition_array(self) -> tuple:
+        """
+        Build the transition arrays returned by `get_transition_array`.
+
+        Compartments and formulas are resolved to their index through dictionaries,
+        so the cost is linear in the number of transitions and compartments.
+        """
+        compartment_index = {
+            name: compartment for compartment, name in enumerate(self.compartments["name"])
+        }
 
-            for it, elem in enumerate(self.transitions["rate"]):
-                candidate = reduce(lambda a, b: a + "*" + b, elem)
-                candidate = candidate.replace(" ", "")
-                # candidate = candidate.replace("*1", "")
-                if candidate not in unique_strings:
+        transition_array = np.zeros(
+            (self.transitions.shape[1], self.transitions.shape[0]), dtype="int64"
+        )
+        for cit, colname in enumerate(("source", "destination")):
+            for it, elem in enumerate(self.transitions[colname]):
+                elem = reduce(lambda a, b: a + "_" + b, elem)
+                if elem not in compartment_index:
                     raise ValueError(
-                        f"Candidate '{candidate}' from 'rate' column is not in the list of unique strings: {unique_strings}."
-                    )
-                rc = [it for it, x in enumerate(unique_strings) if x == candidate][0]
-                transition_array[2][it] = rc
-
-            current_proportion_start = 0
-            for it, elem in enumerate(self.transitions["proportional_to"]):
-                transition_array[3][it] = current_proportion_start
-                transition_array[4][it] = current_proportion_start + len(elem)
-                current_proportion_start += len(elem)
-
-            proportion_info = np.zeros((3, transition_array[4].max()), dtype="int64")
-            current_proportion_sum_start = 0
-            current_proportion_sum_it = 0
-            for it, elem in enumerate(self.transitions["proportional_to"]):
-                for it2, elem2 in enumerate(elem):
-                    elem_tmp = [
-                        w
-                        for w in pd.DataFrame(index=pd.MultiIndex.from_product(elem2))
-                        .reset_index()
-                        .apply(lambda z: reduce(lambda x, y: f"{x}_{y}", z), axis=1)
-                    ]
-
-                    # for it3, elem3 in enumerate(elem_tmp):
-                    #     rc = -1
-                    #     for compartment in range(self.compartments.shape[0]):
-                    #         if self.compartments["name"][compartment] == elem3:
-                    #             rc = compartment
-                    #     if rc == -1:
-                    #         raise ValueError(f"Could not find match for {elem3} in compartments")
-                    proportion_info[0][
-                        current_proportion_sum_it
-                    ] = current_proportion_sum_start
-                    proportion_info[1][current_proportion_sum_it] = (
-                        current_proportion_sum_start + len(elem_tmp)
+                        f"Could not find '{colname}' defined by '{elem}' in '{self.compartments}'."
                     )
-                    current_proportion_sum_it += 1
-                    current_proportion_sum_start += len(elem_tmp)
-            proportion_compartment_index = 0
-            for it, elem in enumerate(self.transitions["proportion_exponent"]):
-                for y in elem:
-                    candidate = reduce(lambda a, b: a + "*" + b, y)
-                    candidate = candidate.replace(" ", "")
-                    # candidate = candidate.replace("*1", "")
-                    if candidate not in unique_strings:
+                transition_array[cit, it] = compartment_index[elem]
+
+        def formula(elem):
+            return reduce(lambda a, b: a + "*" + b, elem).replace(" ", "")
+
+        unique_string_index = {}
+        for x in self.transitions["proportion_exponent"]:
+            for y in x:
+                unique_string_index.setdefault(formula(y), len(unique_string_index))
+        for x in self.transitions["rate"]:
+            unique_string_index.setdefault(formula(x), len(unique_string_index))
+        unique_strings = list(unique_string_index)
+
+        # parenthesis are now supported
+        assert all(x.find("%") == -1 for x in unique_strings)
+        assert all(x.find(" ") == -1 for x in unique_strings)
+
+        for it, elem in enumerate(self.transitions["rate"]):
+            transition_array[2][it] = unique_string_index[formula(elem)]
+
+        current_proportion_start = 0
+        for it, elem in enumerate(self.transitions["proportional_to"]):
+            transition_array[3][it] = current_proportion_start
+            transition_array[4][it] = current_proportion_start + len(elem)
+            current_proportion_start += len(elem)
+
+        # Each proportional_to term sums over the product of its compartment attributes
+        proportion_info = np.zeros((3, transition_array[4].max()), dtype="int64")
+        proportion_compartments = []
+        current_proportion_sum_it = 0
+        for elem in self.transitions["proportional_to"]:
+            for elem2 in elem:
+                proportion_info[0][current_proportion_sum_it] = len(proportion_compartments)
+                for names in itertools.product(*elem2):
+                    elem3 = reduce(lambda x, y: f"{x}_{y}", names)
+                    if elem3 not in compartment_index:
                         raise ValueError(
-                            f"Proportion exponent '{candidate}' is not found in the list of unique strings: '{unique_strings}'."
+                            f"Could not find `proportional_to` '{elem3}' in compartments. "
+                            f"Available compartments: '{self.compartments}'."
                         )
-                    rc = [it for it, x in enumerate(unique_strings) if x == candidate][0]
-                    proportion_info[2][proportion_compartment_index] = rc
-                    proportion_compartment_index += 1
-
-            assert proportion_compartment_index == current_proportion_sum_it
-
-            proportion_array = np.zeros((current_proportion_sum_start), dtype="int64")
-
-            proportion_index = 0
-            for it, elem in enumerate(self.transitions["proportional_to"]):
-                for it2, elem2 in enumerate(elem):
-                    elem_tmp = [
-                        w
-                        for w in pd.DataFrame(index=pd.MultiIndex.from_product(elem2))
-                        .reset_index()
-                        .apply(lambda z: reduce(lambda x, y: f"{x}_{y}", z), axis=1)
-                    ]
-
-                    for it3, elem3 in enumerate(elem_tmp):
-                        rc = -1
-                        for compartment in range(self.compartments.shape[0]):
-                            if self.compartments["name"][compartment] == elem3:
-                                rc = compartment
-                        if rc == -1:
-                            raise ValueError(
-                                f"Could not find `proportional_to` '{elem3}' in compartments. "
-                                f"Available compartments: '{self.compartments}'."
-                            )
+                    proportion_compartments.append(compartment_index[elem3])
+                proportion_info[1][current_proportion_sum_it] = len(proportion_compartments)
+                current_proportion_sum_it += 1
+
+        proportion_compartment_index = 0
+        for elem in self.transitions["proportion_exponent"]:
+            for y in elem:
+                proportion_info[2][proportion_compartment_index] = unique_string_index[
+                    formula(y)
+                ]
+                proportion_compartment_index += 1
+
+        assert proportion_compartment_index == current_proportion_sum_it
 
-                        proportion_array[proportion_index] = rc
-                        proportion_index += 1
-
-            ## This will need to be reworked to deal with the summing bit
-            ## There will be changes needed in the steps_source too
-            ## They are doable though
-            # for it, elem in enumerate(self.transitions['proportional_to']):
-            #     elem = [y for y in map(
-            #         lambda x: reduce(
-            #             lambda a, b: str(a) + "_" + str(b),
-            #             map(
-            #                 lambda x: reduce(
-            #                     lambda a, b: str(a) + "+" + str(b),
-            #                     as_list(x)
-            #                 ),
-            #                 x
-            #             )
-            #         ),
-            #         elem
-            #     )]
-            #     for it2, elem2 in enumerate(elem):
-            #         rc = -1
-            #         for compartment in range(self.compartments.shape[0]):
-            #             if self.compartments["name"][compartment] == elem2:
-            #                 rc = compartment
-            #         proportion_array[it]
+        proportion_array = np.array(proportion_compartments, dtype="int64")
 
         return (
             unique_strings,
@@ -740,56 +745,24 @@ class Compartments:
     def parse_parameter_strings_to_numpy_arrays_v2(
         self, parameters, parameter_names, string_list
     ):
-        # is using eval a better way ???
-        import sympy as sp
-
         # Validate input lengths
         if len(parameters) != len(parameter_names):
             raise ValueError(
                 "Number of parameter values does not match the number of parameter names."
             )
 
-        # Define the symbols used in the formulas
-        symbolic_parameters_namespace = {name: sp.symbols(name) for name in parameter_names}
-
-        symbolic_parameters = [sp.symbols(name) for name in parameter_names]
-
-        parsed_formulas = []
-        for formula in string_list:
-            try:
-                # here it is very important to pass locals so that e.g if the  gamma parameter
-                # is defined, it is not converted into the gamma scipy function
-                f = sp.sympify(formula, locals=symbolic_parameters_namespace)
-                parsed_formulas.append(f)
-            except Exception as e:
-                print(
-                    f"Cannot parse formula '{formula}' from parameters: '{parameter_names}'."
-                )
-                raise (e)  # Print the error message for debugging
-
-        # the list order needs to be right.
-        parameter_values = {
-            param: value for param, value in zip(symbolic_parameters, parameters)
-        }
-        parameter_values_list = [parameter_values[param] for param in symbolic_parameters]
-
-        # Create a lambdify function for substitution
-        substitution_function = sp.lambdify(symbolic_parameters, parsed_formulas)
-
-        # Apply the lambdify function with parameter values as a list
-        substituted_formulas = substitution_function(*parameter_values_list)
-        for i in range(len(substituted_formulas)):
-            # sometime it's "1" or "1*1*1*..." which produce an int or float instead of an array
-            # in this case we find the next array and set it to that size,
-            # TODO: instead of searching for the next array, better to just use the parameter shape.
-            if not isinstance(substituted_formulas[i], np.ndarray):
-                for k in range(len(substituted_formulas)):
-                    if isinstance(substituted_formulas[k], np.ndarray):
-                        substituted_formulas[i] = substituted_formulas[i] * np.ones_like(
-                            substituted_formulas[k]
-                        )
+        # The formulas are only parsed the first time they are seen in this process
+        evaluate_formulas = _compile_parameter_formulas(
+            tuple(str(name) for name in parameter_names),
+            tuple(str(formula) for formula in string_list),
+        )
 
-        return np.array(substituted_formulas)
+        # Formulas like "1" or "1*1*1*..." evaluate to a scalar, which is broadcast
+        # to the shape of the parameters when assigned.
+        parsed_parameters = np.empty((len(string_list), *np.shape(parameters)[1:]))
+        for i, value in enumerate(evaluate_formulas(*parameters)):
+            parsed_parameters[i] = value
+        return parsed_parameters
 
     def parse_parameter_strings_to_numpy_arrays(
         self,
@@ -922,6 +895,58 @@ class Compartments:
         src.render(output_file)
 
 
+@lru_cache(maxsize=None)
+def _compile_parameter_formulas(
+    parameter_names: tuple[str, ...], formulas: tuple[str, ...]
+) -> Callable[..., list]:
+    """
+    Compile parameter formulas into a vectorized numpy function.
+
+    The symbolic parsing is cached per process, so evaluating the formulas of a model
+    for a new draw of its parameters, once per slot or per proposal, only costs the
+    array arithmetic. The cache is kept out of `Compartments` so that it stays
+    picklable.
+
+    Args:
+        parameter_names: The names of the parameters the formulas can refer to, in the
+            order the compiled function takes their values.
+        formulas: The formulas to compile, such as the `unique_strings` returned by
+            `Compartments.get_transition_array`.
+
+    Returns:
+        A function taking the value of each parameter and returning a list with the
+        value of each formula. Formulas that do not depend on any parameter evaluate
+        to a scalar.
+
+    Examples:
+        >>> import numpy as np
+        >>> from gempyor.compartments import _compile_parameter_formulas
+        >>> evaluate = _compile_parameter_formulas(("gamma", "R0"), ("R0 * gamma", "1"))
+        >>> evaluate(np.array([0.2, 0.25]), np.array([2.0, 3.0]))
+        [array([0.4 , 0.75]), 1]
+    """
+    import sympy as sp
+
+    symbolic_parameters = [sp.symbols(name) for name in parameter_names]
+    # here it is very important to pass locals so that e.g if the gamma parameter
+    # is defined, it is not converted into the gamma scipy function
+    symbolic_parameters_namespace = dict(zip(parameter_names, symbolic_parameters))
+
+    parsed_formulas = []
+    for formula in formulas:
+        try:
+            parsed_formulas.append(
+                sp.sympify(formula, locals=symbolic_parameters_namespace)
+            )
+        except Exception as e:
+            print(
+                f"Cannot parse formula '{formula}' from parameters: '{list(parameter_names)}'."
+            )
+            raise (e)  # Print the error message for debugging
+
+    return sp.lambdify(symbolic_parameters, parsed_formulas, modules="numpy", cse=True)
+
+
 def get_list_dimension(thing: Any) -> int:
     """
     Returns the dimension of a given object.
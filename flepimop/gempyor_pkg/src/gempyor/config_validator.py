@@ -142,8 +142,20 @@ class SeedingConfig(BaseModel):
 
 
 class IntegrationConfig(BaseModel):
-    method: Literal["rk4", "rk4.jit", "best.current", "euler", "stochastic"] = "rk4"
+    method: Literal[
+        "rk4",
+        "rk4.jit",
+        "rk4.parallel",
+        "rk45",
+        "rk45.parallel",
+        "best.current",
+        "euler",
+        "euler.parallel",
+        "stochastic",
+    ] = "rk4"
     dt: float = 2.0
+    rtol: float = 1e-6
+    atol: float = 1e-3
 
 
 class ValueConfig(BaseModel):
@@ -215,12 +227,19 @@ class TransitionConfig(BaseModel):
     proportional_to: List[str]
 
 
+class SeirOutputConfig(BaseModel):
+    compression: Optional[str] = None
+    row_group_size: Optional[int] = None
+
+
 class SeirConfig(BaseModel):
     integration: IntegrationConfig  # is this Optional?
     parameters: Dict[
         str, SeirParameterConfig
     ]  # there was a previous issue that gempyor doesn't work if there are no parameters (eg if just numbers are used in the transitions) - do we want to get around this?
     transitions: List[TransitionConfig]
+    transition_cache_dir: Optional[str] = None
+    output: Optional[SeirOutputConfig] = None
 
 
 class SinglePeriodModifierConfig(BaseModel):
@@ -304,11 +323,21 @@ class SourceConfig(
     #     return source_names  # Access keys using a loop
 
 
+class DelayKernelConfig(BaseModel):
+    distribution: Literal["gamma", "lognormal"]
+    shape: Optional[float] = None  # gamma only
+    sdlog: Optional[float] = None  # lognormal only
+
+
+class DelayParameterConfig(BaseParameterConfig):
+    kernel: Optional[DelayKernelConfig] = None
+
+
 class DelayFrameConfig(BaseModel):
     source: Optional[SourceConfig] = None
     probability: Optional[BaseParameterConfig] = None
-    delay: Optional[BaseParameterConfig] = None
-    duration: Optional[BaseParameterConfig] = None
+    delay: Optional[DelayParameterConfig] = None
+    duration: Optional[DelayParameterConfig] = None
     sum: Optional[List[str]] = None  # only for sums of other outcomes
 
     # @validator("sum")
@@ -34,12 +34,13 @@ Functions:
 
 import os
 import logging
-import copy
+from collections.abc import Mapping
 import multiprocessing as mp
 from concurrent.futures import ProcessPoolExecutor
 
 import numpy as np
 import pandas as pd
+import pyarrow as pa
 import pyarrow.parquet as pq
 import xarray as xr
 import numba as nb
@@ -47,7 +48,7 @@ import numba as nb
 from typing import Literal
 
 from . import seir, model_info
-from . import outcomes, file_paths
+from . import outcomes, file_paths, NPI
 from .utils import config, Timer, read_df, as_list
 
 
@@ -62,11 +63,62 @@ handler.setFormatter(formatter)
 # so it is saved by emcee, so I can build a posterio
 
 
+def _same_block(a, b) -> bool:
+    """Compare two SEIR input blocks, either arrays or mappings of arrays."""
+    if isinstance(a, Mapping):
+        return (
+            isinstance(b, Mapping)
+            and a.keys() == b.keys()
+            and all(_same_block(a[k], b[k]) for k in a)
+        )
+    return np.array_equal(a, b)
+
+
+def _lookup_seir_states(
+    cache: list[tuple[dict, xr.Dataset]], inputs: dict
+) -> xr.Dataset | None:
+    """
+    Find the SEIR states of a recent simulation that had the same SEIR inputs.
+
+    Proposals that only change outcome parameters or outcome modifiers leave the
+    SEIR inputs untouched, so their SEIR states can be reused instead of integrating
+    the model again.
+
+    Args:
+        cache: The `(inputs, states)` pairs of recent simulations, most recent last.
+            A hit is moved to the end.
+        inputs: The SEIR input blocks of the simulation to run, by name.
+
+    Returns:
+        The cached SEIR states, or `None` if every cached simulation differs from
+        `inputs` in at least one block.
+    """
+    for i, (cached_inputs, states) in enumerate(cache):
+        changed = [
+            name
+            for name, block in inputs.items()
+            if not _same_block(cached_inputs[name], block)
+        ]
+        if not changed:
+            cache.append(cache.pop(i))
+            return states
+        logging.debug(f"SEIR inputs changed since a cached simulation: {changed}")
+    return None
+
+
+def _store_seir_states(
+    cache: list[tuple[dict, xr.Dataset]], inputs: dict, states: xr.Dataset, size: int
+) -> None:
+    """Add a simulation to a SEIR states cache, keeping the `size` most recent."""
+    cache.append((inputs, states))
+    del cache[: max(len(cache) - size, 0)]
+
+
 # TODO: there is way to many of these functions, merge with the R inference.py implementation to avoid code duplication
 def simulation_atomic(
     *,
-    snpi_df_in,
-    hnpi_df_in,
+    snpi_df_in=None,
+    hnpi_df_in=None,
     modinf: model_info.ModelInfo,
     p_draw,
     unique_strings,
@@ -77,17 +129,32 @@ def simulation_atomic(
     seeding_data,
     seeding_amounts,
     outcomes_parameters,
+    npi_seir=None,
+    npi_outcomes=None,
     save=False,
+    as_array=False,
+    seir_cache=None,
+    seir_cache_size=1,
 ):
+    # `seir_cache` is the SEIR states cache of the caller, for this `modinf` only: the
+    # cached inputs leave out the model structure, so it must not be shared between
+    # models. Without it, the SEIR simulation always runs.
+
     # We need to reseed because subprocess inherit of the same random generator state.
     np.random.seed(int.from_bytes(os.urandom(4), byteorder="little"))
     random_id = np.random.randint(0, 1e8)
 
-    npi_seir = seir.build_npi_SEIR(
-        modinf=modinf, load_ID=False, sim_id2load=None, config=config, bypass_DF=snpi_df_in
-    )
+    # Modifiers are rebuilt from the modifier tables, unless already built
+    if npi_seir is None:
+        npi_seir = seir.build_npi_SEIR(
+            modinf=modinf,
+            load_ID=False,
+            sim_id2load=None,
+            config=config,
+            bypass_DF=snpi_df_in,
+        )
 
-    if modinf.npi_config_outcomes:
+    if npi_outcomes is None and modinf.npi_config_outcomes:
         npi_outcomes = outcomes.build_outcome_modifiers(
             modinf=modinf,
             load_ID=False,
@@ -95,8 +162,6 @@ def simulation_atomic(
             config=config,
             bypass_DF=hnpi_df_in,
         )
-    else:
-        npi_outcomes = None
 
     # reduce them
     parameters = modinf.parameters.parameters_reduce(p_draw, npi_seir)
@@ -113,23 +178,34 @@ def simulation_atomic(
     for k, v in seeding_data.items():
         seeding_data_nbdict[k] = np.array(v, dtype=np.int64)
 
-    # Compute the SEIR simulation
-    states = seir.steps_SEIR(
-        modinf,
-        parsed_parameters,
-        transition_array,
-        proportion_array,
-        proportion_info,
-        initial_conditions,
-        seeding_data_nbdict,
-        seeding_amounts,
-    )
+    # Compute the SEIR simulation, unless only outcome inputs changed since the last one
+    seir_inputs = {
+        "parameters": parameters,
+        "initial_conditions": initial_conditions,
+        "seeding_data": seeding_data_nbdict,
+        "seeding_amounts": seeding_amounts,
+    }
+    reusable = seir_cache is not None and modinf.get_engine() != "stochastic"
+    states = _lookup_seir_states(seir_cache, seir_inputs) if reusable else None
+    if states is None:
+        states = seir.steps_SEIR(
+            modinf,
+            parsed_parameters,
+            transition_array,
+            proportion_array,
+            proportion_info,
+            initial_conditions,
+            seeding_data_nbdict,
+            seeding_amounts,
+        )
+        if reusable:
+            _store_seir_states(seir_cache, seir_inputs, states, seir_cache_size)
     if save:
         seir.write_spar_snpi(sim_id=random_id, modinf=modinf, p_draw=p_draw, npi=npi_seir)
         seir.write_seir(sim_id=random_id, modinf=modinf, states=states)
 
     # Compute outcomes
-    outcomes_df, hpar_df = outcomes.compute_all_multioutcomes(
+    outcomes_array, hpar_df = outcomes.compute_all_multioutcomes_array(
         modinf=modinf,
         sim_id2write=0,
         parameters=outcomes_parameters,
@@ -137,14 +213,18 @@ def simulation_atomic(
         npi=npi_outcomes,
         bypass_seir_xr=states,
     )
-    outcomes_df, hpar, hnpi = outcomes.postprocess_and_write(
-        sim_id=random_id,
-        modinf=modinf,
-        outcomes_df=outcomes_df,
-        hpar=hpar_df,
-        npi=npi_outcomes,
-        write=save,
-    )
+    # The long table is only built when it is written or asked for
+    if save or not as_array:
+        outcomes_df, hpar, hnpi = outcomes.postprocess_and_write(
+            sim_id=random_id,
+            modinf=modinf,
+            outcomes_df=outcomes.dataframe_from_outcomes_array(outcomes_array),
+            hpar=hpar_df,
+            npi=npi_outcomes,
+            write=save,
+        )
+    if as_array:
+        return outcomes_array
     # needs to be after write... because parquet write discard the index.
     outcomes_df = outcomes_df.set_index("date")  # after writing
 
@@ -168,7 +248,7 @@ def get_static_arguments(modinf: model_info.ModelInfo):
         proportion_info,
     ) = modinf.compartments.get_transition_array()
 
-    outcomes_parameters = outcomes.read_parameters_from_config(modinf)
+    outcomes_parameters = outcomes.OutcomePlan.from_model_info(modinf)
     npi_seir = (
         seir.build_npi_SEIR(modinf=modinf, load_ID=False, sim_id2load=None, config=config)
         if modinf.npi_config_seir is not None
@@ -260,6 +340,18 @@ def get_static_arguments(modinf: model_info.ModelInfo):
 
     # need to convert to numba dict to python dict so it is pickable
     seeding_data = dict(seeding_data)
+    # The static arguments are shared, not copied, by all the simulations of an
+    # inference, so their arrays are made read-only
+    for value in (
+        p_draw,
+        transition_array,
+        proportion_array,
+        proportion_info,
+        initial_conditions,
+        seeding_amounts,
+        *seeding_data.values(),
+    ):
+        value.setflags(write=False)
     static_sim_arguments = {
         "snpi_df_ref": snpi_df_ref,
         "hnpi_df_ref": hnpi_df_ref,
@@ -353,7 +445,15 @@ class GempyorInference:
         modinf: A `ModelInfo` object.
         already_built: Flag to determine if necessary objects have been built.
         autowrite_seir: Flag to automatically write SEIR data after simulation.
+        seir_cache_size: Number of recent SEIR simulations kept in `seir_cache`.
+        seir_cache: The `(inputs, states)` pairs of recent SEIR simulations, reused by
+            `one_simulation` and `simulate_proposal` when the SEIR inputs of a
+            simulation are unchanged.
         static_sim_arguments: Dictionary containing static simulation arguments.
+        compiled_npi_seir: The seir modifiers of the static simulation, compiled so
+            that proposals are injected into them without rebuilding them.
+        compiled_npi_outcomes: The outcome modifiers of the static simulation,
+            compiled likewise.
         do_inference: Flag to determine if model should be run with inference.
         silent: Flag indicating whether to supress output messaging.
         save: Flag indicating whether simulation results should be saved.
@@ -374,6 +474,7 @@ class GempyorInference:
         out_prefix=None,  # if out_prefix is different from in_prefix, fill this
         path_prefix: str = "",  # in case the data folder is on another directory
         autowrite_seir: bool = False,
+        seir_cache_size: int = 2,
     ):
         """
         Initializes the `GempyorInference` object by loading config, setting up the model, and configuring inference parameters.
@@ -392,6 +493,9 @@ class GempyorInference:
             out_prefix: Prefix for file paths to output.
             path_prefix: Prefix for paths to files (in case data folder is in another directory)
             autowrite_seir: Flag to automatically write SEIR data after simulation, default is False.
+            seir_cache_size: Number of recent SEIR simulations whose states are kept to
+                be reused by proposals that only change outcome inputs, default is 2 to
+                cover both the last accepted and the last rejected proposal.
         """
         # Config prep
         config.clear()
@@ -455,9 +559,13 @@ class GempyorInference:
 
         self.already_built = False  # whether we have already built the costly objects that need just one build
         self.autowrite_seir = autowrite_seir
+        self.seir_cache_size = seir_cache_size
+        self.seir_cache = []
 
         ## Inference Stuff
         self.static_sim_arguments = None
+        self.compiled_npi_seir = None
+        self.compiled_npi_outcomes = None
         self.do_inference = False
         if config["inference"].exists():
             from . import inference_parameter, logloss
@@ -471,6 +579,34 @@ class GempyorInference:
                     global_config=config,
                     subpop_names=self.modinf.subpop_struct.subpop_names,
                 )
+                # Proposals only change modifier values, so the modifiers are built once
+                if self.modinf.npi_config_seir is not None:
+                    self.compiled_npi_seir = NPI.CompiledModifier(
+                        seir.build_npi_SEIR(
+                            modinf=self.modinf,
+                            load_ID=False,
+                            sim_id2load=None,
+                            config=config,
+                            bypass_DF=self.static_sim_arguments["snpi_df_ref"].copy(),
+                        )
+                    )
+                if self.modinf.npi_config_outcomes:
+                    self.compiled_npi_outcomes = NPI.CompiledModifier(
+                        outcomes.build_outcome_modifiers(
+                            modinf=self.modinf,
+                            load_ID=False,
+                            sim_id2load=None,
+                            config=config,
+                            bypass_DF=self.static_sim_arguments["hnpi_df_ref"].copy(),
+                        )
+                    )
+                # Fail early on inferred modifier values that proposals cannot change
+                for ptype, compiled_npi in (
+                    ("seir_modifiers", self.compiled_npi_seir),
+                    ("outcome_modifiers", self.compiled_npi_outcomes),
+                ):
+                    if compiled_npi is not None:
+                        self.inferpar.get_modifier_slots(ptype, compiled_npi)
                 self.logloss = logloss.LogLoss(
                     inference_config=config["inference"],
                     path_prefix=path_prefix,
@@ -502,25 +638,51 @@ class GempyorInference:
             self.save,
         ]
 
-    def simulate_proposal(self, proposal):
+    def _simulation_arguments(self, **overlay) -> dict:
+        """
+        Assemble the arguments of `simulation_atomic` for one simulation.
+
+        The static simulation arguments are read-only, so they are passed by reference
+        instead of being copied for each simulation.
+
+        Args:
+            **overlay: The arguments that are specific to this simulation.
+
+        Returns:
+            The static simulation arguments, without the reference modifier tables,
+            updated with `overlay`.
+        """
+        sim_arguments = {
+            key: value
+            for key, value in self.static_sim_arguments.items()
+            if key not in ("snpi_df_ref", "hnpi_df_ref")
+        }
+        sim_arguments.update(overlay)
+        return sim_arguments
+
+    def simulate_proposal(self, proposal, as_array=False):
         if not self.inferpar.check_in_bound(proposal=proposal):
             if not self.silent:
                 print("`llik` is -inf (out of bound proposal).")
             return -np.inf, -np.inf, -np.inf
 
-        snpi_df_mod, hnpi_df_mod = self.inferpar.inject_proposal(
+        self.inferpar.inject_proposal_into_modifiers(
             proposal=proposal,
-            snpi_df=self.static_sim_arguments["snpi_df_ref"],
-            hnpi_df=self.static_sim_arguments["hnpi_df_ref"],
+            npi_seir=self.compiled_npi_seir,
+            npi_outcomes=self.compiled_npi_outcomes,
         )
 
-        ss = copy.deepcopy(self.static_sim_arguments)
-        ss["snpi_df_in"] = snpi_df_mod
-        ss["hnpi_df_in"] = hnpi_df_mod
-        del ss["snpi_df_ref"]
-        del ss["hnpi_df_ref"]
-
-        outcomes_df = simulation_atomic(**ss, modinf=self.modinf, save=self.save)
+        outcomes_df = simulation_atomic(
+            **self._simulation_arguments(
+                npi_seir=self.compiled_npi_seir,
+                npi_outcomes=self.compiled_npi_outcomes,
+            ),
+            modinf=self.modinf,
+            save=self.save,
+            as_array=as_array,
+            seir_cache=self.seir_cache,
+            seir_cache_size=self.seir_cache_size,
+        )
 
         return outcomes_df
 
@@ -530,10 +692,10 @@ class GempyorInference:
                 print("OUT OF BOUND!!")
             return -np.inf, -np.inf, -np.inf
 
-        outcomes_df = self.simulate_proposal(proposal=proposal)
+        outcomes_array = self.simulate_proposal(proposal=proposal, as_array=True)
 
         ll_total, logloss, regularizations = self.logloss.compute_logloss(
-            model_df=outcomes_df, subpop_names=self.modinf.subpop_struct.subpop_names
+            model_df=outcomes_array, subpop_names=self.modinf.subpop_struct.subpop_names
         )
         if not self.silent:
             print(f"llik is '{ll_total}' ")
@@ -544,14 +706,29 @@ class GempyorInference:
         ll_total, logloss, regularizations = self.get_logloss(proposal)
         return ll_total
 
-    def perform_test_run(self):
-        ss = copy.deepcopy(self.static_sim_arguments)
+    def get_logloss_with_statistics(self, proposal):
+        """
+        Compute the logloss of a proposal, with the log-likelihood of each statistic.
+
+        Args:
+            proposal: The proposal to evaluate.
 
-        ss["snpi_df_in"] = ss["snpi_df_ref"]
-        ss["hnpi_df_in"] = ss["hnpi_df_ref"]
-        # delete the ref
-        del ss["snpi_df_ref"]
-        del ss["hnpi_df_ref"]
+        Returns:
+            The total logloss, and the log-likelihood of each statistic summed over
+            the subpops, in the order of `logloss.statistics`. These are `-inf` for
+            an out of bound proposal.
+        """
+        ll_total, logloss, regularizations = self.get_logloss(proposal)
+        if np.isneginf(ll_total):
+            return ll_total, np.full(len(self.logloss.statistics), -np.inf)
+        return ll_total, logloss.sum("subpop").values
+
+    def perform_test_run(self):
+        # Building the modifiers from the tables modifies them, so they are copied
+        ss = self._simulation_arguments(
+            snpi_df_in=self.static_sim_arguments["snpi_df_ref"].copy(),
+            hnpi_df_in=self.static_sim_arguments["hnpi_df_ref"].copy(),
+        )
 
         hosp = simulation_atomic(**ss, modinf=self.modinf)
 
@@ -613,11 +790,20 @@ class GempyorInference:
         ) = self.modinf.compartments.get_transition_array()
         self.already_built = True
 
-    def write_last_seir(self, sim_id2write=None):
+    def write_last_seir(self, sim_id2write=None) -> pa.Table:
+        """
+        Write the `.seir.` output of the last simulation.
+
+        Args:
+            sim_id2write: The simulation ID to write, the one of the last simulation
+                by default.
+
+        Returns:
+            The written Arrow table, as returned by `seir.write_seir`.
+        """
         if sim_id2write is None:
             sim_id2write = self.lastsim_sim_id2write
-        out_df = seir.write_seir(sim_id2write, self.modinf, self.lastsim_states)
-        return out_df
+        return seir.write_seir(sim_id2write, self.modinf, self.lastsim_states)
 
     # @profile()
     def one_simulation(
@@ -654,7 +840,7 @@ class GempyorInference:
             f">>> GEMPYOR onesim {'(loading file)' if load_ID else '(from config)'}"
         ):
             if not self.already_built and self.modinf.outcomes_config is not None:
-                self.outcomes_parameters = outcomes.read_parameters_from_config(self.modinf)
+                self.outcomes_parameters = outcomes.OutcomePlan.from_model_info(self.modinf)
 
             npi_outcomes = None
             npi_seir = None
@@ -767,24 +953,42 @@ class GempyorInference:
                 self.lastsim_initial_conditions = initial_conditions
 
             with Timer("SEIR.compute"):
-                states = seir.steps_SEIR(
-                    self.modinf,
-                    parsed_parameters,
-                    self.transition_array,
-                    self.proportion_array,
-                    self.proportion_info,
-                    initial_conditions,
-                    seeding_data,
-                    seeding_amounts,
+                # Proposals that only change outcome inputs reuse the SEIR states
+                seir_inputs = {
+                    "parameters": parameters,
+                    "initial_conditions": initial_conditions,
+                    "seeding_data": seeding_data,
+                    "seeding_amounts": seeding_amounts,
+                }
+                reusable = self.modinf.get_engine() != "stochastic"
+                states = (
+                    _lookup_seir_states(self.seir_cache, seir_inputs) if reusable else None
                 )
+                if states is None:
+                    states = seir.steps_SEIR(
+                        self.modinf,
+                        parsed_parameters,
+                        self.transition_array,
+                        self.proportion_array,
+                        self.proportion_info,
+                        initial_conditions,
+                        seeding_data,
+                        seeding_amounts,
+                    )
+                    if reusable:
+                        _store_seir_states(
+                            self.seir_cache, seir_inputs, states, self.seir_cache_size
+                        )
                 self.lastsim_states = states
 
             with Timer("SEIR.postprocess"):
                 if self.modinf.write_csv or self.modinf.write_parquet:
                     seir.write_spar_snpi(sim_id2write, self.modinf, p_draw, npi_seir)
                     if self.autowrite_seir:
-                        out_df = seir.write_seir(sim_id2write, self.modinf, states)
-                        self.lastsim_out_df = out_df
+                        # The written Arrow table, see `seir.write_seir`
+                        self.lastsim_out_df = seir.write_seir(
+                            sim_id2write, self.modinf, states
+                        )
 
             loaded_values = None
             if load_ID:
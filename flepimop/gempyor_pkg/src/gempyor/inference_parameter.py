@@ -26,6 +26,7 @@ class InferenceParameters:
         self.pdists = []
         self.ubs = []
         self.lbs = []
+        self._modifier_slots = {}
         self.build_from_config(global_config, subpop_names)
 
     def add_modifier(self, pname, ptype, parameter_config, subpops):
@@ -262,3 +263,71 @@ class InferenceParameters:
                     "value",
                 ] = proposal[p_idx]
         return snpi_df_mod, hnpi_df_mod
+
+    def get_modifier_slots(
+        self, ptype: str, modifiers: NPI.CompiledModifier
+    ) -> tuple[np.ndarray, np.ndarray]:
+        """
+        Finds where the parameters of a type are in compiled modifiers.
+
+        Args:
+            ptype (str): The parameter type, 'seir_modifiers' or 'outcome_modifiers'.
+            modifiers (NPI.CompiledModifier): The compiled modifiers for this type.
+
+        Returns:
+            np.ndarray, np.ndarray: The indices of the parameters in a proposal and
+            their slots in `modifiers`. Parameters of modifiers that are not part of
+            `modifiers` are left out, as `inject_proposal` leaves them out.
+
+        Raises:
+            ValueError: If a parameter is a value of a modifier that cannot be
+                compiled, as the proposal could not change it.
+        """
+        p_indices, slots = [], []
+        for p_idx in range(self.get_dim()):
+            if self.ptypes[p_idx] == ptype:
+                slot = modifiers.slot(self.pnames[p_idx], self.subpops[p_idx])
+                if slot is None and modifiers.is_opaque(
+                    self.pnames[p_idx], self.subpops[p_idx]
+                ):
+                    raise ValueError(
+                        f"The {ptype} parameter '{self.pnames[p_idx]}' of subpop "
+                        f"'{self.subpops[p_idx]}' cannot be inferred, its modifier "
+                        "has no periods to inject the proposal into."
+                    )
+                if slot is not None:
+                    p_indices.append(p_idx)
+                    slots.append(slot)
+        return np.array(p_indices, dtype=np.int64), np.array(slots, dtype=np.int64)
+
+    def inject_proposal_into_modifiers(
+        self,
+        proposal,
+        npi_seir=None,
+        npi_outcomes=None,
+    ):
+        """
+        Injects the proposal into compiled modifiers, in place.
+
+        This does what `inject_proposal` does without rebuilding the modifiers from
+        the modified DataFrames: each parameter is written to its slot in the
+        compiled modifiers.
+
+        Args:
+            proposal: The proposed parameter values.
+            npi_seir (NPI.CompiledModifier): Compiled seir modifiers.
+            npi_outcomes (NPI.CompiledModifier): Compiled outcome modifiers.
+        """
+        proposal = np.asarray(proposal)
+        for ptype, modifiers in (
+            ("seir_modifiers", npi_seir),
+            ("outcome_modifiers", npi_outcomes),
+        ):
+            if modifiers is None:
+                continue
+            slots = self._modifier_slots.get(ptype)
+            if slots is None or slots[0] is not modifiers:
+                slots = (modifiers, *self.get_modifier_slots(ptype, modifiers))
+                self._modifier_slots[ptype] = slots
+            _, p_indices, modifier_slots = slots
+            modifiers.set_values(modifier_slots, proposal[p_indices])
@@ -0,0 +1,266 @@
+"""
+A long-lived pool of workers evaluating proposals of a `GempyorInference`.
+
+Classes:
+    InferencePool:
+        A process pool whose workers load the inference once, with its static
+        simulation arrays in shared memory, and evaluate batches of proposals. Workers
+        are recycled when one of them goes over a memory watermark.
+"""
+
+__all__ = ["InferencePool"]
+
+
+import copy
+import multiprocessing
+import os
+import resource
+import sys
+from multiprocessing import shared_memory
+from typing import Any
+
+import numpy as np
+
+from . import steps_rk4
+
+
+def _resident_memory() -> int:
+    """
+    Get the resident memory of the current process.
+
+    Returns:
+        The resident set size in bytes, or the peak resident set size if the current
+        resident set size is not available on this platform.
+    """
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except OSError:
+        maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return maxrss if sys.platform == "darwin" else maxrss * 1024
+
+
+_worker_state = {}
+
+
+def _init_inference_worker(
+    inference: Any,
+    shared_arrays: dict[str, tuple[str, tuple, str]],
+    memory_limit: int | None,
+) -> None:
+    """
+    Process pool initializer keeping the inference for the worker.
+
+    Args:
+        inference: The `GempyorInference`, without the static simulation arrays that
+            are in shared memory.
+        shared_arrays: The shared memory block name, shape and dtype of the static
+            simulation arrays, by static simulation argument name.
+        memory_limit: The resident memory, in bytes, over which the worker asks to be
+            recycled, or `None` for twice its resident memory once initialized.
+
+    Returns:
+        None
+    """
+    blocks = []
+    for key, (name, shape, dtype) in shared_arrays.items():
+        # The workers share the resource tracker of the pool's process, which owns and
+        # unlinks the block
+        shm = shared_memory.SharedMemory(name=name)
+        blocks.append(shm)
+        array = np.ndarray(shape, dtype=dtype, buffer=shm.buf)
+        array.setflags(write=False)
+        inference.static_sim_arguments[key] = array
+    steps_rk4.precompile()
+
+    _worker_state["inference"] = inference
+    _worker_state["shared_memory"] = blocks
+    _worker_state["memory_limit"] = (
+        2 * _resident_memory() if memory_limit is None else memory_limit
+    )
+
+
+def _run_inference_worker(
+    task: tuple[str, np.ndarray, bool, bool],
+) -> tuple[Any, bool]:
+    """
+    Evaluate a proposal in a process pool worker.
+
+    Args:
+        task: The name of the `GempyorInference` method to call with the proposal,
+            the proposal, and the silent and save flags of the inference.
+
+    Returns:
+        The value returned by the method, and whether the worker is over its memory
+        limit.
+
+    See Also:
+        `_init_inference_worker`
+    """
+    method, proposal, silent, save = task
+    inference = _worker_state["inference"]
+    inference.set_silent(silent)
+    inference.set_save(save)
+    result = getattr(inference, method)(proposal)
+    return result, _resident_memory() > _worker_state["memory_limit"]
+
+
+class InferencePool:
+    """
+    A long-lived pool of workers evaluating proposals of a `GempyorInference`.
+
+    Each worker receives the inference once, when it starts, instead of with each
+    task. The arrays of the static simulation arguments are placed in shared memory
+    and mapped read-only by the workers, so that they are neither pickled nor
+    duplicated per worker. Workers also load the compiled integration kernels when
+    they start.
+
+    After each batch of proposals, the workers report whether they went over their
+    memory watermark, in which case the pool is restarted. This bounds the memory
+    growth of long calibrations without restarting the pool on a fixed schedule.
+
+    The pool evaluates the proposals with the current silent and save flags of the
+    inference it was created with.
+
+    Attributes:
+        inference: The `GempyorInference` whose proposals are evaluated.
+        ncpu: The number of workers.
+        memory_limit: The resident memory, in bytes, over which a worker is recycled,
+            or `None` for twice its resident memory once initialized.
+        restarts: The number of times the pool was restarted to recycle its workers.
+
+    Examples:
+        >>> with InferencePool(gempyor_inference, ncpu=4) as pool:
+        ...     sampler = emcee.EnsembleSampler(
+        ...         nwalkers, ndim, pool.log_prob, vectorize=True
+        ...     )
+    """
+
+    def __init__(self, inference: Any, ncpu: int, memory_limit: int | None = None) -> None:
+        """
+        Create a pool and start its workers.
+
+        Args:
+            inference: The `GempyorInference` whose proposals are evaluated.
+            ncpu: The number of workers.
+            memory_limit: The resident memory, in bytes, over which a worker is
+                recycled, or `None` for twice its resident memory once initialized.
+        """
+        self.inference = inference
+        self.ncpu = ncpu
+        self.memory_limit = memory_limit
+        self.restarts = 0
+
+        # The static arrays go to shared memory, the rest of the inference is
+        # pickled once for each worker
+        self._shared_memory = []
+        shared_arrays = {}
+        static_sim_arguments = dict(inference.static_sim_arguments)
+        for key, value in inference.static_sim_arguments.items():
+            if not isinstance(value, np.ndarray) or value.nbytes == 0:
+                continue
+            shm = shared_memory.SharedMemory(create=True, size=value.nbytes)
+            self._shared_memory.append(shm)
+            np.ndarray(value.shape, dtype=value.dtype, buffer=shm.buf)[...] = value
+            shared_arrays[key] = (shm.name, value.shape, value.dtype.str)
+            del static_sim_arguments[key]
+        worker_inference = copy.copy(inference)
+        worker_inference.static_sim_arguments = static_sim_arguments
+        self._initargs = (worker_inference, shared_arrays, memory_limit)
+
+        self._pool = None
+        self._start()
+
+    def _start(self) -> None:
+        self._pool = multiprocessing.Pool(
+            self.ncpu, initializer=_init_inference_worker, initargs=self._initargs
+        )
+
+    def _map(self, method: str, proposals: np.ndarray) -> list:
+        """
+        Call a method of the inference on each proposal in the workers.
+
+        Args:
+            method: The name of the `GempyorInference` method to call.
+            proposals: The proposals, one per row.
+
+        Returns:
+            The values returned by the method, in the order of `proposals`.
+        """
+        tasks = [
+            (method, proposal, self.inference.silent, self.inference.save)
+            for proposal in proposals
+        ]
+        results = self._pool.map(_run_inference_worker, tasks, chunksize=1)
+        if any(over_limit for _, over_limit in results):
+            self.restart()
+        return [result for result, _ in results]
+
+    def restart(self) -> None:
+        """Replace the workers of the pool by new ones."""
+        self._pool.close()
+        self._pool.join()
+        self.restarts += 1
+        self._start()
+
+    def log_prob(self, proposals: np.ndarray) -> np.ndarray:
+        """
+        Compute the log-likelihood of a batch of proposals.
+
+        This is the batched log-probability function of an `emcee.EnsembleSampler`
+        created with `vectorize=True`.
+
+        Args:
+            proposals: The proposals, as an array of shape `(nproposals, ndim)`.
+
+        Returns:
+            The log-likelihood of each proposal.
+        """
+        return np.array(self._map("get_logloss_as_single_number", proposals))
+
+    def log_prob_with_blobs(self, proposals: np.ndarray) -> list[tuple]:
+        """
+        Compute the log-likelihood of a batch of proposals, with per-statistic blobs.
+
+        This is the batched log-probability function of an `emcee.EnsembleSampler`
+        created with `vectorize=True`, for which the log-likelihood of each statistic
+        is stored as a blob.
+
+        Args:
+            proposals: The proposals, as an array of shape `(nproposals, ndim)`.
+
+        Returns:
+            The log-likelihood of each proposal, with the log-likelihood of each
+            statistic as returned by `GempyorInference.get_logloss_with_statistics`.
+        """
+        return self._map("get_logloss_with_statistics", proposals)
+
+    def simulate(self, proposals: np.ndarray) -> list:
+        """
+        Simulate a batch of proposals.
+
+        Args:
+            proposals: The proposals, as an array of shape `(nproposals, ndim)`.
+
+        Returns:
+            The outcomes of each proposal, as returned by
+            `GempyorInference.simulate_proposal`.
+        """
+        return self._map("simulate_proposal", proposals)
+
+    def close(self) -> None:
+        """Stop the workers and release the shared memory."""
+        if self._pool is not None:
+            self._pool.close()
+            self._pool.join()
+            self._pool = None
+        for shm in self._shared_memory:
+            shm.close()
+            shm.unlink()
+        self._shared_memory = []
+
+    def __enter__(self) -> "InferencePool":
+        return self
+
+    def __exit__(self, *args) -> None:
+        self.close()
@@ -0,0 +1,131 @@
+"""
+Closed form log-likelihood kernels for output statistics.
+
+This module provides the kernels used by `Statistic.llik`, by the name of the
+distribution given in the inference -> statistics -> likelihood -> dist config key. The
+kernels are written directly over numpy arrays, without the argument validation and
+broadcasting of `scipy.stats`, and with the terms that only depend on the ground truth
+split out so they can be computed once per ground truth data set.
+
+Each kernel has the signature `kernel(gt, model, gt_terms, **params)`, where `gt_terms`
+is the value returned by the ground truth terms function of the kernel, or `None` if
+the kernel does not have one, and `params` are the likelihood parameters of the
+statistic's config.
+"""
+
+__all__ = ["KERNELS"]
+
+
+from typing import Any, Callable
+
+import numpy as np
+from scipy.special import gammaln, xlog1py
+
+_NORM_PDF_LOG_C = np.log(2 * np.pi) / 2
+
+
+def _normal_logpdf(x: np.ndarray, loc: np.ndarray, scale: np.ndarray) -> np.ndarray:
+    """
+    Log-density of a normal distribution, as `scipy.stats.norm.logpdf`.
+
+    Args:
+        x: The values to evaluate the log-density at.
+        loc: The mean of the distribution.
+        scale: The standard deviation of the distribution.
+
+    Returns:
+        The log-density of `x`, NaN where `scale` is not positive.
+    """
+    with np.errstate(divide="ignore", invalid="ignore"):
+        y = (x - loc) / scale
+        logpdf = -(y**2) / 2.0 - _NORM_PDF_LOG_C - np.log(scale)
+    return np.where(scale > 0, logpdf, np.nan)
+
+
+def pois_gt_terms(gt: np.ndarray, **params: Any) -> np.ndarray:
+    """The log factorial of the ground truth counts."""
+    return gammaln(gt + 1)
+
+
+def pois(
+    gt: np.ndarray, model: np.ndarray, gt_terms: np.ndarray, **params: Any
+) -> np.ndarray:
+    """Poisson log-likelihood of the ground truth counts with the model as mean."""
+    return -model + (gt * np.log(model)) - gt_terms
+
+
+def nbinom_gt_terms(gt: np.ndarray, alpha: float, **params: Any) -> np.ndarray:
+    """The log binomial coefficient of the negative binomial log-likelihood."""
+    n = 1.0 / alpha
+    return gammaln(n + gt) - gammaln(gt + 1) - gammaln(n)
+
+
+def nbinom(
+    gt: np.ndarray, model: np.ndarray, gt_terms: np.ndarray, alpha: float, **params: Any
+) -> np.ndarray:
+    """
+    Negative binomial log-likelihood of the ground truth counts with the model as mean.
+
+    The distribution has `n = 1 / alpha` successes with probability
+    `p = 1 / (1 + alpha * model)`, as `scipy.stats.nbinom.logpmf`: NaN for invalid
+    parameters and `-inf` for negative counts.
+    """
+    n = 1.0 / alpha
+    p = 1.0 / (1.0 + alpha * model)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        logpmf = gt_terms + n * np.log(p) + xlog1py(gt, -p)
+    logpmf = np.where(gt >= 0, logpmf, -np.inf)
+    return np.where((n > 0) & (p > 0) & (p <= 1), logpmf, np.nan)
+
+
+def norm(
+    gt: np.ndarray, model: np.ndarray, gt_terms: None, scale: float, **params: Any
+) -> np.ndarray:
+    """Normal log-likelihood with the model as mean and a fixed `scale`."""
+    return _normal_logpdf(gt, model, np.asarray(scale, dtype=np.float64))
+
+
+def norm_cov(
+    gt: np.ndarray, model: np.ndarray, gt_terms: None, scale: float, **params: Any
+) -> np.ndarray:
+    """Normal log-likelihood with a `scale` proportional to the model, floored at 5."""
+    return _normal_logpdf(gt, model, scale * np.where(model > 5, model, 5))
+
+
+def norm_homoskedastic(
+    gt: np.ndarray, model: np.ndarray, gt_terms: None, sd: float, **params: Any
+) -> np.ndarray:
+    """Normal log-likelihood with the model as mean and a fixed standard deviation."""
+    return _normal_logpdf(gt, model, np.asarray(sd, dtype=np.float64))
+
+
+def norm_heteroskedastic(
+    gt: np.ndarray, model: np.ndarray, gt_terms: None, sd: float, **params: Any
+) -> np.ndarray:
+    """Normal log-likelihood with a standard deviation proportional to the model."""
+    return _normal_logpdf(gt, model, sd * model)
+
+
+def rmse(gt: np.ndarray, model: np.ndarray, gt_terms: None, **params: Any) -> float:
+    """Negative log of the root of the sum of squared errors, over all the data."""
+    return -np.log(np.sqrt(np.nansum((gt - model) ** 2)))
+
+
+def absolute_error(
+    gt: np.ndarray, model: np.ndarray, gt_terms: None, **params: Any
+) -> float:
+    """Negative log of the sum of absolute errors, over all the data."""
+    return -np.log(np.nansum(np.abs(gt - model)))
+
+
+KERNELS: dict[str, tuple[Callable[..., Any] | None, Callable[..., Any]]] = {
+    "pois": (pois_gt_terms, pois),
+    "norm": (None, norm),
+    "norm_cov": (None, norm_cov),
+    "norm_homoskedastic": (None, norm_homoskedastic),
+    "norm_heteroskedastic": (None, norm_heteroskedastic),
+    "nbinom": (nbinom_gt_terms, nbinom),
+    "rmse": (None, rmse),
+    "absolute_error": (None, absolute_error),
+}
+"""The ground truth terms function, if any, and kernel of each distribution."""
@@ -66,6 +66,14 @@ class LogLoss:
         for key, value in inference_config["statistics"].items():
             self.statistics[key] = statistics.Statistic(key, value)
 
+        # The ground truth does not change between evaluations, so each statistic's
+        # ground truth is selected, resampled and scaled once here
+        gt_xr = self.gt_xr.sel(date=slice(self.first_date, self.last_date))
+        self.gt_transformed = {
+            key: stat.apply_transforms(gt_xr[stat.data_var])
+            for key, stat in self.statistics.items()
+        }
+
     def plot_gt(
         self, ax=None, subpop=None, statistic=None, subplot=False, filename=None, **kwargs
     ):
@@ -139,37 +147,68 @@ class LogLoss:
         else:
             return ax  # Optionally return the axis
 
+    def _select_model_data(self, model_array: xr.DataArray, subpop_names) -> dict:
+        """
+        Select the model outcomes used by the statistics over the inference dates.
+
+        Args:
+            model_array: The `[outcome, date, subpop]` array returned by
+                `outcomes.compute_all_multioutcomes_array`.
+            subpop_names: list of subpop names
+
+        Returns:
+            A dictionary of `[date, subpop]` DataArrays, by outcome name.
+        """
+        if not np.array_equal(model_array["subpop"].values, subpop_names):
+            model_array = model_array.reindex({"subpop": subpop_names})
+        dates = model_array["date"].values
+        start = np.searchsorted(dates, np.datetime64(self.first_date), side="left")
+        stop = np.searchsorted(dates, np.datetime64(self.last_date), side="right")
+        coords = {"date": dates[start:stop], "subpop": subpop_names}
+
+        outcome_names = list(model_array["outcome"].values)
+        values = model_array.values
+        return {
+            stat.sim_var: xr.DataArray(
+                values[outcome_names.index(stat.sim_var), start:stop],
+                coords=coords,
+                dims=["date", "subpop"],
+            )
+            for stat in self.statistics.values()
+        }
+
     def compute_logloss(self, model_df, subpop_names):
         """
         Compute logloss for all statistics
-        model_df: DataFrame indexed by date
+        model_df: DataFrame indexed by date, or the [outcome, date, subpop] array
+            returned by `outcomes.compute_all_multioutcomes_array`
         subpop_names: list of subpop names
-        TODO: support kwargs for emcee, and this looks very slow
+        TODO: support kwargs for emcee
         """
-        coords = {"statistic": list(self.statistics.keys()), "subpop": subpop_names}
-
-        logloss = xr.DataArray(
-            np.zeros((len(coords["statistic"]), len(coords["subpop"]))),
-            dims=["statistic", "subpop"],
-            coords=coords,
-        )
+        if isinstance(model_df, xr.DataArray):
+            model_data = self._select_model_data(model_df, subpop_names)
+        else:
+            model_data = xr.Dataset.from_dataframe(
+                model_df.reset_index().set_index(["date", "subpop"])
+            )
+            model_data = model_data.sortby("date").reindex({"subpop": subpop_names})
+            model_data = model_data.sel(date=slice(self.first_date, self.last_date))
 
+        logloss = np.zeros((len(self.statistics), len(subpop_names)))
         regularizations = 0
-
-        model_xr = (
-            xr.Dataset.from_dataframe(model_df.reset_index().set_index(["date", "subpop"]))
-            .sortby("date")
-            .reindex({"subpop": subpop_names})
-        )
-
-        for key, stat in self.statistics.items():
-            ll, reg = stat.compute_logloss(
-                model_xr.sel(date=slice(self.first_date, self.last_date)),
-                self.gt_xr.sel(date=slice(self.first_date, self.last_date)),
+        for i, (key, stat) in enumerate(self.statistics.items()):
+            ll, reg = stat.compute_transformed_logloss(
+                stat.apply_transforms(model_data[stat.sim_var]),
+                self.gt_transformed[key],
             )
-            logloss.loc[dict(statistic=key)] = ll
+            logloss[i] = ll.values
             regularizations += reg
 
+        logloss = xr.DataArray(
+            logloss,
+            dims=["statistic", "subpop"],
+            coords={"statistic": list(self.statistics.keys()), "subpop": subpop_names},
+        )
         ll_total = logloss.sum().sum().values + regularizations
 
         return ll_total, logloss, regularizations
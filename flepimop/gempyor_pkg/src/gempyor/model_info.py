@@ -25,6 +25,7 @@ import numba as nb
 import numpy as np
 import numpy.typing as npt
 import pandas as pd
+import pyarrow as pa
 
 from . import (
     seeding,
@@ -302,7 +303,13 @@ class ModelInfo:
         # really ugly references to the config globally here.
         self.compartments = (
             compartments.Compartments(
-                seir_config=self.seir_config, compartments_config=config["compartments"]
+                seir_config=self.seir_config,
+                compartments_config=config["compartments"],
+                cache_dir=(
+                    self.path_prefix / self.seir_config["transition_cache_dir"].as_str()
+                    if self.seir_config["transition_cache_dir"].exists()
+                    else None
+                ),
             )
             if (config["compartments"].exists() and self.seir_config is not None)
             else None
@@ -443,9 +450,10 @@ class ModelInfo:
         self,
         ftype: str,
         sim_id: int,
-        df: pd.DataFrame,
+        df: pd.DataFrame | pa.Table,
         input: bool = False,
         extension_override: str = "",
+        **parquet_options,
     ):
         fname = self.get_filename(
             ftype=ftype,
@@ -457,10 +465,7 @@ class ModelInfo:
         os.makedirs(os.path.dirname(fname), exist_ok=True)
 
         # print(f"Writing {fname}")
-        write_df(
-            fname=fname,
-            df=df,
-        )
+        write_df(fname=fname, df=df, **parquet_options)
         return fname
 
     def get_seeding_data(self, sim_id: int) -> tuple[nb.typed.Dict, npt.NDArray[np.number]]:
@@ -2,20 +2,27 @@
 Handles the execution of outcome simulations in parallel, builds outcome modifiers, and processes simulation outcomes
 """
 
-import itertools
+from concurrent.futures import ProcessPoolExecutor
 import logging
 import random
 import time
+from functools import lru_cache
 from typing import Literal
 
+import confuse
 from numba import jit
 import numpy as np
+import numpy.typing as npt
 import pandas as pd
 import pyarrow as pa
-import tqdm.contrib.concurrent
+import pyarrow.compute as pc
+import pyarrow.parquet as pq
+import scipy.signal
+import scipy.stats
+import tqdm
 import xarray as xr
 
-from .utils import Timer, _nslots_random_seeds, config, read_df
+from .utils import Timer, _nslots_random_seeds, config, global_random_generator, read_df
 from . import NPI, model_info
 
 
@@ -39,11 +46,13 @@ def run_parallel_outcomes(
 
     Notes:
         Successive calls to this function will produce different samples for random
-        parameters.
+        parameters. Worker processes receive the model and the outcome plan once, when
+        they start, and then stream through the slots.
     """
     start = time.monotonic()
     sim_id2writes = np.arange(sim_id2write, sim_id2write + modinf.nslots)
     random_seeds = _nslots_random_seeds(nslots)
+    plan = OutcomePlan.from_model_info(modinf)
     if (n_jobs == 1) or (
         modinf.nslots == 1
     ):  # run single process for debugging/profiling purposes
@@ -52,15 +61,19 @@ def run_parallel_outcomes(
                 random_seeds[sim_offset],
                 sim_id2writes[sim_offset],
                 modinf=modinf,
+                plan=plan,
             )
     else:
-        tqdm.contrib.concurrent.process_map(
-            _onerun_delayframe_outcomes_with_random_seed,
-            random_seeds,
-            sim_id2writes,
-            itertools.repeat(modinf),
+        with ProcessPoolExecutor(
             max_workers=n_jobs,
-        )
+            initializer=_init_outcomes_worker,
+            initargs=(modinf, plan),
+        ) as executor:
+            for _ in tqdm.tqdm(
+                executor.map(_onerun_outcomes_worker, random_seeds, sim_id2writes),
+                total=nslots,
+            ):
+                pass
 
     print(
         f">> {nslots} outcomes simulations completed "
@@ -103,9 +116,11 @@ def onerun_delayframe_outcomes(
     modinf: model_info.ModelInfo,
     load_ID: bool = False,
     sim_id2load: int = None,
+    plan: "OutcomePlan | None" = None,
 ):
-    with Timer("buildOutcome.structure"):
-        parameters = read_parameters_from_config(modinf)
+    if plan is None:
+        with Timer("buildOutcome.structure"):
+            plan = OutcomePlan.from_model_info(modinf)
 
     npi_outcomes = None
     if modinf.npi_config_outcomes:
@@ -122,7 +137,7 @@ def onerun_delayframe_outcomes(
         outcomes_df, hpar = compute_all_multioutcomes(
             modinf=modinf,
             sim_id2write=sim_id2write,
-            parameters=parameters,
+            parameters=plan,
             loaded_values=loaded_values,
             npi=npi_outcomes,
         )
@@ -143,6 +158,7 @@ def _onerun_delayframe_outcomes_with_random_seed(
     modinf: model_info.ModelInfo,
     load_ID: bool = False,
     sim_id2load: int = None,
+    plan: "OutcomePlan | None" = None,
 ) -> None:
     """
     Wrapper function to run `onerun_delayframe_outcomes` with a random seed.
@@ -151,6 +167,7 @@ def _onerun_delayframe_outcomes_with_random_seed(
         random_seed: Random seed to use for the run.
         sim_id2write: Simulation ID to write.
         modinf: ModelInfo object.
+        plan: The outcome plan, built from `modinf` if not given.
 
     Returns:
         None
@@ -161,7 +178,49 @@ def _onerun_delayframe_outcomes_with_random_seed(
     """
     np.random.seed(seed=random_seed)
     onerun_delayframe_outcomes(
-        sim_id2write, modinf, load_ID=load_ID, sim_id2load=sim_id2load
+        sim_id2write, modinf, load_ID=load_ID, sim_id2load=sim_id2load, plan=plan
+    )
+
+
+_worker_state = {}
+
+
+def _init_outcomes_worker(
+    modinf: model_info.ModelInfo, plan: "OutcomePlan | None" = None
+) -> None:
+    """
+    Process pool initializer keeping the model and the outcome plan for the worker.
+
+    Args:
+        modinf: ModelInfo object.
+        plan: The outcome plan, built from `modinf` if not given.
+
+    Returns:
+        None
+    """
+    _worker_state["modinf"] = modinf
+    _worker_state["plan"] = plan
+
+
+def _onerun_outcomes_worker(random_seed: int, sim_id2write: int) -> None:
+    """
+    Run `_onerun_delayframe_outcomes_with_random_seed` in a process pool worker.
+
+    Args:
+        random_seed: Random seed to use for the run.
+        sim_id2write: Simulation ID to write.
+
+    Returns:
+        None
+
+    See Also:
+        `_init_outcomes_worker`
+    """
+    _onerun_delayframe_outcomes_with_random_seed(
+        random_seed,
+        sim_id2write,
+        modinf=_worker_state["modinf"],
+        plan=_worker_state["plan"],
     )
 
 
@@ -263,6 +322,10 @@ def read_parameters_from_config(modinf: model_info.ModelInfo):
                         parameters[new_comp][
                             "delay::npi_param_name"
                         ] = f"{new_comp}::delay".lower()
+                    if outcomes_config[new_comp]["delay"]["kernel"].exists():
+                        parameters[new_comp]["delay::kernel"] = _read_delay_kernel(
+                            outcomes_config[new_comp]["delay"]["kernel"], new_comp
+                        )
                 else:
                     logging.critical(f"No delay for outcome {new_comp}, using a 0 delay")
                     outcomes_config[new_comp]["delay"] = {"value": 0}
@@ -293,6 +356,11 @@ def read_parameters_from_config(modinf: model_info.ModelInfo):
                             "duration::npi_param_name"
                         ] = f"{new_comp}::duration".lower()
 
+                    if outcomes_config[new_comp]["duration"]["kernel"].exists():
+                        parameters[new_comp]["duration::kernel"] = _read_delay_kernel(
+                            outcomes_config[new_comp]["duration"]["kernel"], new_comp
+                        )
+
                     if outcomes_config[new_comp]["duration"]["name"].exists():
                         parameters[new_comp]["outcome_prevalence_name"] = (
                             #    outcomes_config[new_comp]["duration"]["name"].as_str() + subclass
@@ -338,6 +406,199 @@ def read_parameters_from_config(modinf: model_info.ModelInfo):
     return parameters
 
 
+class OutcomePlan:
+    """
+    The outcome parameters compiled once into a reusable computation plan.
+
+    The plan resolves the order in which outcomes can be computed (an outcome drawn
+    from, or summing, other outcomes comes after them) and holds the probability,
+    delay and duration specifications as plain values, so that it can be built once
+    per run and shipped to worker processes instead of re-reading the config for
+    every slot. The random samplers are rebuilt lazily in each process, so that they
+    draw from that process' (seeded) global random state.
+
+    Attributes:
+        parameters: The outcome parameters, as given by `read_parameters_from_config`.
+        order: The outcome names in computation order.
+    """
+
+    _DISTRIBUTION_QUANTITIES = ("probability", "delay", "duration")
+
+    def __init__(self, parameters: dict) -> None:
+        """
+        Initialize an outcome plan.
+
+        Args:
+            parameters: The outcome parameters, as given by
+                `read_parameters_from_config`.
+
+        Raises:
+            ValueError: If an outcome is drawn from, or sums, an outcome that is
+                not defined, or if outcomes depend on each other in a cycle.
+        """
+        self.parameters = {}
+        for new_comp, params in parameters.items():
+            params = dict(params)
+            for quantity in self._DISTRIBUTION_QUANTITIES:
+                if isinstance(params.get(quantity), confuse.ConfigView):
+                    params[quantity] = params[quantity].get()
+            self.parameters[new_comp] = params
+        self.order = self._dependency_order()
+        self.seir_sources = {
+            new_comp: params["source"]
+            for new_comp, params in self.parameters.items()
+            if isinstance(params.get("source"), dict)
+        }
+        self._samplers = {}
+
+    @classmethod
+    def from_model_info(cls, modinf: model_info.ModelInfo) -> "OutcomePlan":
+        """
+        Build the outcome plan of a model.
+
+        Args:
+            modinf: ModelInfo object.
+
+        Returns:
+            The outcome plan for the outcomes configured in `modinf`.
+        """
+        return cls(read_parameters_from_config(modinf))
+
+    def __getstate__(self) -> dict:
+        state = self.__dict__.copy()
+        state["_samplers"] = {}
+        return state
+
+    def _dependency_order(self) -> list[str]:
+        """
+        Order the outcomes so that each one comes after the outcomes it needs.
+
+        Outcomes are visited in config order, and an outcome whose inputs are not
+        available yet is moved to the back of the queue, as the outcome computation
+        always did.
+
+        Returns:
+            The outcome names in computation order.
+        """
+        produced = set(self.parameters)
+        for params in self.parameters.values():
+            if "outcome_prevalence_name" in params:
+                produced.add(params["outcome_prevalence_name"])
+
+        dependencies = {}
+        for new_comp, params in self.parameters.items():
+            if isinstance(params.get("source"), str):
+                dependencies[new_comp] = [params["source"]]
+                if params["source"] not in produced:
+                    raise ValueError(
+                        f"Issue with outcome '{new_comp}'; the specified source '{params['source']}' is neither a dictionnary (for seir outcome) nor an existing pre-identified outcome."
+                    )
+            elif "sum" in params:
+                dependencies[new_comp] = list(params["sum"])
+                for cmp in params["sum"]:
+                    if cmp not in produced:
+                        raise ValueError(
+                            f"Issue with outcome '{new_comp}'; the summed outcome '{cmp}' is not an existing outcome."
+                        )
+            else:
+                dependencies[new_comp] = []
+
+        available = set()
+        order = []
+        queue = list(self.parameters)
+        deferred = 0
+        while queue:
+            new_comp = queue.pop(0)
+            if all(dep in available for dep in dependencies[new_comp]):
+                order.append(new_comp)
+                available.add(new_comp)
+                if "outcome_prevalence_name" in self.parameters[new_comp]:
+                    available.add(self.parameters[new_comp]["outcome_prevalence_name"])
+                deferred = 0
+            else:
+                queue.append(new_comp)
+                deferred += 1
+                if deferred > len(queue):
+                    raise ValueError(
+                        f"The outcomes {sorted(queue)} depend on each other in a cycle."
+                    )
+        return order
+
+    def seir_filter(self) -> pc.Expression | None:
+        """
+        Build the predicate selecting the SEIR output rows that source outcomes.
+
+        Returns:
+            A pyarrow expression matching the `mc_value_type` and `mc_*` values of
+            the SEIR sources of the plan, or `None` if no outcome is sourced from
+            the SEIR output.
+
+        Raises:
+            ValueError: If a source is neither an incidence nor a prevalence.
+        """
+        expression = None
+        for new_comp, filters in self.seir_sources.items():
+            vtype = _source_value_type(filters, new_comp)
+            term = pc.field("mc_value_type") == vtype
+            for mc_type, mc_value in filters[vtype].items():
+                values = [mc_value] if isinstance(mc_value, str) else list(mc_value)
+                term &= pc.field(f"mc_{mc_type}").isin(values)
+            expression = term if expression is None else expression | term
+        return expression
+
+    def noutputs(self) -> int:
+        """
+        Count the outcomes and outcome prevalences computed by the plan.
+
+        Returns:
+            The number of output slots needed to store the plan's results.
+        """
+        return sum(
+            ("source" in p) + ("sum" in p) + ("duration" in p)
+            for p in self.parameters.values()
+        )
+
+    def sample(self, outcome_name: str, quantity: str) -> float:
+        """
+        Draw a value of an outcome's probability, delay or duration.
+
+        Args:
+            outcome_name: The name of the outcome.
+            quantity: One of 'probability', 'delay' or 'duration'.
+
+        Returns:
+            A draw from the distribution specified for that quantity.
+        """
+        key = (outcome_name, quantity)
+        if key not in self._samplers:
+            spec = self.parameters[outcome_name][quantity]
+            view = confuse.RootView([confuse.ConfigSource.of({quantity: spec})])
+            self._samplers[key] = view[quantity].as_random_distribution()
+        return self._samplers[key]()
+
+
+def _read_delay_kernel(kernel_config, outcome_name: str) -> dict:
+    """
+    Read and check a `delay::kernel` or `duration::kernel` section of an outcome.
+
+    Args:
+        kernel_config: The confuse view of the kernel section.
+        outcome_name: The name of the outcome, for error messages.
+
+    Returns:
+        The keyword arguments for `discretized_delay_kernel`, without the mean.
+
+    Raises:
+        ValueError: If the kernel distribution or its parameters are not supported.
+    """
+    kernel = dict(kernel_config.get())
+    try:
+        discretized_delay_kernel(1.0, 1, **kernel)
+    except (TypeError, ValueError) as e:
+        raise ValueError(f"Invalid delay kernel for outcome '{outcome_name}': {e}") from e
+    return kernel
+
+
 def postprocess_and_write(
     sim_id, modinf: model_info.ModelInfo, outcomes_df, hpar, npi, write=True
 ):
@@ -377,13 +638,29 @@ def dataframe_from_array(data, subpops, dates, comp_name):
     return df
 
 
-def read_seir_sim(modinf: model_info.ModelInfo, sim_id):
-    seir_df = modinf.read_simID(ftype="seir", sim_id=sim_id)
+def read_seir_sim(
+    modinf: model_info.ModelInfo, sim_id, plan: "OutcomePlan | None" = None
+) -> pd.DataFrame:
+    """
+    Read the `.seir.` output of a simulation.
 
-    return seir_df
+    Args:
+        modinf: ModelInfo object.
+        sim_id: Simulation ID to read.
+        plan: If given, a parquet output is memory-mapped and only the rows that
+            source the outcomes of the plan are read, with the filter pushed down
+            to the parquet reader.
 
+    Returns:
+        The SEIR output table.
+    """
+    fname = modinf.get_filename(ftype="seir", sim_id=sim_id, input=True)
+    if plan is None or fname.suffix != ".parquet":
+        return read_df(fname=fname)
+    return pq.read_table(fname, filters=plan.seir_filter(), memory_map=True).to_pandas()
 
-def compute_all_multioutcomes(
+
+def compute_all_multioutcomes_array(
     *,
     modinf: model_info.ModelInfo,
     sim_id2write,
@@ -392,64 +669,74 @@ def compute_all_multioutcomes(
     npi=None,
     bypass_seir_df: pd.DataFrame = None,
     bypass_seir_xr: xr.Dataset = None,
-):
-    """Compute delay frame based on temporally varying input. We load the seir sim corresponding to sim_id to write"""
+    rng: np.random.Generator | None = None,
+) -> tuple[xr.DataArray, pd.DataFrame]:
+    """
+    Compute all outcomes into a single `[outcome, date, subpop]` array.
+
+    This is the array-native engine behind `compute_all_multioutcomes`: every outcome,
+    including the `_curr` prevalence of outcomes with a duration, is written into one
+    preallocated array in the order it is computed, and nothing is converted to a long
+    table. Callers that need the output table can use `dataframe_from_outcomes_array`.
+
+    Args:
+        modinf: The model info to compute outcomes for.
+        sim_id2write: The simulation ID to read the SEIR output of, unless bypassed.
+        parameters: The outcome plan, or the outcome parameters as given by
+            `read_parameters_from_config` to compile a plan from.
+        loaded_values: Outcome parameter values to reuse, as in a `.hpar.` file.
+        npi: The outcome modifiers to apply, if any.
+        bypass_seir_df: A SEIR output table to use instead of reading one.
+        bypass_seir_xr: SEIR states to use instead of reading the SEIR output.
+        rng: With the stochastic engine, the random generator to draw outcome
+            incidences and distributed delays from. If not given, incidences are drawn
+            from numpy's global random state and delays from a generator seeded from
+            it, so that seeding the global state reproduces a slot.
+
+    Returns:
+        A tuple of the outcomes as an `xr.DataArray` with dimensions `outcome`, `date`
+        and `subpop`, and the outcome parameters drawn as a DataFrame.
+    """
     hpar_list = []
     all_data = {}
     dates = pd.date_range(modinf.ti, modinf.tf, freq="D")
+    subpops = modinf.subpop_struct.subpop_names
+
+    plan = parameters if isinstance(parameters, OutcomePlan) else OutcomePlan(parameters)
+    parameters = plan.parameters
+    stochastic = modinf.get_engine() == "stochastic"
+    delay_rng = rng
+
+    # One slot per outcome and per outcome prevalence, filled in computation order
+    outcomes_array = np.zeros((plan.noutputs(), len(dates), len(subpops)))
+    outcome_names = []
+
+    def store(name, values):
+        outcomes_array[len(outcome_names)] = values
+        all_data[name] = outcomes_array[len(outcome_names)]
+        outcome_names.append(name)
 
-    outcomes = dataframe_from_array(
-        np.zeros((len(dates), len(modinf.subpop_struct.subpop_names)), dtype=int),
-        modinf.subpop_struct.subpop_names,
-        dates,
-        "zeros",
-    ).drop("zeros", axis=1)
     if bypass_seir_df is None and bypass_seir_xr is None:
-        seir_sim = read_seir_sim(modinf, sim_id=sim_id2write)
+        seir_sim = read_seir_sim(modinf, sim_id=sim_id2write, plan=plan)
     elif bypass_seir_xr is not None:
         seir_sim = bypass_seir_xr
     else:
         seir_sim = bypass_seir_df
 
-    parameters_keys = list(parameters.keys())
-    for new_comp in parameters_keys:
+    # Pull all the sources from the seir simulation at once
+    seir_sources = pull_seir_sources(seir_sim, dates, subpops, plan.seir_sources)
+
+    for new_comp in plan.order:
         if "source" in parameters[new_comp]:
             # Read the config for this compartment: if a source is specified, we
             # 1. compute incidence from binomial draw
             # 2. compute duration if needed
             source_name = parameters[new_comp]["source"]
             if isinstance(source_name, dict):
-                if isinstance(seir_sim, pd.DataFrame):
-                    source_array = filter_seir_df(
-                        diffI=seir_sim,
-                        dates=dates,
-                        subpops=modinf.subpop_struct.subpop_names,
-                        filters=source_name,
-                        outcome_name=new_comp,
-                    )
-                elif isinstance(seir_sim, xr.Dataset):
-                    source_array = filter_seir_xr(
-                        diffI=seir_sim,
-                        dates=dates,
-                        subpops=modinf.subpop_struct.subpop_names,
-                        filters=source_name,
-                        outcome_name=new_comp,
-                    )
-                else:
-                    raise ValueError(
-                        f"Unknown type provided for seir simulation, received '{type(seir_sim)}'."
-                    )
+                source_array = seir_sources[new_comp]
                 # we don't keep source in this cases
-            else:  # already defined outcomes
-                if source_name in all_data:
-                    source_array = all_data[source_name]
-                elif source_name in parameters_keys:
-                    parameters_keys.append(new_comp)
-                    continue
-                else:
-                    raise ValueError(
-                        f"Issue with outcome '{new_comp}'; the specified source '{source_name}' is neither a dictionnary (for seir outcome) nor an existing pre-identified outcome."
-                    )
+            else:  # already defined outcomes, computed before in the plan order
+                source_array = all_data[source_name]
 
             if (loaded_values is not None) and (
                 new_comp in loaded_values["outcome"].values
@@ -466,13 +753,13 @@ def compute_all_multioutcomes(
             else:
                 # One draw for all subpops
                 probabilities = np.repeat(
-                    parameters[new_comp]["probability"].as_random_distribution()(),
+                    plan.sample(new_comp, "probability"),
                     len(modinf.subpop_struct.subpop_names),
                 )
                 if "rel_probability" in parameters[new_comp]:
                     probabilities = probabilities * parameters[new_comp]["rel_probability"]
                 delays = np.repeat(
-                    parameters[new_comp]["delay"].as_random_distribution()(),
+                    plan.sample(new_comp, "delay"),
                     len(modinf.subpop_struct.subpop_names),
                 )
             probabilities[probabilities > 1] = 1
@@ -505,7 +792,7 @@ def compute_all_multioutcomes(
             if npi is not None:
                 delays = NPI.reduce_parameter(
                     parameter=delays,
-                    modification=npi.getReduction(
+                    modification=npi.getReductionArray(
                         parameters[new_comp]["delay::npi_param_name"].lower()
                     ),
                 )
@@ -513,34 +800,36 @@ def compute_all_multioutcomes(
                 delays = np.round(delays).astype(int)
                 probabilities = NPI.reduce_parameter(
                     parameter=probabilities,
-                    modification=npi.getReduction(
+                    modification=npi.getReductionArray(
                         parameters[new_comp]["probability::npi_param_name"].lower()
                     ),
                 )
 
             # Create new compartment incidence:
-            all_data[new_comp] = np.empty_like(source_array)
             # Draw with from source compartment
-            if modinf.get_engine() == "stochastic":
-                all_data[new_comp] = np.random.binomial(
+            if stochastic:
+                new_comp_incidence = (np.random if rng is None else rng).binomial(
                     source_array.astype(np.int32), probabilities
                 )
             else:
-                all_data[new_comp] = source_array * (
+                new_comp_incidence = source_array * (
                     probabilities * np.ones_like(source_array)
                 )
 
-            # Shift to account for the delay
-            ## stoch_delay_flag is whether to use stochastic delays or not
-            stoch_delay_flag = False
-            all_data[new_comp] = multishift(
-                all_data[new_comp], delays, stoch_delay_flag=stoch_delay_flag
-            )
-            # Produce a dataframe an merge it
-            df_p = dataframe_from_array(
-                all_data[new_comp], modinf.subpop_struct.subpop_names, dates, new_comp
+            # Shift to account for the delay, the stochastic engine splits each day's
+            # incidence over a delay distribution with multinomial draws
+            delay_kernel = parameters[new_comp].get("delay::kernel")
+            if stochastic and delay_kernel is not None and delay_rng is None:
+                delay_rng = global_random_generator()
+            store(
+                new_comp,
+                apply_delays(
+                    new_comp_incidence,
+                    delays,
+                    kernel=delay_kernel,
+                    rng=delay_rng if stochastic else None,
+                ),
             )
-            outcomes = pd.merge(outcomes, df_p)
 
             # Make duration
             if "duration" in parameters[new_comp]:
@@ -553,7 +842,7 @@ def compute_all_multioutcomes(
                     ]["value"].to_numpy()
                 else:
                     durations = np.repeat(
-                        parameters[new_comp]["duration"].as_random_distribution()(),
+                        plan.sample(new_comp, "duration"),
                         len(modinf.subpop_struct.subpop_names),
                     )
                 durations = np.repeat(
@@ -579,7 +868,7 @@ def compute_all_multioutcomes(
                     # print(f"{new_comp}-duration".lower(), npi.getReduction(f"{new_comp}-duration".lower()))
                     durations = NPI.reduce_parameter(
                         parameter=durations,
-                        modification=npi.getReduction(
+                        modification=npi.getReductionArray(
                             parameters[new_comp]["duration::npi_param_name"].lower()
                         ),
                     )  # npi.getReduction(f"{new_comp}::duration".lower()))
@@ -590,102 +879,405 @@ def compute_all_multioutcomes(
                     # plt.savefig('Daft'+new_comp + '-' + source)
                     # plt.close()
 
-                all_data[parameters[new_comp]["outcome_prevalence_name"]] = np.cumsum(
-                    all_data[new_comp], axis=0
-                ) - multishift(
-                    np.cumsum(all_data[new_comp], axis=0),
-                    durations,
-                    stoch_delay_flag=stoch_delay_flag,
-                )
-
-                df_p = dataframe_from_array(
-                    all_data[parameters[new_comp]["outcome_prevalence_name"]],
-                    modinf.subpop_struct.subpop_names,
-                    dates,
-                    parameters[new_comp]["outcome_prevalence_name"],
-                )
-                outcomes = pd.merge(outcomes, df_p)
+                cumulative = np.cumsum(all_data[new_comp], axis=0)
+                duration_kernel = parameters[new_comp].get("duration::kernel")
+                if stochastic and duration_kernel is not None:
+                    # Draw when each individual leaves, rather than spreading the
+                    # cumulative counts
+                    if delay_rng is None:
+                        delay_rng = global_random_generator()
+                    exits = np.cumsum(
+                        apply_delays(
+                            all_data[new_comp], durations, duration_kernel, rng=delay_rng
+                        ),
+                        axis=0,
+                    )
+                else:
+                    exits = apply_delays(cumulative, durations, kernel=duration_kernel)
+                store(parameters[new_comp]["outcome_prevalence_name"], cumulative - exits)
 
         elif "sum" in parameters[new_comp]:
-            sum_outcome = np.zeros(
-                (len(dates), len(modinf.subpop_struct.subpop_names)),
-                dtype=all_data[parameters[new_comp]["sum"][0]].dtype,
-            )
             # Sum all concerned compartment.
-            for cmp in parameters[new_comp]["sum"]:
-                sum_outcome += all_data[cmp]
-            all_data[new_comp] = sum_outcome
-            df_p = dataframe_from_array(
-                sum_outcome, modinf.subpop_struct.subpop_names, dates, new_comp
+            store(
+                new_comp,
+                sum(all_data[cmp] for cmp in parameters[new_comp]["sum"]),
             )
-            outcomes = pd.merge(outcomes, df_p)
     # Concat our hpar dataframes
     hpar = (
         pd.concat(hpar_list)
         if hpar_list
         else pd.DataFrame(columns=["subpop", "quantity", "outcome", "value"])
     )
+    outcomes = xr.DataArray(
+        outcomes_array[: len(outcome_names)],
+        dims=["outcome", "date", "subpop"],
+        coords={"outcome": outcome_names, "date": dates, "subpop": subpops},
+    )
     return outcomes, hpar
 
 
-def filter_seir_df(diffI, dates, subpops, filters, outcome_name) -> np.ndarray:
+def compute_all_multioutcomes(
+    *,
+    modinf: model_info.ModelInfo,
+    sim_id2write,
+    parameters,
+    loaded_values=None,
+    npi=None,
+    bypass_seir_df: pd.DataFrame = None,
+    bypass_seir_xr: xr.Dataset = None,
+    rng: np.random.Generator | None = None,
+):
+    """Compute delay frame based on temporally varying input. We load the seir sim corresponding to sim_id to write"""
+    outcomes, hpar = compute_all_multioutcomes_array(
+        modinf=modinf,
+        sim_id2write=sim_id2write,
+        parameters=parameters,
+        loaded_values=loaded_values,
+        npi=npi,
+        bypass_seir_df=bypass_seir_df,
+        bypass_seir_xr=bypass_seir_xr,
+        rng=rng,
+    )
+    return dataframe_from_outcomes_array(outcomes), hpar
+
+
+def dataframe_from_outcomes_array(outcomes: xr.DataArray) -> pd.DataFrame:
+    """
+    Convert an `[outcome, date, subpop]` outcomes array to the outcomes output table.
+
+    Args:
+        outcomes: The outcomes, as returned by `compute_all_multioutcomes_array`.
+
+    Returns:
+        A DataFrame with `date` and `subpop` columns, ordered by subpop then date, and
+        one float column per outcome.
+    """
+    dates = outcomes.indexes["date"]
+    subpops = outcomes.indexes["subpop"]
+    # Transpose once so every outcome column is a contiguous (subpop, date) block
+    values = np.ascontiguousarray(
+        outcomes.to_numpy().transpose(0, 2, 1), dtype=np.double
+    ).reshape(len(outcomes["outcome"]), len(subpops) * len(dates))
+    df = pd.DataFrame(
+        {
+            "date": np.tile(dates.to_numpy(), len(subpops)),
+            "subpop": np.repeat(subpops.to_numpy(), len(dates)),
+        }
+    )
+    return pd.concat(
+        [
+            df,
+            pd.DataFrame(dict(zip(outcomes.indexes["outcome"], values)), index=df.index),
+        ],
+        axis=1,
+    )
+
+
+def _source_value_type(filters: dict, outcome_name: str) -> str:
+    """Determine if an outcome is sourced from the SEIR incidence or prevalence."""
     if list(filters.keys()) == ["incidence"]:
-        vtype = "incidence"
+        return "incidence"
     elif list(filters.keys()) == ["prevalence"]:
-        vtype = "prevalence"
-    else:
+        return "prevalence"
+    raise ValueError(
+        f"Cannot discern the source of outcome '{outcome_name}'; it is not a previously defined outcome and there is no `incidence` or `prevalence`."
+    )
+
+
+@lru_cache(maxsize=None)
+def _source_selection(
+    compartments: tuple[tuple[str, tuple[str, ...]], ...],
+    sources: tuple[tuple[str, str, tuple[tuple[str, tuple[str, ...]], ...]], ...],
+) -> dict[str, tuple[list[str], npt.NDArray[np.float64]]]:
+    """
+    Resolve the SEIR sources of outcomes to compartment selection matrices.
+
+    Memoized, so that the compartment filters of a model are only resolved once.
+
+    Args:
+        compartments: The `(column, values)` pairs of the `mc_*` compartment columns.
+        sources: The `(outcome, value type, filters)` triplets of the outcomes, with
+            filters given as `(mc_type, values)` pairs.
+
+    Returns:
+        For each value type, the names of the outcomes it sources and a 0/1 matrix of
+        shape `(len(outcomes), ncompartments)` selecting their compartments.
+    """
+    columns = {column: np.asarray(values) for column, values in compartments}
+    ncompartments = len(columns["mc_name"])
+    selection = {}
+    for outcome_name, vtype, filters in sources:
+        mask = np.ones(ncompartments, dtype=bool)
+        for mc_type, mc_value in filters:
+            mask &= np.isin(columns[f"mc_{mc_type}"], mc_value)
+        names, rows = selection.setdefault(vtype, ([], []))
+        names.append(outcome_name)
+        rows.append(mask.astype(np.float64))
+    return {vtype: (names, np.stack(rows)) for vtype, (names, rows) in selection.items()}
+
+
+def _seir_arrays(
+    seir_sim: pd.DataFrame | xr.Dataset, dates: pd.DatetimeIndex, subpops: list[str]
+) -> tuple[pd.DataFrame, dict[str, np.ndarray]]:
+    """
+    Get the compartments and the `[date, compartment, subpop]` arrays of a SEIR sim.
+
+    Args:
+        seir_sim: The SEIR simulation, either the states or the `.seir.` output table.
+        dates: The dates of the simulation.
+        subpops: The subpops of the simulation.
+
+    Returns:
+        The `mc_*` compartment table and a dictionary of arrays by value type.
+
+    Raises:
+        ValueError: If the type of the SEIR simulation is not supported.
+    """
+    if isinstance(seir_sim, xr.Dataset):
+        compartments = pd.DataFrame(
+            {
+                c: seir_sim[c].to_numpy()
+                for c in seir_sim.coords
+                if c.startswith("mc_") and seir_sim[c].dims == ("compartment",)
+            }
+        )
+        return compartments, {
+            vtype: seir_sim[vtype].to_numpy() for vtype in ("incidence", "prevalence")
+        }
+    if not isinstance(seir_sim, pd.DataFrame):
         raise ValueError(
-            f"Cannot discern the source of outcome '{outcome_name}'; it is not a previously defined outcome and there is no `incidence` or `prevalence`."
+            f"Unknown type provided for seir simulation, received '{type(seir_sim)}'."
+        )
+    mc_columns = [
+        c for c in seir_sim.columns if c.startswith("mc_") and c != "mc_value_type"
+    ]
+    # Compartments are identified by all their mc_* columns, not only by mc_name
+    compartments = seir_sim[mc_columns].drop_duplicates(ignore_index=True)
+    compartment_index = pd.MultiIndex.from_frame(compartments)
+    arrays = {}
+    for vtype, df in seir_sim.groupby("mc_value_type", sort=False):
+        date_indices = dates.get_indexer(pd.to_datetime(df["date"]))
+        if (date_indices < 0).any():
+            raise ValueError(
+                "The SEIR simulation has dates outside of the simulation period "
+                f"from {dates[0].date()} to {dates[-1].date()}."
+            )
+        arrays[vtype] = np.zeros((len(dates), len(compartments), len(subpops)))
+        arrays[vtype][
+            date_indices,
+            compartment_index.get_indexer(pd.MultiIndex.from_frame(df[mc_columns])),
+        ] = df[subpops].to_numpy()
+    return compartments, arrays
+
+
+def pull_seir_sources(
+    seir_sim: pd.DataFrame | xr.Dataset,
+    dates: pd.DatetimeIndex,
+    subpops: list[str],
+    sources: dict[str, dict],
+) -> dict[str, np.ndarray]:
+    """
+    Sum the compartments sourcing each outcome out of a SEIR simulation.
+
+    The compartment filters of all the sources are resolved to one selection matrix
+    per value type, which is applied to the SEIR values with a single matrix product.
+
+    Args:
+        seir_sim: The SEIR simulation, either the states or the `.seir.` output table.
+        dates: The dates of the simulation.
+        subpops: The subpops of the simulation.
+        sources: The SEIR source filters by outcome name, like
+            `{"incidI": {"incidence": {"infection_stage": "I1"}}}`.
+
+    Returns:
+        The `[date, subpop]` source values by outcome name.
+
+    Raises:
+        ValueError: If a source is neither an incidence nor a prevalence.
+    """
+    if not sources:
+        return {}
+    frozen_sources = tuple(
+        (
+            outcome_name,
+            vtype,
+            tuple(
+                (mc_type, (mc_value,) if isinstance(mc_value, str) else tuple(mc_value))
+                for mc_type, mc_value in filters[vtype].items()
+            ),
         )
+        for outcome_name, filters in sources.items()
+        for vtype in (_source_value_type(filters, outcome_name),)
+    )
+    compartments, arrays = _seir_arrays(seir_sim, dates, subpops)
+    selection = _source_selection(
+        tuple((c, tuple(compartments[c])) for c in compartments.columns),
+        frozen_sources,
+    )
+    source_arrays = {}
+    for vtype, (names, matrix) in selection.items():
+        summed = np.matmul(matrix, arrays[vtype]).transpose(1, 0, 2)
+        source_arrays.update(zip(names, np.ascontiguousarray(summed)))
+    return source_arrays
 
-    diffI = diffI[diffI["mc_value_type"] == vtype]
-    # diffI.drop(["mc_value_type"], inplace=True, axis=1)
-    filters = filters[vtype]
 
-    incidI_arr = np.zeros((len(dates), len(subpops)))
-    df = diffI
-    for mc_type, mc_value in filters.items():
-        if isinstance(mc_value, str):
-            mc_value = [mc_value]
-        df = df[df[f"mc_{mc_type}"].isin(mc_value)]
-    for mcn in df["mc_name"].unique():
-        new_df = df[df["mc_name"] == mcn]
-        new_df = new_df.drop(["date"] + [c for c in new_df.columns if "mc_" in c], axis=1)
-        # new_df = new_df.drop("date", axis=1)
-        incidI_arr = incidI_arr + new_df.to_numpy()
-    return incidI_arr
+def filter_seir_df(diffI, dates, subpops, filters, outcome_name) -> np.ndarray:
+    return pull_seir_sources(diffI, dates, subpops, {outcome_name: filters})[outcome_name]
 
 
 def filter_seir_xr(diffI, dates, subpops, filters, outcome_name) -> np.ndarray:
-    # Determine the variable type (prevalence or incidence)
-    if list(filters.keys()) == ["incidence"]:
-        vtype = "incidence"
-    elif list(filters.keys()) == ["prevalence"]:
-        vtype = "prevalence"
-    else:
+    return pull_seir_sources(diffI, dates, subpops, {outcome_name: filters})[outcome_name]
+
+
+_DELAY_KERNEL_PARAMETERS = {"gamma": "shape", "lognormal": "sdlog"}
+
+
+def discretized_delay_kernel(
+    mean: float, ndays: int, distribution: str, **params: float
+) -> npt.NDArray[np.float64]:
+    """
+    Discretize a delay distribution with a given mean over days `0, ..., ndays - 1`.
+
+    Day `d` receives the probability mass of `[d - 0.5, d + 0.5)`, so that the mean of
+    the kernel stays close to `mean`. The mass beyond the last day is dropped, like
+    delayed counts that fall after the end of the simulation.
+
+    Args:
+        mean: The mean delay in days, a delay of zero or less gives no delay.
+        ndays: The number of days to discretize the distribution over.
+        distribution: Either 'gamma', which takes a `shape` parameter, or 'lognormal',
+            which takes a `sdlog` parameter.
+        **params: The dispersion parameter of the distribution.
+
+    Returns:
+        The probability of each delay, from 0 to `ndays - 1` days.
+
+    Raises:
+        ValueError: If the distribution is not supported or its parameters do not
+            match the distribution.
+
+    Examples:
+        >>> from gempyor.outcomes import discretized_delay_kernel
+        >>> discretized_delay_kernel(2.0, 6, "gamma", shape=1e6).round(3)
+        array([0., 0., 1., 0., 0., 0.])
+    """
+    if distribution not in _DELAY_KERNEL_PARAMETERS:
+        raise ValueError(
+            f"Unknown delay kernel distribution '{distribution}', "
+            f"expected one of {list(_DELAY_KERNEL_PARAMETERS)}."
+        )
+    if set(params) != {_DELAY_KERNEL_PARAMETERS[distribution]}:
         raise ValueError(
-            f"Cannot discern the source of outcome '{outcome_name}'; it is not a previously defined outcome and there is no `incidence` or `prevalence`."
+            f"The '{distribution}' delay kernel takes exactly a "
+            f"'{_DELAY_KERNEL_PARAMETERS[distribution]}' parameter, given {list(params)}."
         )
-    # Filter the data
-    filters = filters[vtype]
-
-    # Initialize the array to store filtered incidence values
-    # Initialize the array to store filtered incidence values
-    incidI_arr = np.zeros((len(dates), len(subpops)))
-
-    diffI_filtered = diffI
-    for mc_type, mc_value in filters.items():
-        # Check if mc_value is a string or list of strings
-        if isinstance(mc_value, str):
-            mc_value = [mc_value]
-        # Filter data along the specified mc_type dimension
-        diffI_filtered = diffI_filtered.where(
-            diffI_filtered[f"mc_{mc_type}"].isin(mc_value), drop=True
+    kernel = np.zeros(ndays)
+    if mean <= 0:
+        kernel[0] = 1.0
+        return kernel
+    if distribution == "gamma":
+        dist = scipy.stats.gamma(a=params["shape"], scale=mean / params["shape"])
+    else:
+        dist = scipy.stats.lognorm(
+            s=params["sdlog"], scale=np.exp(np.log(mean) - params["sdlog"] ** 2 / 2)
         )
-    # Sum along the compartment dimension
-    incidI_arr += diffI_filtered[vtype].sum(dim="compartment")
+    return np.diff(dist.cdf(np.concatenate(([0.0], np.arange(ndays) + 0.5))))
+
+
+def _convolve_delay(arr: np.ndarray, delay: int, kernel: dict) -> np.ndarray:
+    """Spread all the columns of `arr` by the same delay kernel, see `apply_delays`."""
+    ndays = arr.shape[0]
+    weights = discretized_delay_kernel(delay, ndays, **kernel)
+    return scipy.signal.oaconvolve(arr, weights[:, np.newaxis], axes=0)[:ndays]
+
+
+def apply_delays(
+    arr: np.ndarray,
+    delays: npt.NDArray[np.int64],
+    kernel: dict | None = None,
+    rng: np.random.Generator | None = None,
+) -> np.ndarray:
+    """
+    Delay an outcome along its first (date) axis.
+
+    Without a `kernel` every `arr[i, j]` is moved to `arr[i + delays[i, j], j]` with
+    `multishift`. With a `kernel` it is instead spread over the following days by a
+    delay distribution of mean `delays[i, j]`, see `discretized_delay_kernel`. Given an
+    `rng` as well, each `arr[i, j]` is rounded to a count of individuals, which is
+    split over the following days with a multinomial draw from the delay
+    distribution, see `_multinomial_delays`.
+
+    Distributed delays are applied as one convolution over all the subpops sharing a
+    delay when the delays do not change in time. Piecewise-constant delays, as
+    produced by outcome modifiers, are split by distinct delay and summed back.
+
+    Args:
+        arr: The values to delay, an array of shape `[dates, subpops]`.
+        delays: The delays in days, an integer array of the same shape as `arr`.
+        kernel: The keyword arguments of `discretized_delay_kernel`, without the mean,
+            or `None` for fixed delays.
+        rng: The random generator to draw stochastic delays from, or `None` to spread
+            the values by their expected delay distribution.
+
+    Returns:
+        The delayed values, an array of the same shape as `arr`.
+    """
+    if kernel is None:
+        return multishift(arr, delays, stoch_delay_flag=False)
+    if rng is not None:
+        return multishift(arr, delays, stoch_delay_flag=True, kernel=kernel, rng=rng)
+    result = np.zeros(arr.shape)
+    if (delays == delays[0]).all():
+        for delay in np.unique(delays[0]):
+            columns = delays[0] == delay
+            result[:, columns] = _convolve_delay(arr[:, columns], delay, kernel)
+    else:
+        for delay in np.unique(delays):
+            result += _convolve_delay(np.where(delays == delay, arr, 0), delay, kernel)
+    return result
 
-    return incidI_arr.to_numpy()
+
+@jit(nopython=True, cache=True)
+def _multinomial_delays(
+    counts: npt.NDArray[np.int64],
+    kernel_indices: npt.NDArray[np.int64],
+    weights: npt.NDArray[np.float64],
+    rng: np.random.Generator,
+) -> npt.NDArray[np.float64]:
+    """
+    Split counts over the following days by multinomial draws from delay kernels.
+
+    The `counts[i, j]` individuals are distributed over days `i, i + 1, ...` of
+    column `j` by the delay probabilities `weights[kernel_indices[i, j]]`, drawing
+    the multinomial as a sequence of conditional binomials from `rng`. Individuals
+    delayed past the last day are dropped.
+
+    Args:
+        counts: The counts to delay, an array of shape `[dates, subpops]`.
+        kernel_indices: The row of `weights` to delay each count by.
+        weights: The delay kernels, an array of shape `[kernels, dates]` whose rows
+            sum to at most 1.
+        rng: The random generator to draw from, advanced in place.
+
+    Returns:
+        The delayed counts, an array of the same shape as `counts`.
+    """
+    ndays, nsubpops = counts.shape
+    result = np.zeros((ndays, nsubpops))
+    for i in range(ndays):
+        for j in range(nsubpops):
+            remaining = counts[i, j]
+            kernel = weights[kernel_indices[i, j]]
+            mass = 1.0
+            for k in range(ndays - i):
+                if remaining <= 0 or mass <= 0.0:
+                    break
+                p = min(max(kernel[k] / mass, 0.0), 1.0)
+                drawn = rng.binomial(remaining, p)
+                result[i + k, j] += drawn
+                remaining -= drawn
+                mass -= kernel[k]
+    return result
 
 
 @jit(nopython=True)
@@ -710,53 +1302,72 @@ def shift(arr, num, fill_value=0):
 
 
 def multishiftee(arr, shifts, stoch_delay_flag=True):
-    """Shift along first (0) axis"""
+    """Shift along first (0) axis, see `multishift`"""
+    if stoch_delay_flag:
+        return multishift(arr, shifts, stoch_delay_flag=True)
     result = np.zeros_like(arr)
+    for i, row in enumerate(arr):
+        for j, elem in enumerate(row):
+            if i + shifts[i][j] < arr.shape[0]:
+                result[i + shifts[i][j]][j] += elem
+    return result
 
-    if stoch_delay_flag:
-        raise NotImplementedError("`stoch_delay_flag` not supported yet.")
-        # for i, row in reversed(enumerate(np.rows(arr))):
-        #    for j,elem in reversed(enumerate(row)):
-        ## This function takes in :
-        ##  - elem (int > 0)
-        ##  - delay (single average delay)
-        ## and outputs
-        ##  - vector of fixed size where the k element stores # of people who are delayed by k
-        # percentages = np.random.multinomial(el<fixed based on delays[i][j]>)
-        #        cases = diff(round(cumsum(percentages)*elem))
-        #        for k,case in enumerate(cases):
-        #            results[i+k][j] = cases[k]
+
+def multishift(
+    arr: np.ndarray,
+    shifts: npt.NDArray[np.int64],
+    stoch_delay_flag: bool = True,
+    kernel: dict | None = None,
+    rng: np.random.Generator | None = None,
+) -> np.ndarray:
+    """
+    Shift along first (0) axis.
+
+    Every `arr[i, j]` is moved to `arr[i + shifts[i, j], j]`, values shifted past the
+    last day are dropped. With `stoch_delay_flag` each `arr[i, j]` is instead rounded to
+    a count of individuals whose delays are drawn with `_multinomial_delays`, from a
+    delay distribution of mean `shifts[i, j]` given a `kernel` and from the exact
+    delay `shifts[i, j]` otherwise.
+
+    Args:
+        arr: The values to shift, an array of shape `[dates, subpops]`.
+        shifts: The delays in days, an integer array of the same shape as `arr`.
+        stoch_delay_flag: Whether to draw the delays of individuals.
+        kernel: The keyword arguments of `discretized_delay_kernel`, without the mean,
+            of the delay distribution to draw from, or `None` for fixed delays.
+        rng: The random generator to draw the delays from, by default one seeded from
+            numpy's global random state, see `utils.global_random_generator`.
+
+    Returns:
+        The shifted values, an array of the same shape as `arr`.
+    """
+    if not stoch_delay_flag:
+        return _multishift(arr, shifts)
+    ndays = arr.shape[0]
+    delay_values = np.unique(shifts)
+    if kernel is None:
+        weights = np.zeros((len(delay_values), ndays))
+        for k, delay in enumerate(delay_values):
+            if delay < ndays:
+                weights[k, delay] = 1.0
     else:
-        for i, row in enumerate(arr):
-            for j, elem in enumerate(row):
-                if i + shifts[i][j] < arr.shape[0]:
-                    result[i + shifts[i][j]][j] += elem
-    return result
+        weights = np.stack(
+            [discretized_delay_kernel(delay, ndays, **kernel) for delay in delay_values]
+        )
+    return _multinomial_delays(
+        np.round(arr).astype(np.int64),
+        np.searchsorted(delay_values, shifts),
+        weights,
+        global_random_generator() if rng is None else rng,
+    )
 
 
 @jit(nopython=True)
-def multishift(arr, shifts, stoch_delay_flag=True):
-    """Shift along first (0) axis"""
+def _multishift(arr, shifts):
+    """Shift along first (0) axis, see `multishift`"""
     result = np.zeros_like(arr)
-
-    if stoch_delay_flag:
-        raise NotImplementedError("`stoch_delay_flag` not supported yet.")
-        # for i, row in reversed(enumerate(np.rows(arr))):
-        #    for j,elem in reversed(enumerate(row)):
-        ## This function takes in :
-        ##  - elem (int > 0)
-        ##  - delay (single average delay)
-        ## and outputs
-        ##  - vector of fixed size where the k element stores # of people who are delayed by k
-        # percentages = np.random.multinomial(el<fixed based on delays[i][j]>)
-        #        cases = diff(round(cumsum(percentages)*elem))
-        #        for k,case in enumerate(cases):
-        #            results[i+k][j] = cases[k]
-    else:
-        for i in range(
-            arr.shape[0]
-        ):  # numba nopython does not allow iterating over 2D array
-            for j in range(arr.shape[1]):
-                if i + shifts[i, j] < arr.shape[0]:
-                    result[i + shifts[i, j], j] += arr[i, j]
+    for i in range(arr.shape[0]):  # numba nopython does not allow iterating over 2D array
+        for j in range(arr.shape[1]):
+            if i + shifts[i, j] < arr.shape[0]:
+                result[i + shifts[i, j], j] += arr[i, j]
     return result
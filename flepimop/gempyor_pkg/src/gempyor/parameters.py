@@ -324,7 +324,7 @@ class Parameters:
             for idx, pn in enumerate(self.pnames):
                 npi_val = NPI.reduce_parameter(
                     parameter=p_draw[idx],
-                    modification=npi.getReduction(pn.lower()),
+                    modification=npi.getReductionArray(pn.lower()),
                     method=self.pdata[pn]["stacked_modifier_method"],
                 )
                 p_reduced[idx] = npi_val
@@ -9,6 +9,7 @@ import time
 import numpy as np
 import numpy.typing as npt
 import pandas as pd
+import pyarrow as pa
 import scipy
 import tqdm.contrib.concurrent
 import xarray as xr
@@ -90,6 +91,19 @@ def check_parameter_positivity(
         )
 
 
+# Integration methods accepted for `seir::integration::method`, mapped to the
+# `steps_rk4` method and whether its thread parallel kernels are used.
+_integration_engines = {
+    "rk4.jit": ("rk4", False),
+    "rk4.parallel": ("rk4", True),
+    "euler": ("euler", False),
+    "euler.parallel": ("euler", True),
+    "stochastic": ("stochastic", False),
+    "rk45": ("rk45", False),
+    "rk45.parallel": ("rk45", True),
+}
+
+
 def build_step_source_arg(
     modinf: ModelInfo,
     parsed_parameters,
@@ -107,7 +121,7 @@ def build_step_source_arg(
                 integration_method = "rk4.jit"
             if integration_method == "rk4":
                 integration_method = "rk4.jit"
-            if integration_method not in ["rk4.jit", "euler", "stochastic"]:
+            if integration_method not in _integration_engines:
                 raise ValueError(
                     f"Unknown integration method given, '{integration_method}'."
                 )
@@ -117,9 +131,22 @@ def build_step_source_arg(
             )  # ugly way to parse string and formulas
         else:
             dt = 2.0
+        # Error tolerances of the adaptive step `rk45` method, ignored by the others
+        rtol = (
+            float(modinf.seir_config["integration"]["rtol"].get())
+            if modinf.seir_config["integration"]["rtol"].exists()
+            else 1e-6
+        )
+        atol = (
+            float(modinf.seir_config["integration"]["atol"].get())
+            if modinf.seir_config["integration"]["atol"].exists()
+            else 1e-3
+        )
     else:
         integration_method = "rk4.jit"
         dt = 2.0
+        rtol = 1e-6
+        atol = 1e-3
         logging.info(
             f"Integration method not provided, assuming type {integration_method} with dt={dt}"
         )
@@ -173,6 +200,10 @@ def build_step_source_arg(
     assert type(modinf.subpop_pop[0]) == np.int64
 
     assert dt <= 1.0 or dt == 2.0
+    if rtol <= 0 or atol <= 0:
+        raise ValueError(
+            f"The integration tolerances must be positive, given rtol={rtol} and atol={atol}."
+        )
 
     fnct_args = {
         "ncompartments": modinf.compartments.compartments.shape[0],
@@ -180,6 +211,8 @@ def build_step_source_arg(
         "ndays": modinf.n_days,
         "parameters": parsed_parameters,
         "dt": dt,
+        "rtol": rtol,
+        "atol": atol,
         "integration_method": integration_method,
         "transitions": transition_array,
         "proportion_info": proportion_info,
@@ -223,15 +256,21 @@ def steps_SEIR(
 
     integration_method = fnct_args["integration_method"]
     fnct_args.pop("integration_method")
+    rtol, atol = fnct_args.pop("rtol"), fnct_args.pop("atol")
 
     logging.debug(f"Integrating with method {integration_method}")
 
-    if integration_method == "euler":
-        seir_sim = steps_rk4.rk4_integration(**fnct_args, method="euler")
-    elif integration_method == "stochastic":
-        seir_sim = steps_rk4.rk4_integration(**fnct_args, method="stochastic")
-    elif integration_method == "rk4.jit":
-        seir_sim = steps_rk4.rk4_integration(**fnct_args, silent=True)
+    if integration_method in _integration_engines:
+        method, parallel = _integration_engines[integration_method]
+        if method == "rk45":
+            fnct_args.pop("dt")
+            seir_sim = steps_rk4.rk45_integration(
+                **fnct_args, rtol=rtol, atol=atol, parallel=parallel
+            )
+        else:
+            seir_sim = steps_rk4.rk4_integration(
+                **fnct_args, method=method, silent=method == "rk4", parallel=parallel
+            )
     else:
         if integration_method in {
             "scipy.solve_ivp",
@@ -254,6 +293,148 @@ def steps_SEIR(
         raise ValueError(f"Unknown integration method given, '{integration_method}'.")
 
     # We return an xarray instead of a ndarray now
+    return _states_to_dataset(modinf, *seir_sim)
+
+
+def steps_SEIR_batch(
+    modinf: ModelInfo,
+    parsed_parameters: npt.NDArray[np.float64],
+    transition_array,
+    proportion_array,
+    proportion_info,
+    initial_conditions: npt.NDArray[np.float64],
+    seeding_data,
+    seeding_amounts: npt.NDArray[np.float64],
+) -> xr.Dataset:
+    """
+    Integrate a batch of parameter sets sharing the same model structure.
+
+    Batched counterpart of `steps_SEIR`, for example to evaluate all the proposals of
+    an emcee iteration in one pass instead of one process per proposal.
+
+    Args:
+        modinf: The ModelInfo object.
+        parsed_parameters: The parsed parameters of each batch member with shape
+            (batch, n_parameters, n_days, n_subpops).
+        transition_array: The transition array shared by the batch.
+        proportion_array: The proportion array shared by the batch.
+        proportion_info: The proportion info shared by the batch.
+        initial_conditions: The initial conditions of each batch member with shape
+            (batch, n_compartments, n_subpops).
+        seeding_data: The seeding structure shared by the batch.
+        seeding_amounts: The seeding amounts of each batch member with shape
+            (batch, n_seeding).
+
+    Returns:
+        The simulated prevalence and incidence, with a leading `batch` dimension.
+
+    Raises:
+        ValueError: If `parsed_parameters`, `initial_conditions` and `seeding_amounts`
+            do not agree on the batch size.
+        ValueError: If the parameters or initial conditions of the batch members do
+            not have the shapes of the model.
+        ValueError: If any parameter, initial condition or seeding amount is not
+            finite.
+        ValueError: If any batch member has negative parameters, listing every
+            offending member.
+        ValueError: If the integration method is the adaptive step `rk45`, which
+            does not have a batched engine.
+    """
+    batch_size = parsed_parameters.shape[0]
+    if len(initial_conditions) != batch_size or len(seeding_amounts) != batch_size:
+        raise ValueError(
+            f"The batch has {batch_size} parameter sets, but {len(initial_conditions)} "
+            f"initial conditions and {len(seeding_amounts)} seeding amounts."
+        )
+    ncompartments = modinf.compartments.compartments.shape[0]
+    if parsed_parameters.shape[2:] != (modinf.n_days, modinf.nsubpops) or (
+        initial_conditions.shape[1:] != (ncompartments, modinf.nsubpops)
+    ):
+        raise ValueError(
+            f"The batch members have parameters of shape {parsed_parameters.shape[1:]} "
+            f"and initial conditions of shape {initial_conditions.shape[1:]}, expected "
+            f"(n_parameters, {modinf.n_days}, {modinf.nsubpops}) and "
+            f"({ncompartments}, {modinf.nsubpops})."
+        )
+    for name, values in (
+        ("parameters", parsed_parameters),
+        ("initial conditions", initial_conditions),
+        ("seeding amounts", seeding_amounts),
+    ):
+        finite = np.isfinite(values).reshape(batch_size, -1).all(axis=1)
+        if not finite.all():
+            raise ValueError(
+                f"The {name} of batch members {np.flatnonzero(~finite).tolist()} "
+                "are not finite."
+            )
+
+    negative = (parsed_parameters < 0).reshape(batch_size, -1).any(axis=1)
+    if negative.any():
+        errors = []
+        for member in np.flatnonzero(negative):
+            _, days, subpops = np.nonzero(parsed_parameters[member] < 0)
+            neg_subpops = sorted({modinf.subpop_struct.subpop_names[k] for k in subpops})
+            errors.append(
+                f"member {member} in subpops {', '.join(neg_subpops)} starting from "
+                f"date {modinf.dates[days.min()].date()}"
+            )
+        raise ValueError(
+            f"There are negative parameters in batch members "
+            f"{np.flatnonzero(negative).tolist()}: {'; '.join(errors)}."
+        )
+
+    # The arguments shared by the batch are validated and built once
+    fnct_args = build_step_source_arg(
+        modinf,
+        parsed_parameters[0],
+        transition_array,
+        proportion_array,
+        proportion_info,
+        initial_conditions[0],
+        seeding_data,
+        seeding_amounts[0],
+    )
+    fnct_args.update(
+        parameters=parsed_parameters,
+        initial_conditions=initial_conditions,
+        seeding_amounts=seeding_amounts,
+    )
+
+    integration_method = fnct_args.pop("integration_method")
+    fnct_args.pop("rtol")
+    fnct_args.pop("atol")
+    logging.debug(f"Integrating a batch of {batch_size} with method {integration_method}")
+    method, parallel = _integration_engines[integration_method]
+    if method == "rk45":
+        raise ValueError(
+            f"The '{integration_method}' integration method does not support batches."
+        )
+    seir_sim = steps_rk4.rk4_integration_batch(
+        **fnct_args, method=method, silent=True, parallel=parallel
+    )
+    return _states_to_dataset(modinf, *seir_sim, batch=True)
+
+
+def _states_to_dataset(
+    modinf: ModelInfo,
+    prevalence: npt.NDArray[np.float64],
+    incidence: npt.NDArray[np.float64],
+    batch: bool = False,
+) -> xr.Dataset:
+    """
+    Wrap integrated prevalence and incidence arrays in an xarray Dataset.
+
+    Args:
+        modinf: The ModelInfo object.
+        prevalence: The prevalence with shape (n_days, n_compartments, n_subpops),
+            with a leading batch dimension if `batch`.
+        incidence: The incidence, with the same shape as `prevalence`.
+        batch: Whether the arrays have a leading batch dimension.
+
+    Returns:
+        A Dataset with `prevalence` and `incidence` variables indexed by date,
+        compartment (with coordinates for each compartment attribute) and subpop.
+    """
     compartment_coords = {}
     compartment_df = modinf.compartments.get_compartments_explicitDF()
     # Iterate over columns of the DataFrame and populate the dictionary
@@ -261,10 +442,11 @@ def steps_SEIR(
         compartment_coords[column] = ("compartment", compartment_df[column].tolist())
 
     # comparment is a dimension with coordinate from each of the compartments
+    dims = (["batch"] if batch else []) + ["date", "compartment", "subpop"]
     states = xr.Dataset(
         data_vars=dict(
-            prevalence=(["date", "compartment", "subpop"], seir_sim[0]),
-            incidence=(["date", "compartment", "subpop"], seir_sim[1]),
+            prevalence=(dims, prevalence),
+            incidence=(dims, incidence),
         ),
         coords=dict(
             date=pd.date_range(modinf.ti, modinf.tf, freq="D"),
@@ -317,7 +499,20 @@ def onerun_SEIR(
     load_ID: bool = False,
     sim_id2load: int = None,
     config=None,
-) -> pd.DataFrame:
+) -> pa.Table:
+    """
+    Run one SEIR simulation and write its outputs.
+
+    Args:
+        sim_id2write: The simulation ID to write.
+        modinf: The ModelInfo object.
+        load_ID: Whether to load the simulation ID.
+        sim_id2load: The simulation ID to load.
+        config: The configuration.
+
+    Returns:
+        The `.seir.` output table, as built by `states2Table`.
+    """
     npi = None
     if modinf.npi_config_seir:
         npi = build_npi_SEIR(
@@ -383,8 +578,8 @@ def onerun_SEIR(
     with Timer("onerun_SEIR.postprocess"):
         if modinf.write_csv or modinf.write_parquet:
             write_spar_snpi(sim_id2write, modinf, p_draw, npi)
-            out_df = write_seir(sim_id2write, modinf, states)
-    return out_df
+            out_table = write_seir(sim_id2write, modinf, states)
+    return out_table
 
 
 def _onerun_SEIR_with_random_seed(
@@ -394,7 +589,7 @@ def _onerun_SEIR_with_random_seed(
     load_ID: bool = False,
     sim_id2load: int = None,
     config=None,
-) -> pd.DataFrame:
+) -> pa.Table:
     """
     Wrapper function to `onerun_SEIR` that sets a random seed.
 
@@ -407,7 +602,8 @@ def _onerun_SEIR_with_random_seed(
         config: The configuration.
 
     Returns:
-        A pandas DataFrame containing the simulated SEIR output.
+        An Arrow table containing the simulated SEIR output, as built by
+        `states2Table`.
 
     See Also:
         `onerun_SEIR`
@@ -528,6 +724,55 @@ def states2Df(modinf: ModelInfo, states):
     return out_df
 
 
+def states2Table(modinf: ModelInfo, states) -> pa.Table:
+    """
+    Build the `.seir.` output table straight from the simulated states.
+
+    Produces the same rows and columns as `states2Df`, incidence before prevalence and
+    ordered by date then compartment, but without going through wide pandas frames.
+    The `mc_*` columns are dictionary encoded and the subpopulation columns wrap
+    contiguous numpy buffers.
+
+    Args:
+        modinf: The model info the states were simulated with.
+        states: An xarray Dataset with 'prevalence' and 'incidence' variables of shape
+            `(ndays, ncompartments, nsubpops)`.
+
+    Returns:
+        An Arrow table with the columns `mc_value_type`, the `mc_*` compartment
+        columns, one column per subpopulation and `date`.
+    """
+    dates = pd.date_range(modinf.ti, modinf.tf, freq="D")
+    compartments_df = modinf.compartments.get_compartments_explicitDF()
+    ndays, ncomp = len(dates), len(compartments_df)
+    nrows = ndays * ncomp
+
+    columns = {
+        "mc_value_type": pa.DictionaryArray.from_arrays(
+            np.repeat(np.arange(2, dtype=np.int32), nrows),
+            pa.array(["incidence", "prevalence"]),
+        )
+    }
+    for column in compartments_df.columns:
+        codes, uniques = pd.factorize(compartments_df[column])
+        columns[column] = pa.DictionaryArray.from_arrays(
+            np.tile(codes.astype(np.int32), 2 * ndays), pa.array(uniques)
+        )
+    # One transposed copy so that every subpop column is a contiguous buffer
+    incidence = states["incidence"].to_numpy().reshape(nrows, modinf.nsubpops)
+    prevalence = states["prevalence"].to_numpy().reshape(nrows, modinf.nsubpops)
+    values = np.empty(
+        (modinf.nsubpops, 2 * nrows), dtype=np.result_type(incidence, prevalence)
+    )
+    values[:, :nrows] = incidence.T
+    values[:, nrows:] = prevalence.T
+    for i, subpop in enumerate(modinf.subpop_struct.subpop_names):
+        columns[subpop] = pa.array(values[i])
+    columns["date"] = pa.array(np.tile(np.repeat(dates.values, ncomp), 2))
+
+    return pa.table(columns)
+
+
 def write_spar_snpi(sim_id: int, modinf: ModelInfo, p_draw, npi):
     # NPIs
     if npi is not None:
@@ -538,12 +783,30 @@ def write_spar_snpi(sim_id: int, modinf: ModelInfo, p_draw, npi):
     )
 
 
-def write_seir(sim_id, modinf: ModelInfo, states):
-    # print_disk_diagnosis()
-    out_df = states2Df(modinf, states)
-    modinf.write_simID(ftype="seir", sim_id=sim_id, df=out_df)
+def write_seir(sim_id, modinf: ModelInfo, states) -> pa.Table:
+    """
+    Write the `.seir.` output of a simulation.
 
-    return out_df
+    Args:
+        sim_id: The simulation ID to write.
+        modinf: The model info the states were simulated with.
+        states: The simulated states, as returned by `steps_SEIR`.
+
+    Returns:
+        The written table, as built by `states2Table`. Use `states2Df` for the same
+        rows as a pandas DataFrame indexed by date.
+    """
+    # print_disk_diagnosis()
+    out_table = states2Table(modinf, states)
+    output_config = modinf.seir_config["output"]
+    parquet_options = {}
+    if output_config["compression"].exists():
+        parquet_options["compression"] = output_config["compression"].as_str()
+    if output_config["row_group_size"].exists():
+        parquet_options["row_group_size"] = int(output_config["row_group_size"].get())
+    modinf.write_simID(ftype="seir", sim_id=sim_id, df=out_table, **parquet_options)
+
+    return out_table
 
 
 def log_debug_parameters(params, prefix):
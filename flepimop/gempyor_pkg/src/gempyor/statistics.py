@@ -8,12 +8,15 @@ statistics section.
 __all__ = ["Statistic"]
 
 
+import warnings
+
 import confuse
 import numpy as np
-from scipy.special import gammaln
-import scipy.stats
+import pandas as pd
 import xarray as xr
 
+from . import likelihoods
+
 
 class Statistic:
     """
@@ -113,6 +116,9 @@ class Statistic:
         if statistic_config["zero_to_one"].exists():
             self.zero_to_one = statistic_config["zero_to_one"].get()
 
+        self._resample_plans = {}
+        self._gt_cache = None
+
     def __str__(self) -> str:
         return (
             f"{self.name}: {self.dist} between {self.sim_var} "
@@ -190,6 +196,9 @@ class Statistic:
             A resample dataset with similar dimensions to `data`.
         """
         if self.resample:
+            plan = self._resample_plan(data)
+            if plan is not None:
+                return self._segment_reduce(data, *plan)
             aggregator_method = getattr(
                 data.resample(date=self.resample_freq), self.resample_aggregator_name
             )
@@ -197,6 +206,100 @@ class Statistic:
         else:
             return data
 
+    # Reductions by aggregator name, as (reduction, reduction skipping NaNs)
+    _segment_reductions = {
+        "sum": (np.sum, np.nansum),
+        "mean": (np.mean, np.nanmean),
+        "max": (np.max, np.nanmax),
+        "min": (np.min, np.nanmin),
+    }
+
+    def _resample_plan(self, data: xr.DataArray) -> tuple | None:
+        """
+        Get the plan to resample data with the dates of `data`.
+
+        The resampling bins of a sorted date coordinate are contiguous segments of it.
+        A plan is the labels of the bins and, for each segment length, the positions of
+        the bins of that length and the date indices of their segments. Plans are
+        computed once per date coordinate, which is the same for every evaluation of a
+        calibration.
+
+        Args:
+            data: An xarray dataset with "date" and "subpop" dimensions.
+
+        Returns:
+            A tuple of the bin labels and the segments grouped by length, or `None` if
+            the resampling cannot be done by segments, i.e. for an unsupported
+            aggregator, unsorted dates or empty bins.
+        """
+        if self.resample_aggregator_name not in self._segment_reductions:
+            return None
+        dates = data["date"].values
+        key = dates.tobytes()
+        if key not in self._resample_plans:
+            plan = None
+            if dates.size and np.all(dates[1:] > dates[:-1]):
+                counts = (
+                    pd.Series(np.ones(dates.size), index=pd.DatetimeIndex(dates))
+                    .resample(self.resample_freq)
+                    .count()
+                )
+                lengths = counts.to_numpy()
+                if (lengths > 0).all():
+                    starts = np.concatenate(([0], np.cumsum(lengths)[:-1]))
+                    segments = []
+                    for length in np.unique(lengths):
+                        bins = np.flatnonzero(lengths == length)
+                        segments.append((bins, starts[bins, None] + np.arange(length)))
+                    plan = (counts.index.to_numpy(), segments)
+            self._resample_plans[key] = plan
+        return self._resample_plans[key]
+
+    def _segment_reduce(
+        self, data: xr.DataArray, labels: np.ndarray, segments: list[tuple]
+    ) -> xr.DataArray:
+        """
+        Resample data by reducing the segments of its date dimension.
+
+        Segments of the same length are gathered and reduced together, so that each
+        bin is reduced by the same numpy reduction over the same number of dates as
+        with `data.resample(...)`, which gives the same result to the last bit.
+
+        Args:
+            data: An xarray dataset with "date" and "subpop" dimensions.
+            labels: The labels of the resampling bins.
+            segments: The positions of the bins and the date indices of their
+                segments, for each segment length.
+
+        Returns:
+            The same resampled dataset as `data.resample(...)` with the aggregator.
+        """
+        # Numpy sums along a dimension in an order that depends on the memory layout, so
+        # the segments are gathered in the memory order of `data`
+        values = data.values
+        memory_order = np.argsort([-stride for stride in values.strides], kind="stable")
+        values = values.transpose(memory_order)
+        axis = list(memory_order).index(data.get_axis_num("date"))
+        reduction = self._segment_reductions[self.resample_aggregator_name][
+            bool(self.resample_skipna)
+        ]
+        shape = list(values.shape)
+        shape[axis] = len(labels)
+        reduced = None
+        with warnings.catch_warnings():
+            # All NaN bins are NaN, as with xarray
+            warnings.simplefilter("ignore", RuntimeWarning)
+            for bins, indices in segments:
+                bin_values = reduction(np.take(values, indices, axis=axis), axis=axis + 1)
+                if reduced is None:
+                    reduced = np.empty(shape, dtype=bin_values.dtype)
+                reduced[(slice(None),) * axis + (bins,)] = bin_values
+        reduced = reduced.transpose(np.argsort(memory_order))
+
+        coords = {k: v for k, v in data.coords.items() if "date" not in v.dims}
+        coords["date"] = labels
+        return xr.DataArray(reduced, coords=coords, dims=data.dims, name=data.name)
+
     def apply_scale(self, data: xr.DataArray) -> xr.DataArray:
         """
         Scale a data set using the specified scaling function.
@@ -232,6 +335,10 @@ class Statistic:
         """
         Compute the log-likelihood of observing the ground truth given model output.
 
+        The ground truth terms of the likelihood are computed once and reused while
+        `llik` is called with the same `gt_data` object, so `gt_data` should not be
+        modified in place between calls.
+
         Args:
             model_data: An xarray Dataset of the model data with date and subpop
                 dimensions.
@@ -241,67 +348,54 @@ class Statistic:
         Returns:
             The log-likelihood of observing `gt_data` from the model `model_data` as an
             xarray DataArray with a "subpop" dimension.
-        """
 
-        dist_map = {
-            "pois": lambda gt_data, model_data: -model_data
-            + (gt_data * np.log(model_data))
-            - gammaln(gt_data + 1),
-            # >>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>
-            # OLD: # TODO: Swap out in favor of NEW
-            "norm": lambda gt_data, model_data, scale: scipy.stats.norm.logpdf(
-                gt_data, loc=model_data, scale=self.params.get("scale", scale)
-            ),
-            "norm_cov": lambda gt_data, model_data, scale: scipy.stats.norm.logpdf(
-                gt_data, loc=model_data, scale=scale * model_data.where(model_data > 5, 5)
-            ),
-            # >>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>
-            # NEW: names of distributions: `norm` --> `norm_homoskedastic`, `norm_cov`
-            # --> `norm_heteroskedastic`; names of input `scale` --> `sd`
-            "norm_homoskedastic": lambda gt_data, model_data, sd: scipy.stats.norm.logpdf(
-                gt_data, loc=model_data, scale=self.params.get("sd", sd)
-            ),  # scale = standard deviation
-            "norm_heteroskedastic": lambda gt_data, model_data, sd: scipy.stats.norm.logpdf(
-                gt_data, loc=model_data, scale=self.params.get("sd", sd) * model_data
-            ),  # scale = standard deviation
-            # >>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>
-            "nbinom": lambda gt_data, model_data, n, p: scipy.stats.nbinom.logpmf(
-                k=gt_data,
-                n=1.0 / self.params.get("alpha"),
-                p=1.0 / (1.0 + self.params.get("alpha") * model_data),
-            ),
-            "rmse": lambda gt_data, model_data: -np.log(
-                np.sqrt(np.nansum((gt_data - model_data) ** 2))
-            ),
-            "absolute_error": lambda gt_data, model_data: -np.log(
-                np.nansum(np.abs(gt_data - model_data))
-            ),
-        }
-        if self.dist not in dist_map:
+        Raises:
+            ValueError: If the `dist` attribute is not a supported distribution.
+        """
+        if self.dist not in likelihoods.KERNELS:
             raise ValueError(
                 f"Invalid distribution specified: '{self.dist}'. "
-                f"Valid distributions: '{dist_map.keys()}'."
+                f"Valid distributions: '{likelihoods.KERNELS.keys()}'."
             )
-        if self.dist in ["pois", "nbinom"]:
-            # pydata/xarray#4612
-            model_data = model_data.fillna(0.0).astype(int)
-            gt_data = gt_data.fillna(0.0).astype(int)
+        gt_terms_func, kernel = likelihoods.KERNELS[self.dist]
 
-        if self.zero_to_one:
-            # so confusing, wish I had not used xarray to do model_data[model_data==0]=1
-            model_data = model_data.where(model_data != 0, 1)
-            gt_data = gt_data.where(gt_data != 0, 1)
+        if self._gt_cache is None or self._gt_cache[0] is not gt_data:
+            gt_values = self._prepare_data(gt_data.values)
+            gt_terms = None
+            if gt_terms_func is not None:
+                with np.errstate(divide="ignore", invalid="ignore"):
+                    gt_terms = gt_terms_func(gt_values, **self.params)
+            self._gt_cache = (gt_data, gt_values, gt_terms)
+        _, gt_values, gt_terms = self._gt_cache
 
         # Use stored parameters in the distribution function call
-        likelihood = dist_map[self.dist](gt_data, model_data, **self.params)
-        if len(likelihood.shape) == 0:
+        likelihood = kernel(
+            gt_values, self._prepare_data(model_data.values), gt_terms, **self.params
+        )
+        if len(np.shape(likelihood)) == 0:
             # If the likelihood is a scalar, broadcast it to the shape of the data.
-            # Xarray used to do this, but not anymore after numpy/numpy#26889?
             likelihood = np.full(gt_data.shape, likelihood)
         likelihood = xr.DataArray(likelihood, coords=gt_data.coords, dims=gt_data.dims)
 
         return likelihood
 
+    def _prepare_data(self, values: np.ndarray) -> np.ndarray:
+        """
+        Prepare model or ground truth values for the likelihood kernel.
+
+        Args:
+            values: The values of a data set with date and subpop dimensions.
+
+        Returns:
+            The values as counts for count distributions, with zeros coerced to one if
+            the `zero_to_one` attribute is set.
+        """
+        if self.dist in ["pois", "nbinom"]:
+            values = np.where(np.isnan(values), 0.0, values).astype(int)
+        if self.zero_to_one:
+            values = np.where(values != 0, values, 1)
+        return values
+
     def compute_logloss(
         self, model_data: xr.Dataset, gt_data: xr.Dataset
     ) -> tuple[xr.DataArray, float]:
@@ -322,9 +416,34 @@ class Statistic:
         Raises:
             ValueError: If `model_data` and `gt_data` do not have the same shape.
         """
-        model_data = self.apply_transforms(model_data[self.sim_var])
-        gt_data = self.apply_transforms(gt_data[self.data_var])
+        return self.compute_transformed_logloss(
+            self.apply_transforms(model_data[self.sim_var]),
+            self.apply_transforms(gt_data[self.data_var]),
+        )
+
+    def compute_transformed_logloss(
+        self, model_data: xr.DataArray, gt_data: xr.DataArray
+    ) -> tuple[xr.DataArray, float]:
+        """
+        Compute the logistic loss of model output and ground truth already transformed.
 
+        This is `compute_logloss` for data that `apply_transforms` has already been
+        applied to, so that the ground truth can be transformed once and reused.
+
+        Args:
+            model_data: An xarray DataArray of the resampled and scaled `sim_var` model
+                data with date and subpop dimensions.
+            gt_data: An xarray DataArray of the resampled and scaled `data_var` ground
+                truth data with date and subpop dimensions.
+
+        Returns:
+            The logistic loss of observing `gt_data` from the model `model_data`
+            decomposed into the log-likelihood along the "subpop" dimension and
+            regularizations.
+
+        Raises:
+            ValueError: If `model_data` and `gt_data` do not have the same shape.
+        """
         if not model_data.shape == gt_data.shape:
             raise ValueError(
                 f"`model_data` and `gt_data` do not have "
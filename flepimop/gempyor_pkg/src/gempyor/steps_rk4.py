@@ -5,9 +5,9 @@ Oversees use of the rk4 algorithim for simulation.
 
 import logging
 import numpy as np
-from numba import jit
-import tqdm, scipy
-from .utils import Timer
+from numba import jit, prange
+import tqdm
+from .utils import Timer, global_random_generator
 
 (
     transition_source_col,
@@ -24,258 +24,1001 @@ proportion_exponent_col = 2
 float_tolerance = 1e-9
 
 
-def rk4_integration(
-    *,
-    ncompartments,  # 1
-    nspatial_nodes,  # 2
-    ndays,  # 3
-    parameters,  # 4
-    dt,  # 5
-    transitions,  # 6
-    proportion_info,  # 7
-    transition_sum_compartments,  # 8
-    initial_conditions,  # 9
-    seeding_data,  # 10
-    seeding_amounts,  # 11
-    mobility_data,  # 12
-    mobility_row_indices,  # 13
-    mobility_data_indices,  # 14
-    population,  # 15
-    method="rk4",
-    silent=False
-):
-    states = np.zeros((ndays, ncompartments, nspatial_nodes))
-    states_daily_incid = np.zeros((ndays, ncompartments, nspatial_nodes))
-    states_current = np.zeros((ncompartments, nspatial_nodes))
-    states_next = np.zeros((ncompartments, nspatial_nodes))
+percent_day_away = 0.5
 
-    ntransitions = transitions.shape[1]
+# Integer codes for the integration methods, numba kernels are compiled once and
+# cached on disk so they can not close over the method name like they used to.
+RK4_METHOD = 0
+EULER_METHOD = 1
+STOCHASTIC_METHOD = 2
 
-    ## Setting values
-    states_current = np.copy(initial_conditions)
-    states_next = states_current.copy()
+_method_codes = {"rk4": RK4_METHOD, "euler": EULER_METHOD, "stochastic": STOCHASTIC_METHOD}
+
+# Dormand-Prince 5(4) tableau used by `rk45_integration`: stage coefficients, 5th
+# order weights, error estimate weights (including the FSAL stage) and the
+# coefficients of the 4th order dense output polynomials in theta, theta^2, ...
+# The nodes are not needed, rates only depend on time through the day.
+dopri_a = np.array(
+    [
+        [0, 0, 0, 0, 0],
+        [1 / 5, 0, 0, 0, 0],
+        [3 / 40, 9 / 40, 0, 0, 0],
+        [44 / 45, -56 / 15, 32 / 9, 0, 0],
+        [19372 / 6561, -25360 / 2187, 64448 / 6561, -212 / 729, 0],
+        [9017 / 3168, -355 / 33, 46732 / 5247, 49 / 176, -5103 / 18656],
+    ]
+)
+dopri_b = np.array([35 / 384, 0, 500 / 1113, 125 / 192, -2187 / 6784, 11 / 84])
+dopri_e = np.array([-71 / 57600, 0, 71 / 16695, -71 / 1920, 17253 / 339200, -22 / 525, 1 / 40])
+dopri_p = np.array(
+    [
+        [1, -8048581381 / 2820520608, 8663915743 / 2820520608, -12715105075 / 11282082432],
+        [0, 0, 0, 0],
+        [0, 131558114200 / 32700410799, -68118460800 / 10900136933, 87487479700 / 32700410799],
+        [0, -1754552775 / 470086768, 14199869525 / 1410260304, -10690763975 / 1880347072],
+        [0, 127303824393 / 49829197408, -318862633887 / 49829197408, 701980252875 / 199316789632],
+        [0, -282668133 / 205662961, 2019193451 / 616988883, -1453857185 / 822651844],
+        [0, 40617522 / 29380423, -110615467 / 29380423, 69997945 / 29380423],
+    ]
+)
+adaptive_min_step = 1e-10
+
+
+def _method_code(method, parallel):
+    """
+    Resolve an integration method name to the integer code used by the kernels.
 
+    Raises:
+        ValueError: If `method` is unknown or if `parallel` is requested for the
+            stochastic method, which only has a serial engine.
+    """
+    if method not in _method_codes:
+        raise ValueError(f"Did not understand method == {method}")
+    if parallel and method == "stochastic":
+        raise ValueError("The stochastic method does not have a parallel engine.")
+    return _method_codes[method]
+
+
+@jit(nopython=True, cache=True)
+def _proportion_who_move(nspatial_nodes, mobility_data, mobility_data_indices, population):
     proportion_who_move = np.zeros((nspatial_nodes))
-    percent_day_away = 0.5
     for spatial_node in range(nspatial_nodes):
         proportion_who_move[spatial_node] = min(
             mobility_data[mobility_data_indices[spatial_node] : mobility_data_indices[spatial_node + 1]].sum()
             / population[spatial_node],
             1,
         )
+    return proportion_who_move
 
-    def rhs(t, x, today):
-        states_current = np.reshape(x, (2, ncompartments, nspatial_nodes))[0]
-        st_next = states_current.copy()  # this is used to make sure stochastic integration never goes below zero
-        transition_amounts = np.zeros((ntransitions, nspatial_nodes))  # keep track of the transitions
 
-        if (x < 0).any():
-            print("Integration error: rhs got a negative x (pos, time)", np.where(x < 0), t)
+@jit(nopython=True, cache=True)
+def _mixing_operator(nspatial_nodes, mobility_data, mobility_row_indices, mobility_data_indices, population):
+    """
+    Precompute the mobility mixing operator as a CSR matrix.
 
-        for transition_index in range(ntransitions):
-            total_rate = np.ones((nspatial_nodes))
-            first_proportion = True
+    Row `i` of the operator weighs the per capita force of infection of every
+    subpopulation felt by residents of `i`, who spend a share `1 - percent_day_away *
+    proportion_who_move[i]` of their time at home and a share `percent_day_away *
+    mobility[i, j] / population[i]` in subpopulation `j`. The operator is constant
+    over the run, so the mobility coupling of a transition is one sparse mat-vec.
 
-            # Each transition may have several proportional_to factors
-            for proportion_index in range(
-                transitions[transition_proportion_start_col][transition_index],
-                transitions[transition_proportion_stop_col][transition_index],
+    Returns:
+        A tuple of the data, column indices and row pointers of the operator.
+    """
+    proportion_who_move = _proportion_who_move(nspatial_nodes, mobility_data, mobility_data_indices, population)
+    mixing_data = np.zeros(nspatial_nodes + len(mobility_data))
+    mixing_indices = np.zeros(nspatial_nodes + len(mobility_data), dtype=np.int64)
+    mixing_indptr = np.zeros(nspatial_nodes + 1, dtype=np.int64)
+    position = 0
+    for spatial_node in range(nspatial_nodes):
+        mixing_data[position] = 1 - percent_day_away * proportion_who_move[spatial_node]
+        mixing_indices[position] = spatial_node
+        position += 1
+        for mobility_index in range(mobility_data_indices[spatial_node], mobility_data_indices[spatial_node + 1]):
+            mixing_data[position] = percent_day_away * mobility_data[mobility_index] / population[spatial_node]
+            mixing_indices[position] = mobility_row_indices[mobility_index]
+            position += 1
+        mixing_indptr[spatial_node + 1] = position
+    return mixing_data, mixing_indices, mixing_indptr
+
+
+@jit(nopython=True, cache=True)
+def _transition_rates(
+    t,
+    x,
+    today,
+    ncompartments,
+    nspatial_nodes,
+    parameters,
+    transitions,
+    proportion_info,
+    transition_sum_compartments,
+    mixing_data,
+    mixing_indices,
+    mixing_indptr,
+    population,
+):
+    """
+    Compute the source sizes and per capita rates of every transition.
+
+    Returns:
+        A tuple of two arrays of shape (ntransitions, nspatial_nodes), the number of
+        individuals in the source compartment and the total rate at which they move.
+    """
+    states_current = np.reshape(x, (2, ncompartments, nspatial_nodes))[0]
+    ntransitions = transitions.shape[1]
+    source_numbers = np.zeros((ntransitions, nspatial_nodes))
+    total_rates = np.ones((ntransitions, nspatial_nodes))
+
+    if (x < 0).any():
+        print("Integration error: rhs got a negative x (pos, time)", np.where(x < 0), t)
+
+    for transition_index in range(ntransitions):
+        total_rate = total_rates[transition_index]
+        first_proportion = True
+
+        # Each transition may have several proportional_to factors
+        for proportion_index in range(
+            transitions[transition_proportion_start_col][transition_index],
+            transitions[transition_proportion_stop_col][transition_index],
+        ):
+            # Compute the number of individuals in the compartments for this proportions
+            relevant_number_in_comp = np.zeros((nspatial_nodes))
+            relevant_exponent = np.ones((nspatial_nodes))
+            for proportion_sum_index in range(
+                proportion_info[proportion_sum_starts_col][proportion_index],
+                proportion_info[proportion_sum_stops_col][proportion_index],
             ):
-                # Compute the number of individuals in the compartments for this proportions
-                relevant_number_in_comp = np.zeros((nspatial_nodes))
-                relevant_exponent = np.ones((nspatial_nodes))
+                relevant_number_in_comp += states_current[transition_sum_compartments[proportion_sum_index]]
+
+            # exponents should not be a proportion, since we don't sum them over sum compartments
+            relevant_exponent = parameters[proportion_info[proportion_exponent_col][proportion_index]][today]
+
+            # chadi: i believe what this mean that the first proportion is always the
+            # source compartment. That's why there is nothing with n_spatial node here.
+            # but (TODO) we should enforce that ?
+            if first_proportion:
+                only_one_proportion = (
+                    transitions[transition_proportion_start_col][transition_index] + 1
+                ) == transitions[transition_proportion_stop_col][transition_index]
+                first_proportion = False
+                source_number = relevant_number_in_comp  # does this mean we need the first to be "source" ??? yes !
+                source_numbers[transition_index] = source_number
+                if source_number.max() > 0:
+                    total_rate[source_number > 0] *= (
+                        source_number[source_number > 0] ** relevant_exponent[source_number > 0]
+                        / source_number[source_number > 0]
+                    )
+                if only_one_proportion:
+                    total_rate *= parameters[transitions[transition_rate_col][transition_index]][today]
+            else:
+                # Per capita force of infection in each subpopulation, mixed by mobility
+                force = (
+                    relevant_number_in_comp**relevant_exponent
+                    / population
+                    * parameters[transitions[transition_rate_col][transition_index]][today]
+                )
+                for spatial_node in range(nspatial_nodes):
+                    mixed_force = 0.0
+                    for mixing_index in range(mixing_indptr[spatial_node], mixing_indptr[spatial_node + 1]):
+                        mixed_force += mixing_data[mixing_index] * force[mixing_indices[mixing_index]]
+                    total_rate[spatial_node] *= mixed_force
+
+    return source_numbers, total_rates
+
+
+@jit(nopython=True, parallel=True, cache=True)
+def _transition_rates_parallel(
+    t,
+    x,
+    today,
+    ncompartments,
+    nspatial_nodes,
+    parameters,
+    transitions,
+    proportion_info,
+    transition_sum_compartments,
+    mixing_data,
+    mixing_indices,
+    mixing_indptr,
+    population,
+):
+    """
+    Thread parallel counterpart of `_transition_rates`.
+
+    Subpopulations are split across threads, first to compute the source terms and
+    the per capita forces of infection, then to mix those forces with the mobility
+    operator. Every value is computed by a single thread with the same arithmetic as
+    `_transition_rates`, so the result does not depend on the number of threads.
+    """
+    states_current = np.reshape(x, (2, ncompartments, nspatial_nodes))[0]
+    ntransitions = transitions.shape[1]
+    source_numbers = np.zeros((ntransitions, nspatial_nodes))
+    total_rates = np.ones((ntransitions, nspatial_nodes))
+    forces = np.zeros((proportion_info.shape[1], nspatial_nodes))
+
+    if (x < 0).any():
+        print("Integration error: rhs got a negative x (pos, time)", np.where(x < 0), t)
+
+    for spatial_node in prange(nspatial_nodes):
+        for transition_index in range(ntransitions):
+            first_proportion_index = transitions[transition_proportion_start_col][transition_index]
+            last_proportion_index = transitions[transition_proportion_stop_col][transition_index]
+            rate = parameters[transitions[transition_rate_col][transition_index]][today][spatial_node]
+            for proportion_index in range(first_proportion_index, last_proportion_index):
+                relevant_number_in_comp = 0.0
                 for proportion_sum_index in range(
                     proportion_info[proportion_sum_starts_col][proportion_index],
                     proportion_info[proportion_sum_stops_col][proportion_index],
                 ):
-                    relevant_number_in_comp += states_current[transition_sum_compartments[proportion_sum_index]]
-
-                # exponents should not be a proportion, since we don't sum them over sum compartments
-                relevant_exponent = parameters[proportion_info[proportion_exponent_col][proportion_index]][today]
-
-                # chadi: i believe what this mean that the first proportion is always the
-                # source compartment. That's why there is nothing with n_spatial node here.
-                # but (TODO) we should enforce that ?
-                if first_proportion:
-                    only_one_proportion = (
-                        transitions[transition_proportion_start_col][transition_index] + 1
-                    ) == transitions[transition_proportion_stop_col][transition_index]
-                    first_proportion = False
-                    source_number = relevant_number_in_comp  # does this mean we need the first to be "source" ??? yes !
-                    if source_number.max() > 0:
-                        total_rate[source_number > 0] *= (
-                            source_number[source_number > 0] ** relevant_exponent[source_number > 0]
-                            / source_number[source_number > 0]
+                    relevant_number_in_comp += states_current[transition_sum_compartments[proportion_sum_index]][
+                        spatial_node
+                    ]
+                relevant_exponent = parameters[proportion_info[proportion_exponent_col][proportion_index]][today][
+                    spatial_node
+                ]
+                if proportion_index == first_proportion_index:
+                    source_numbers[transition_index][spatial_node] = relevant_number_in_comp
+                    if relevant_number_in_comp > 0:
+                        total_rates[transition_index][spatial_node] *= (
+                            relevant_number_in_comp**relevant_exponent / relevant_number_in_comp
                         )
-                    if only_one_proportion:
-                        total_rate *= parameters[transitions[transition_rate_col][transition_index]][today]
+                    if first_proportion_index + 1 == last_proportion_index:
+                        total_rates[transition_index][spatial_node] *= rate
                 else:
-                    for spatial_node in range(nspatial_nodes):
-                        proportion_keep_compartment = 1 - percent_day_away * proportion_who_move[spatial_node]
-                        proportion_change_compartment = (
-                            percent_day_away
-                            * mobility_data[
-                                mobility_data_indices[spatial_node] : mobility_data_indices[spatial_node + 1]
-                            ]
-                            / population[spatial_node]
-                        )
-                        rate_keep_compartment = (
-                            proportion_keep_compartment
-                            * relevant_number_in_comp[spatial_node] ** relevant_exponent[spatial_node]
-                            / population[spatial_node]
-                            * parameters[transitions[transition_rate_col][transition_index]][today][spatial_node]
-                        )
+                    forces[proportion_index][spatial_node] = (
+                        relevant_number_in_comp**relevant_exponent / population[spatial_node] * rate
+                    )
 
-                        visiting_subpop = mobility_row_indices[
-                            mobility_data_indices[spatial_node] : mobility_data_indices[spatial_node + 1]
-                        ]
+    for spatial_node in prange(nspatial_nodes):
+        for transition_index in range(ntransitions):
+            for proportion_index in range(
+                transitions[transition_proportion_start_col][transition_index] + 1,
+                transitions[transition_proportion_stop_col][transition_index],
+            ):
+                mixed_force = 0.0
+                for mixing_index in range(mixing_indptr[spatial_node], mixing_indptr[spatial_node + 1]):
+                    mixed_force += mixing_data[mixing_index] * forces[proportion_index][mixing_indices[mixing_index]]
+                total_rates[transition_index][spatial_node] *= mixed_force
+
+    return source_numbers, total_rates
+
+
+@jit(nopython=True, cache=True)
+def _rhs(
+    t,
+    x,
+    today,
+    dt,
+    method,
+    parallel,
+    ncompartments,
+    nspatial_nodes,
+    parameters,
+    transitions,
+    proportion_info,
+    transition_sum_compartments,
+    mixing_data,
+    mixing_indices,
+    mixing_indptr,
+    population,
+):
+    """
+    Deterministic right hand side, the amount moved by each transition.
+
+    For `RK4_METHOD` this is the instantaneous flow, for `EULER_METHOD` the rate is
+    compounded over `dt` so the amount already includes the time step. With
+    `parallel` the rates are computed by `_transition_rates_parallel`.
+    """
+    if parallel:
+        source_numbers, total_rates = _transition_rates_parallel(
+            t,
+            x,
+            today,
+            ncompartments,
+            nspatial_nodes,
+            parameters,
+            transitions,
+            proportion_info,
+            transition_sum_compartments,
+            mixing_data,
+            mixing_indices,
+            mixing_indptr,
+            population,
+        )
+    else:
+        source_numbers, total_rates = _transition_rates(
+            t,
+            x,
+            today,
+            ncompartments,
+            nspatial_nodes,
+            parameters,
+            transitions,
+            proportion_info,
+            transition_sum_compartments,
+            mixing_data,
+            mixing_indices,
+            mixing_indptr,
+            population,
+        )
+    # compute the number of individual transitioning from source to destination from the total rate
+    if method == RK4_METHOD:
+        return source_numbers * total_rates
+    return source_numbers * (1.0 - np.exp(-dt * total_rates))
 
-                        rate_change_compartment = proportion_change_compartment * (
-                            relevant_number_in_comp[visiting_subpop] ** relevant_exponent[visiting_subpop]
-                        )
-                        rate_change_compartment /= population[visiting_subpop]
-                        rate_change_compartment *= parameters[transitions[transition_rate_col][transition_index]][
-                            today
-                        ][visiting_subpop]
-                        total_rate[spatial_node] *= (rate_keep_compartment + rate_change_compartment.sum())
-
-            # compute the number of individual transitioning from source to destination from the total rate
-            # number_move has shape (nspatial_nodes)
-            if method == "rk4":
-                number_move = source_number * total_rate
-            elif method == "euler" or method == "stochastic":
-                compound_adjusted_rate = 1.0 - np.exp(-dt * total_rate)
-                number_move = source_number * compound_adjusted_rate  ## to initialize typ
-                if method == "stochastic":
-                    for spatial_node in range(nspatial_nodes):
-                        number_move[spatial_node] = np.random.binomial(
-                            # number_move[spatial_node] = random.binomial(
-                            source_number[spatial_node],
-                            compound_adjusted_rate[spatial_node],
-                        )
-                elif method == "euler":
-                    pass
-                else:
-                    raise ValueError(f"Did not understand method == {method}")
 
-            transition_amounts[transition_index] = number_move
+@jit(nopython=True, cache=True)
+def _stochastic_rhs(
+    t,
+    x,
+    today,
+    dt,
+    rng,
+    ncompartments,
+    nspatial_nodes,
+    parameters,
+    transitions,
+    proportion_info,
+    transition_sum_compartments,
+    mixing_data,
+    mixing_indices,
+    mixing_indptr,
+    population,
+):
+    """
+    Stochastic right hand side, a binomial tau-leap of every transition over `dt`.
 
-        return transition_amounts
-        # for spatial_node in range(nspatial_nodes):
-        #    if number_move[spatial_node] > states_current[transitions[transition_source_col][transition_index]][spatial_node]:
-        #        number_move[spatial_node] = states_current[transitions[transition_source_col][transition_index]][spatial_node]
+    Each of the individuals in the source of a transition leaves with the compounded
+    probability `1 - exp(-dt * rate)`, drawn from the `numpy.random.Generator` `rng`.
+    """
+    source_numbers, total_rates = _transition_rates(
+        t,
+        x,
+        today,
+        ncompartments,
+        nspatial_nodes,
+        parameters,
+        transitions,
+        proportion_info,
+        transition_sum_compartments,
+        mixing_data,
+        mixing_indices,
+        mixing_indptr,
+        population,
+    )
+    compound_adjusted_rates = 1.0 - np.exp(-dt * total_rates)
+    transition_amounts = np.zeros_like(source_numbers)
+    for transition_index in range(transitions.shape[1]):
+        for spatial_node in range(nspatial_nodes):
+            transition_amounts[transition_index][spatial_node] = rng.binomial(
+                int(source_numbers[transition_index][spatial_node]),
+                compound_adjusted_rates[transition_index][spatial_node],
+            )
+    return transition_amounts
 
-    if method == "rk4" or method == "euler":
-        rhs = jit(nopython=True)(rhs)
 
-    @jit(nopython=True)
-    def update_states(states, delta_t, transition_amounts):
-        states_diff = np.zeros((2, ncompartments, nspatial_nodes))  # first dim: 0 -> states_diff, 1: states_cum
-        st_next = states.copy()
-        st_next = np.reshape(st_next, (2, ncompartments, nspatial_nodes))
-        if method == "rk4":
-            # we move by delta_t * transitions, in case of rk4
-            # when we use euler, the compound_adjusted_rate  already
-            # includes the time step
-            transition_amounts = transition_amounts.copy() * delta_t
+@jit(nopython=True, parallel=True, cache=True)
+def _update_states_parallel(states, delta_t, transition_amounts, ncompartments, nspatial_nodes, transitions, method):
+    """
+    Thread parallel counterpart of `_update_states`, splitting subpopulations across threads.
 
+    Transitions only move individuals within a subpopulation, so each thread applies
+    all the transitions of its subpopulations in the same order as `_update_states`.
+    """
+    ntransitions = transitions.shape[1]
+    states_diff = np.zeros((2, ncompartments, nspatial_nodes))  # first dim: 0 -> states_diff, 1: states_cum
+    st_next = np.reshape(states, (2, ncompartments, nspatial_nodes))[0].copy()
+    transition_amounts = transition_amounts.copy()
+    if method == RK4_METHOD:
+        transition_amounts *= delta_t
+
+    for spatial_node in prange(nspatial_nodes):
         for transition_index in range(ntransitions):
-            for spatial_node in range(nspatial_nodes):
-                if transition_amounts[transition_index][spatial_node] < 0:
-                    print(
-                        "Integration error: transition amounts negative (trans_idx, node)",
-                        transition_index,
-                        spatial_node,
-                    )
-                if (
-                    transition_amounts[transition_index][spatial_node]
-                    >= st_next[0][transitions[transition_source_col][transition_index]][spatial_node] - float_tolerance
-                ):
-                    transition_amounts[transition_index][spatial_node] = max(
-                        st_next[0][transitions[transition_source_col][transition_index]][spatial_node]
-                        - float_tolerance,
-                        0,
-                    )
-            st_next[0][transitions[transition_source_col][transition_index]] -= transition_amounts[transition_index]
-            st_next[0][transitions[transition_destination_col][transition_index]] += transition_amounts[
-                transition_index
-            ]
-
-            states_diff[0, transitions[transition_source_col][transition_index]] -= transition_amounts[transition_index]
-            states_diff[0, transitions[transition_destination_col][transition_index]] += transition_amounts[
-                transition_index
-            ]
-            states_diff[1, transitions[transition_destination_col][transition_index], :] += transition_amounts[
-                transition_index
-            ]  # Cumumlative
-
-        return states + np.reshape(states_diff, states_diff.size)
-
-    @jit(nopython=True, fastmath=True)
-    def rk4_integrate(t, x, today):
-        k1 = rhs(t, x, today)
-        k2 = rhs(t + dt / 2, update_states(x, dt / 2, k1), today)
-        k3 = rhs(t + dt / 2, update_states(x, dt / 2, k2), today)
-        k4 = rhs(t + dt, update_states(x, dt, k3), today)
-        return update_states(x, dt / 6, (k1 + 2 * k2 + 2 * k3 + k4))
+            source = transitions[transition_source_col][transition_index]
+            destination = transitions[transition_destination_col][transition_index]
+            amount = transition_amounts[transition_index][spatial_node]
+            if amount < 0:
+                print(
+                    "Integration error: transition amounts negative (trans_idx, node)",
+                    transition_index,
+                    spatial_node,
+                )
+            if amount >= st_next[source][spatial_node] - float_tolerance:
+                amount = max(st_next[source][spatial_node] - float_tolerance, 0.0)
+            st_next[source][spatial_node] -= amount
+            st_next[destination][spatial_node] += amount
 
-    yesterday = -1
-    times = np.arange(0, (ndays - 1) + 1e-7, dt)
+            states_diff[0, source, spatial_node] -= amount
+            states_diff[0, destination, spatial_node] += amount
+            states_diff[1, destination, spatial_node] += amount  # Cumumlative
 
-    for time_index, time in tqdm.tqdm(enumerate(times), disable=silent):  # , total=len(times)
-        today = int(np.floor(time))
-        is_a_new_day = today != yesterday
-        yesterday = today
+    return states + np.reshape(states_diff, states_diff.size)
 
-        if is_a_new_day:
-            # Prevalence is saved at the begining of the day, while incidence is during the day
-            states[today, :, :] = states_next
-            for seeding_instance_idx in range(
-                seeding_data["day_start_idx"][today],
-                seeding_data["day_start_idx"][min(today + int(np.ceil(dt)), len(seeding_data["day_start_idx"]) - 1)],
+
+@jit(nopython=True, cache=True)
+def _update_states(states, delta_t, transition_amounts, ncompartments, nspatial_nodes, transitions, method, parallel):
+    if parallel:
+        return _update_states_parallel(
+            states, delta_t, transition_amounts, ncompartments, nspatial_nodes, transitions, method
+        )
+    ntransitions = transitions.shape[1]
+    states_diff = np.zeros((2, ncompartments, nspatial_nodes))  # first dim: 0 -> states_diff, 1: states_cum
+    st_next = states.copy()
+    st_next = np.reshape(st_next, (2, ncompartments, nspatial_nodes))
+    if method == RK4_METHOD:
+        # we move by delta_t * transitions, in case of rk4
+        # when we use euler, the compound_adjusted_rate  already
+        # includes the time step
+        transition_amounts = transition_amounts.copy() * delta_t
+
+    for transition_index in range(ntransitions):
+        for spatial_node in range(nspatial_nodes):
+            if transition_amounts[transition_index][spatial_node] < 0:
+                print(
+                    "Integration error: transition amounts negative (trans_idx, node)",
+                    transition_index,
+                    spatial_node,
+                )
+            if (
+                transition_amounts[transition_index][spatial_node]
+                >= st_next[0][transitions[transition_source_col][transition_index]][spatial_node] - float_tolerance
             ):
-                this_seeding_amounts = seeding_amounts[seeding_instance_idx]
-                seeding_subpops = seeding_data["seeding_subpops"][seeding_instance_idx]
-                seeding_sources = seeding_data["seeding_sources"][seeding_instance_idx]
-                seeding_destinations = seeding_data["seeding_destinations"][seeding_instance_idx]
-                # this_seeding_amounts = this_seeding_amounts < states_next[seeding_sources] ?  this_seeding_amounts : states_next[seeding_instance_idx]
-                states_next[seeding_sources][seeding_subpops] -= this_seeding_amounts
-                states_next[seeding_sources][seeding_subpops] = states_next[seeding_sources][seeding_subpops] * (
-                    states_next[seeding_sources][seeding_subpops] > 0
+                transition_amounts[transition_index][spatial_node] = max(
+                    st_next[0][transitions[transition_source_col][transition_index]][spatial_node]
+                    - float_tolerance,
+                    0,
                 )
-                states_next[seeding_destinations][seeding_subpops] += this_seeding_amounts
-
-                # ADD TO cumulative, this is debatable,
-                states_daily_incid[today][seeding_destinations][seeding_subpops] += this_seeding_amounts
-
-        x_ = np.zeros((2, ncompartments, nspatial_nodes))
-        x_[0] = states_next
-        x_ = np.reshape(x_, x_.size)
-        if method == "rk4":
-            sol = rk4_integrate(time, x_, today)
-        elif method == "euler" or method == "stochastic":
-            sol = update_states(x_, dt, rhs(time, x_, today))
-        x_ = np.reshape(sol, (2, ncompartments, nspatial_nodes))
-        states_daily_incid[today] += x_[1]
-        states_next = x_[0]
+        st_next[0][transitions[transition_source_col][transition_index]] -= transition_amounts[transition_index]
+        st_next[0][transitions[transition_destination_col][transition_index]] += transition_amounts[
+            transition_index
+        ]
 
-    if dt == 2.0:  # smooth prevalence:
-        states_f = scipy.interpolate.interp1d(
-            np.arange(ndays, step=2),
-            states[::2, :, :],
-            axis=0,
-            kind="linear",
-            bounds_error=False,  # necessary in some case, for some ti and tf
-            fill_value="extrapolate",  # necessary in some case, for some ti and tf
+        states_diff[0, transitions[transition_source_col][transition_index]] -= transition_amounts[transition_index]
+        states_diff[0, transitions[transition_destination_col][transition_index]] += transition_amounts[
+            transition_index
+        ]
+        states_diff[1, transitions[transition_destination_col][transition_index], :] += transition_amounts[
+            transition_index
+        ]  # Cumumlative
+
+    return states + np.reshape(states_diff, states_diff.size)
+
+
+@jit(nopython=True, fastmath=True, cache=True)
+def _rk4_integrate(
+    t,
+    x,
+    today,
+    dt,
+    parallel,
+    ncompartments,
+    nspatial_nodes,
+    parameters,
+    transitions,
+    proportion_info,
+    transition_sum_compartments,
+    mixing_data,
+    mixing_indices,
+    mixing_indptr,
+    population,
+):
+    model = (
+        ncompartments,
+        nspatial_nodes,
+        parameters,
+        transitions,
+        proportion_info,
+        transition_sum_compartments,
+        mixing_data,
+        mixing_indices,
+        mixing_indptr,
+        population,
+    )
+    k1 = _rhs(t, x, today, dt, RK4_METHOD, parallel, *model)
+    k2 = _rhs(
+        t + dt / 2,
+        _update_states(x, dt / 2, k1, ncompartments, nspatial_nodes, transitions, RK4_METHOD, parallel),
+        today,
+        dt,
+        RK4_METHOD,
+        parallel,
+        *model,
+    )
+    k3 = _rhs(
+        t + dt / 2,
+        _update_states(x, dt / 2, k2, ncompartments, nspatial_nodes, transitions, RK4_METHOD, parallel),
+        today,
+        dt,
+        RK4_METHOD,
+        parallel,
+        *model,
+    )
+    k4 = _rhs(
+        t + dt,
+        _update_states(x, dt, k3, ncompartments, nspatial_nodes, transitions, RK4_METHOD, parallel),
+        today,
+        dt,
+        RK4_METHOD,
+        parallel,
+        *model,
+    )
+    return _update_states(
+        x, dt / 6, (k1 + 2 * k2 + 2 * k3 + k4), ncompartments, nspatial_nodes, transitions, RK4_METHOD, parallel
+    )
+
+
+@jit(nopython=True, cache=True)
+def _apply_seeding(
+    today,
+    dt,
+    states_next,
+    states_daily_incid,
+    day_start_idx,
+    seeding_sources,
+    seeding_destinations,
+    seeding_subpops,
+    seeding_amounts,
+):
+    for seeding_instance_idx in range(
+        day_start_idx[today],
+        day_start_idx[min(today + int(np.ceil(dt)), len(day_start_idx) - 1)],
+    ):
+        this_seeding_amounts = seeding_amounts[seeding_instance_idx]
+        seeding_subpop = seeding_subpops[seeding_instance_idx]
+        seeding_source = seeding_sources[seeding_instance_idx]
+        seeding_destination = seeding_destinations[seeding_instance_idx]
+        # this_seeding_amounts = this_seeding_amounts < states_next[seeding_sources] ?  this_seeding_amounts : states_next[seeding_instance_idx]
+        states_next[seeding_source][seeding_subpop] -= this_seeding_amounts
+        states_next[seeding_source][seeding_subpop] = states_next[seeding_source][seeding_subpop] * (
+            states_next[seeding_source][seeding_subpop] > 0
         )
-        states = states_f(np.arange(ndays))
+        states_next[seeding_destination][seeding_subpop] += this_seeding_amounts
 
-        # states_i_f = scipy.interpolate.interp1d(np.arange(ndays, step=2), states_daily_incid[::2, :, :], axis=0, kind="linear")
-        # states_daily_incid = states_i_f(np.arange(ndays)) / 2
-        ## error is smaller with this bellow, but there should be even smarter ways of doing this TODO
-        states_daily_incid = states_daily_incid / 2
-        states_daily_incid[1::2, :, :] = states_daily_incid[:-1:2, :, :]
+        # ADD TO cumulative, this is debatable,
+        states_daily_incid[today][seeding_destination][seeding_subpop] += this_seeding_amounts
+
+
+@jit(nopython=True, cache=True)
+def _integrate_steps(
+    step_start,
+    step_stop,
+    times,
+    yesterday,
+    states,
+    states_daily_incid,
+    states_next,
+    dt,
+    method,
+    parallel,
+    seeding,
+    model,
+):
+    """
+    Integrate the time steps `times[step_start:step_stop]` in place.
+
+    Prevalence is written to `states` at the beginning of each new day, after which
+    that day's seeding is injected, and the daily incidence is accumulated in
+    `states_daily_incid`. Deterministic methods only, see `_integrate_steps_stochastic`.
+
+    Returns:
+        A tuple of the states after the last step and the last day integrated, to be
+        passed back in when integrating the following steps.
+    """
+    ncompartments, nspatial_nodes, transitions = model[0], model[1], model[3]
+    x_ = np.zeros(2 * ncompartments * nspatial_nodes)
+    x_3d = np.reshape(x_, (2, ncompartments, nspatial_nodes))
+    for time_index in range(step_start, step_stop):
+        time = times[time_index]
+        today = int(np.floor(time))
+        if today != yesterday:
+            # Prevalence is saved at the begining of the day, while incidence is during the day
+            states[today] = states_next
+            _apply_seeding(today, dt, states_next, states_daily_incid, *seeding)
+        yesterday = today
+
+        x_3d[0] = states_next
+        x_3d[1] = 0.0
+        if method == RK4_METHOD:
+            sol = _rk4_integrate(time, x_, today, dt, parallel, *model)
+        else:
+            sol = _update_states(
+                x_,
+                dt,
+                _rhs(time, x_, today, dt, method, parallel, *model),
+                ncompartments,
+                nspatial_nodes,
+                transitions,
+                method,
+                parallel,
+            )
+        sol = np.reshape(sol, (2, ncompartments, nspatial_nodes))
+        states_daily_incid[today] += sol[1]
+        states_next = sol[0].copy()
+    return states_next, yesterday
+
+
+@jit(nopython=True, cache=True)
+def _integrate_steps_stochastic(
+    step_start,
+    step_stop,
+    times,
+    yesterday,
+    states,
+    states_daily_incid,
+    states_next,
+    dt,
+    method,
+    parallel,
+    seeding,
+    model,
+    rng,
+):
+    """
+    Counterpart of `_integrate_steps` for the stochastic method.
 
+    The binomial draws of `_stochastic_rhs` come from the `numpy.random.Generator`
+    `rng`, whose state is advanced in place so that successive calls continue the
+    same stream.
+    """
+    ncompartments, nspatial_nodes, transitions = model[0], model[1], model[3]
+    for time_index in range(step_start, step_stop):
+        time = times[time_index]
+        today = int(np.floor(time))
+        if today != yesterday:
+            states[today] = states_next
+            _apply_seeding(today, dt, states_next, states_daily_incid, *seeding)
+        yesterday = today
+
+        x_ = np.zeros(2 * ncompartments * nspatial_nodes)
+        np.reshape(x_, (2, ncompartments, nspatial_nodes))[0] = states_next
+        sol = _update_states(
+            x_,
+            dt,
+            _stochastic_rhs(time, x_, today, dt, rng, *model),
+            ncompartments,
+            nspatial_nodes,
+            transitions,
+            method,
+            False,
+        )
+        sol = np.reshape(sol, (2, ncompartments, nspatial_nodes))
+        states_daily_incid[today] += sol[1]
+        states_next = sol[0].copy()
+    return states_next, yesterday
+
+
+@jit(nopython=True, cache=True)
+def _smooth_two_day_steps(states, states_daily_incid):
+    """
+    Fill in the odd days of an integration done with `dt == 2`.
+
+    Prevalence is linearly interpolated (and extrapolated past the last even day)
+    between the even days with the same arithmetic as `scipy.interpolate.interp1d`,
+    incidence is split evenly over the two days of each step.
+    """
+    ndays = states.shape[0]
+    nknots = (ndays + 1) // 2
+    smoothed = np.empty_like(states)
+    for day in range(ndays):
+        hi = min(max((day + 1) // 2, 1), nknots - 1)
+        lo = hi - 1
+        slope = (states[2 * hi] - states[2 * lo]) / (2 * hi - 2 * lo)
+        smoothed[day] = slope * (day - 2 * lo) + states[2 * lo]
+
+    ## error is smaller with this bellow, but there should be even smarter ways of doing this TODO
+    smoothed_incid = states_daily_incid / 2
+    for day in range(1, ndays, 2):
+        smoothed_incid[day] = smoothed_incid[day - 1]
+    return smoothed, smoothed_incid
+
+
+@jit(nopython=True, cache=True)
+def _integrate_member(
+    member,
+    times,
+    states,
+    states_daily_incid,
+    initial_conditions,
+    dt,
+    method,
+    seeding_index,
+    seeding_amounts,
+    parameters,
+    structure,
+):
+    """
+    Integrate the batch member `member` in place, see `_integrate_batch`.
+    """
+    model = (
+        structure[0],
+        structure[1],
+        parameters[member],
+        structure[2],
+        structure[3],
+        structure[4],
+        structure[5],
+        structure[6],
+        structure[7],
+        structure[8],
+    )
+    seeding = (*seeding_index, seeding_amounts[member])
+    _integrate_steps(
+        0,
+        len(times),
+        times,
+        -1,
+        states[member],
+        states_daily_incid[member],
+        initial_conditions[member].copy(),
+        dt,
+        method,
+        False,
+        seeding,
+        model,
+    )
+    if dt == 2.0:
+        smoothed, smoothed_incid = _smooth_two_day_steps(states[member], states_daily_incid[member])
+        states[member] = smoothed
+        states_daily_incid[member] = smoothed_incid
+
+
+@jit(nopython=True, cache=True)
+def _integrate_batch(
+    times,
+    states,
+    states_daily_incid,
+    initial_conditions,
+    dt,
+    method,
+    seeding_index,
+    seeding_amounts,
+    parameters,
+    structure,
+):
+    """
+    Integrate every member of a batch in a single compiled call.
+
+    The batch members share the model `structure`, a `model` tuple without its
+    parameters, and differ by their `parameters`, `initial_conditions` and
+    `seeding_amounts`, all indexed by batch member along their first axis.
+    """
+    for member in range(parameters.shape[0]):
+        _integrate_member(
+            member,
+            times,
+            states,
+            states_daily_incid,
+            initial_conditions,
+            dt,
+            method,
+            seeding_index,
+            seeding_amounts,
+            parameters,
+            structure,
+        )
+
+
+@jit(nopython=True, parallel=True, cache=True)
+def _integrate_batch_parallel(
+    times,
+    states,
+    states_daily_incid,
+    initial_conditions,
+    dt,
+    method,
+    seeding_index,
+    seeding_amounts,
+    parameters,
+    structure,
+):
+    """
+    Thread parallel counterpart of `_integrate_batch`, splitting batch members across threads.
+
+    Each member is integrated serially by a single thread, so the results are
+    identical to those of `_integrate_batch`.
+    """
+    for member in prange(parameters.shape[0]):
+        _integrate_member(
+            member,
+            times,
+            states,
+            states_daily_incid,
+            initial_conditions,
+            dt,
+            method,
+            seeding_index,
+            seeding_amounts,
+            parameters,
+            structure,
+        )
+
+
+@jit(nopython=True, cache=True)
+def _derivative(x, today, parallel, model):
+    """
+    Time derivative of the states and of the cumulative incidence.
+
+    Rates are evaluated on the states clipped at zero, the tiny negative values an
+    adaptive step can produce would otherwise give NaNs with fractional exponents.
+    Clipping the rates rather than the states keeps the total population constant.
+    """
+    ncompartments, nspatial_nodes, transitions = model[0], model[1], model[3]
+    flows = _rhs(0.0, np.maximum(x, 0.0), today, 1.0, RK4_METHOD, parallel, *model)
+    derivative = np.zeros((2, ncompartments, nspatial_nodes))
+    for transition_index in range(transitions.shape[1]):
+        derivative[0, transitions[transition_source_col][transition_index]] -= flows[transition_index]
+        derivative[0, transitions[transition_destination_col][transition_index]] += flows[transition_index]
+        derivative[1, transitions[transition_destination_col][transition_index]] += flows[transition_index]
+    return np.reshape(derivative, derivative.size)
+
+
+@jit(nopython=True, cache=True)
+def _constant_until(day, ndays, parameters, day_start_idx):
+    """
+    First day after `day` on which parameters change or seeding happens, at most `ndays`.
+    """
+    segment_end = day + 1
+    while segment_end < ndays:
+        if day_start_idx[segment_end + 1] > day_start_idx[segment_end]:
+            break
+        if (parameters[:, segment_end, :] != parameters[:, day, :]).any():
+            break
+        segment_end += 1
+    return segment_end
+
+
+@jit(nopython=True, cache=True)
+def _integrate_adaptive(ndays, states, states_daily_incid, initial_conditions, rtol, atol, parallel, seeding, model):
+    """
+    Integrate with adaptive Dormand-Prince steps, filling daily output in place.
+
+    The horizon is split in segments over which parameters are constant and no
+    seeding happens, steps never cross a segment boundary but may span several
+    days inside one. Prevalence at the beginning of each day and the cumulative
+    incidence at each day boundary are read from the dense output of the step
+    covering it, and clipped at zero on output. Seeding is injected at the
+    beginning of its day like in `_integrate_steps`, and the last day is
+    integrated in full.
+
+    Returns:
+        The number of accepted and rejected steps.
+    """
+    ncompartments, nspatial_nodes, parameters = model[0], model[1], model[2]
+    day_start_idx = seeding[0]
+    size = 2 * ncompartments * nspatial_nodes
+    x = np.zeros(size)
+    x_3d = np.reshape(x, (2, ncompartments, nspatial_nodes))
+    x_3d[0] = initial_conditions
+    cumulative = np.zeros((ndays + 1, ncompartments, nspatial_nodes))
+    k = np.zeros((7, size))
+    h = 1.0
+    naccepted = 0
+    nrejected = 0
+
+    day = 0
+    while day < ndays:
+        # Prevalence is saved at the begining of the day, while incidence is during the day
+        x_3d = np.reshape(x, (2, ncompartments, nspatial_nodes))
+        states[day] = np.maximum(x_3d[0], 0.0)
+        _apply_seeding(day, 1.0, x_3d[0], states_daily_incid, *seeding)
+        cumulative[day] = x_3d[1]
+
+        segment_end = _constant_until(day, ndays, parameters, day_start_idx)
+        next_day = day + 1
+        t = float(day)
+        t_end = float(segment_end)
+        k[0] = _derivative(x, day, parallel, model)
+        while t < t_end:
+            h = min(h, t_end - t)
+            for stage in range(1, 6):
+                y = x.copy()
+                for previous in range(stage):
+                    y += h * dopri_a[stage, previous] * k[previous]
+                k[stage] = _derivative(y, day, parallel, model)
+            x_new = x.copy()
+            for stage in range(6):
+                x_new += h * dopri_b[stage] * k[stage]
+            k[6] = _derivative(x_new, day, parallel, model)
+            error = np.zeros(size)
+            for stage in range(7):
+                error += h * dopri_e[stage] * k[stage]
+            scale = atol + rtol * np.maximum(np.abs(x), np.abs(x_new))
+            error_norm = np.max(np.abs(error) / scale)
+
+            if error_norm <= 1.0:
+                t_new = t_end if t_end - t - h < adaptive_min_step else t + h
+                # Daily output inside the segment comes from the dense output
+                while next_day < segment_end and next_day <= t_new:
+                    theta = (next_day - t) / h
+                    dense = x.copy()
+                    for stage in range(7):
+                        weight = 0.0
+                        for power in range(4):
+                            weight += dopri_p[stage, power] * theta ** (power + 1)
+                        dense += h * weight * k[stage]
+                    dense_3d = np.reshape(dense, (2, ncompartments, nspatial_nodes))
+                    states[next_day] = np.maximum(dense_3d[0], 0.0)
+                    cumulative[next_day] = dense_3d[1]
+                    next_day += 1
+                x = x_new
+                k[0] = k[6]
+                t = t_new
+                naccepted += 1
+                h *= 10.0 if error_norm == 0.0 else min(10.0, 0.9 * error_norm ** -0.2)
+            else:
+                nrejected += 1
+                h *= max(0.2, 0.9 * error_norm ** -0.2) if np.isfinite(error_norm) else 0.2
+                if h < adaptive_min_step:
+                    raise ValueError("Adaptive integration step size underflow.")
+        day = segment_end
+
+    cumulative[ndays] = np.reshape(x, (2, ncompartments, nspatial_nodes))[1]
+    for day in range(ndays):
+        states_daily_incid[day] += np.maximum(cumulative[day + 1] - cumulative[day], 0.0)
+    return naccepted, nrejected
+
+
+def precompile():
+    """
+    Compile the integration kernels ahead of the first simulation.
+
+    The kernels are compiled with `cache=True`, so the first call in a fresh
+    environment writes the machine code to numba's on-disk cache and later calls,
+    including those from freshly started process pool workers, only load it. Useful as
+    a pool initializer so that workers start hot.
+
+    Returns:
+        None
+
+    Examples:
+        >>> from concurrent.futures import ProcessPoolExecutor
+        >>> from gempyor.steps_rk4 import precompile
+        >>> with ProcessPoolExecutor(initializer=precompile) as executor:
+        ...     pass
+    """
+    seeding_data = {
+        "day_start_idx": np.array([0, 1, 1, 1], dtype=np.int64),
+        "seeding_sources": np.array([0], dtype=np.int64),
+        "seeding_destinations": np.array([1], dtype=np.int64),
+        "seeding_subpops": np.array([0], dtype=np.int64),
+    }
+    model = dict(
+        ncompartments=2,
+        nspatial_nodes=2,
+        ndays=3,
+        parameters=np.ones((2, 3, 2)),
+        transitions=np.array([[0], [1], [0], [0], [2]], dtype=np.int64),
+        proportion_info=np.array([[0, 1], [1, 2], [1, 1]], dtype=np.int64),
+        transition_sum_compartments=np.array([0, 1], dtype=np.int64),
+        initial_conditions=np.array([[9.0, 10.0], [1.0, 0.0]]),
+        seeding_data=seeding_data,
+        seeding_amounts=np.array([1.0]),
+        mobility_data=np.array([1.0, 1.0]),
+        mobility_row_indices=np.array([1, 0], dtype=np.int32),
+        mobility_data_indices=np.array([0, 1, 2], dtype=np.int32),
+        population=np.array([10, 10], dtype=np.int64),
+    )
+    for method, dt in (("rk4", 2.0), ("euler", 1.0)):
+        rk4_integration(**model, dt=dt, method=method, silent=True)
+    rk4_integration(**model, dt=1.0, method="stochastic", silent=True, rng=np.random.default_rng(0))
+    rk45_integration(**model)
+
+
+def _check_integration_result(states, states_daily_incid, integration_args):
+    """
+    Log and dump the inputs of an integration that produced invalid states.
+
+    Args:
+        states: The prevalence returned by the integration.
+        states_daily_incid: The daily incidence returned by the integration.
+        integration_args: The inputs of the integration, in the order of the
+            `rk4_integration` arguments followed by the method, pickled along the
+            states to `integration_dump.pkl` when the result is invalid.
+
+    Returns:
+        None
+    """
     error = False
     ## Perform some checks:
     if np.isnan(states_daily_incid).any() or np.isnan(states).any():
@@ -300,26 +1043,7 @@ def rk4_integration(
 
         with open("integration_dump.pkl", "wb") as fn_dump:
             pickle.dump(
-                [
-                    states,
-                    states_daily_incid,
-                    ncompartments,
-                    nspatial_nodes,
-                    ndays,
-                    parameters,
-                    dt,
-                    transitions,
-                    proportion_info,
-                    transition_sum_compartments,
-                    initial_conditions,
-                    dict(seeding_data),
-                    seeding_amounts,
-                    mobility_data,
-                    mobility_row_indices,
-                    mobility_data_indices,
-                    population,
-                    method,
-                ],
+                [states, states_daily_incid, *integration_args],
                 fn_dump,
             )
         print(
@@ -327,4 +1051,355 @@ def rk4_integration(
         )
         print("/!\\ Invalid integration, will cause problems for downstream users /!\\ ")
         # raise ValueError("Invalid Integration...")
+
+
+def rk4_integration(
+    *,
+    ncompartments,  # 1
+    nspatial_nodes,  # 2
+    ndays,  # 3
+    parameters,  # 4
+    dt,  # 5
+    transitions,  # 6
+    proportion_info,  # 7
+    transition_sum_compartments,  # 8
+    initial_conditions,  # 9
+    seeding_data,  # 10
+    seeding_amounts,  # 11
+    mobility_data,  # 12
+    mobility_row_indices,  # 13
+    mobility_data_indices,  # 14
+    population,  # 15
+    method="rk4",
+    silent=False,
+    parallel=False,
+    rng=None
+):
+    method_code = _method_code(method, parallel)
+
+    states = np.zeros((ndays, ncompartments, nspatial_nodes))
+    states_daily_incid = np.zeros((ndays, ncompartments, nspatial_nodes))
+
+    ## Setting values
+    states_current = np.copy(initial_conditions)
+    states_next = states_current.copy()
+
+    mixing_data, mixing_indices, mixing_indptr = _mixing_operator(
+        nspatial_nodes, mobility_data, mobility_row_indices, mobility_data_indices, population
+    )
+    model = (
+        ncompartments,
+        nspatial_nodes,
+        parameters,
+        transitions,
+        proportion_info,
+        transition_sum_compartments,
+        mixing_data,
+        mixing_indices,
+        mixing_indptr,
+        population,
+    )
+
+    seeding = (
+        seeding_data["day_start_idx"],
+        seeding_data["seeding_sources"],
+        seeding_data["seeding_destinations"],
+        seeding_data["seeding_subpops"],
+        seeding_amounts,
+    )
+    times = np.arange(0, (ndays - 1) + 1e-7, dt)
+    if method_code == STOCHASTIC_METHOD:
+        integrate_steps = _integrate_steps_stochastic
+        rng_args = (global_random_generator() if rng is None else rng,)
+    else:
+        integrate_steps = _integrate_steps
+        rng_args = ()
+
+    # The whole time loop runs in compiled code, when progress is reported it is
+    # entered once per simulated day instead of once per time step.
+    steps_per_chunk = len(times) if silent else max(int(round(1.0 / dt)), 1)
+    yesterday = -1
+    with tqdm.tqdm(total=len(times), disable=silent) as progress:
+        for step_start in range(0, len(times), steps_per_chunk):
+            step_stop = min(step_start + steps_per_chunk, len(times))
+            states_next, yesterday = integrate_steps(
+                step_start,
+                step_stop,
+                times,
+                yesterday,
+                states,
+                states_daily_incid,
+                states_next,
+                dt,
+                method_code,
+                parallel,
+                seeding,
+                model,
+                *rng_args,
+            )
+            progress.update(step_stop - step_start)
+
+    if dt == 2.0:  # smooth prevalence:
+        states, states_daily_incid = _smooth_two_day_steps(states, states_daily_incid)
+
+    _check_integration_result(
+        states,
+        states_daily_incid,
+        [
+            ncompartments,
+            nspatial_nodes,
+            ndays,
+            parameters,
+            dt,
+            transitions,
+            proportion_info,
+            transition_sum_compartments,
+            initial_conditions,
+            dict(seeding_data),
+            seeding_amounts,
+            mobility_data,
+            mobility_row_indices,
+            mobility_data_indices,
+            population,
+            method,
+        ],
+    )
+    return states, states_daily_incid
+
+
+def rk4_integration_batch(
+    *,
+    ncompartments,
+    nspatial_nodes,
+    ndays,
+    parameters,
+    dt,
+    transitions,
+    proportion_info,
+    transition_sum_compartments,
+    initial_conditions,
+    seeding_data,
+    seeding_amounts,
+    mobility_data,
+    mobility_row_indices,
+    mobility_data_indices,
+    population,
+    method="rk4",
+    silent=False,
+    parallel=False,
+    rng=None
+):
+    """
+    Integrate a batch of parameter sets sharing the same model structure.
+
+    Takes the same arguments as `rk4_integration`, except that `parameters`,
+    `initial_conditions` and `seeding_amounts` carry a leading batch dimension, with
+    shapes (batch, nparameters, ndays, nspatial_nodes), (batch, ncompartments,
+    nspatial_nodes) and (batch, nseeding) respectively. The seeding structure in
+    `seeding_data` is shared by every member.
+
+    Deterministic batches are integrated in a single compiled call when `silent`,
+    otherwise (and always for the stochastic method) member by member. With
+    `parallel` the compiled call splits the members across threads, while members
+    integrated one by one are each integrated by the thread parallel kernels.
+    Stochastic members draw one after the other from the same `rng`.
+
+    Returns:
+        A tuple of the prevalence and the daily incidence, both of shape (batch, ndays,
+        ncompartments, nspatial_nodes).
+    """
+    method_code = _method_code(method, parallel)
+
+    batch_size = parameters.shape[0]
+    if initial_conditions.shape[0] != batch_size or seeding_amounts.shape[0] != batch_size:
+        raise ValueError(
+            f"The batch has {batch_size} parameter sets, but {initial_conditions.shape[0]} "
+            f"initial conditions and {seeding_amounts.shape[0]} seeding amounts."
+        )
+
+    states = np.zeros((batch_size, ndays, ncompartments, nspatial_nodes))
+    states_daily_incid = np.zeros((batch_size, ndays, ncompartments, nspatial_nodes))
+
+    mixing_data, mixing_indices, mixing_indptr = _mixing_operator(
+        nspatial_nodes, mobility_data, mobility_row_indices, mobility_data_indices, population
+    )
+    structure = (
+        ncompartments,
+        nspatial_nodes,
+        transitions,
+        proportion_info,
+        transition_sum_compartments,
+        mixing_data,
+        mixing_indices,
+        mixing_indptr,
+        population,
+    )
+    seeding_index = (
+        seeding_data["day_start_idx"],
+        seeding_data["seeding_sources"],
+        seeding_data["seeding_destinations"],
+        seeding_data["seeding_subpops"],
+    )
+    times = np.arange(0, (ndays - 1) + 1e-7, dt)
+
+    if silent and method_code != STOCHASTIC_METHOD:
+        integrate_batch = _integrate_batch_parallel if parallel else _integrate_batch
+        integrate_batch(
+            times,
+            states,
+            states_daily_incid,
+            np.ascontiguousarray(initial_conditions, dtype=np.float64),
+            dt,
+            method_code,
+            seeding_index,
+            np.ascontiguousarray(seeding_amounts, dtype=np.float64),
+            parameters,
+            structure,
+        )
+    else:
+        if method_code == STOCHASTIC_METHOD:
+            integrate_steps = _integrate_steps_stochastic
+            rng_args = (global_random_generator() if rng is None else rng,)
+        else:
+            integrate_steps = _integrate_steps
+            rng_args = ()
+        for member in tqdm.trange(batch_size, disable=silent):
+            model = (*structure[:2], parameters[member], *structure[2:])
+            integrate_steps(
+                0,
+                len(times),
+                times,
+                -1,
+                states[member],
+                states_daily_incid[member],
+                np.copy(initial_conditions[member]),
+                dt,
+                method_code,
+                parallel,
+                (*seeding_index, seeding_amounts[member]),
+                model,
+                *rng_args,
+            )
+            if dt == 2.0:  # smooth prevalence:
+                states[member], states_daily_incid[member] = _smooth_two_day_steps(
+                    states[member], states_daily_incid[member]
+                )
+
+    _check_integration_result(
+        states,
+        states_daily_incid,
+        [
+            ncompartments,
+            nspatial_nodes,
+            ndays,
+            parameters,
+            dt,
+            transitions,
+            proportion_info,
+            transition_sum_compartments,
+            initial_conditions,
+            dict(seeding_data),
+            seeding_amounts,
+            mobility_data,
+            mobility_row_indices,
+            mobility_data_indices,
+            population,
+            method,
+        ],
+    )
+    return states, states_daily_incid
+
+
+def rk45_integration(
+    *,
+    ncompartments,
+    nspatial_nodes,
+    ndays,
+    parameters,
+    transitions,
+    proportion_info,
+    transition_sum_compartments,
+    initial_conditions,
+    seeding_data,
+    seeding_amounts,
+    mobility_data,
+    mobility_row_indices,
+    mobility_data_indices,
+    population,
+    rtol=1e-6,
+    atol=1e-3,
+    parallel=False
+):
+    """
+    Integrate the model with an adaptive step Dormand-Prince 5(4) scheme.
+
+    Takes the same arguments as `rk4_integration`, with the `rtol`/`atol` error
+    tolerances of the adaptive steps in place of `dt`. Steps only stop where
+    parameters change or seeding happens, so smooth stretches are covered with few
+    steps, and daily prevalence and incidence are read from the dense output.
+
+    Returns:
+        A tuple of the prevalence and the daily incidence, both of shape (ndays,
+        ncompartments, nspatial_nodes).
+    """
+    states = np.zeros((ndays, ncompartments, nspatial_nodes))
+    states_daily_incid = np.zeros((ndays, ncompartments, nspatial_nodes))
+
+    mixing_data, mixing_indices, mixing_indptr = _mixing_operator(
+        nspatial_nodes, mobility_data, mobility_row_indices, mobility_data_indices, population
+    )
+    model = (
+        ncompartments,
+        nspatial_nodes,
+        parameters,
+        transitions,
+        proportion_info,
+        transition_sum_compartments,
+        mixing_data,
+        mixing_indices,
+        mixing_indptr,
+        population,
+    )
+    seeding = (
+        seeding_data["day_start_idx"],
+        seeding_data["seeding_sources"],
+        seeding_data["seeding_destinations"],
+        seeding_data["seeding_subpops"],
+        seeding_amounts,
+    )
+    naccepted, nrejected = _integrate_adaptive(
+        ndays,
+        states,
+        states_daily_incid,
+        np.ascontiguousarray(initial_conditions, dtype=np.float64),
+        float(rtol),
+        float(atol),
+        parallel,
+        seeding,
+        model,
+    )
+    logging.debug(f"Adaptive integration took {naccepted} steps, {nrejected} rejected")
+
+    _check_integration_result(
+        states,
+        states_daily_incid,
+        [
+            ncompartments,
+            nspatial_nodes,
+            ndays,
+            parameters,
+            None,
+            transitions,
+            proportion_info,
+            transition_sum_compartments,
+            initial_conditions,
+            dict(seeding_data),
+            seeding_amounts,
+            mobility_data,
+            mobility_row_indices,
+            mobility_data_indices,
+            population,
+            "rk45",
+        ],
+    )
     return states, states_daily_incid
@@ -22,6 +22,7 @@ import numpy as np
 import numpy.typing as npt
 import pandas as pd
 import pyarrow as pa
+import pyarrow.parquet as pq
 import scipy.ndimage
 import scipy.stats
 import sympy.parsing.sympy_parser
@@ -37,20 +38,25 @@ config = confuse.Configuration("flepiMoP", read=False)
 
 def write_df(
     fname: str | bytes | os.PathLike,
-    df: pd.DataFrame,
+    df: pd.DataFrame | pa.Table,
     extension: Literal[None, "", "csv", "parquet"] = "",
+    **parquet_options: Any,
 ) -> None:
-    """Writes a pandas DataFrame without its index to a file.
+    """Writes a pandas DataFrame or an Arrow table without its index to a file.
 
     Writes a pandas DataFrame to either a CSV or Parquet file without its index and can
     infer which format to use based on the extension given in `fname` or based on
-    explicit `extension`.
+    explicit `extension`. Arrow tables are written to Parquet as they are, without
+    the Arrow schema, so dictionary encoded columns read back as plain strings.
 
     Args:
         fname: The name of the file to write to.
-        df: A pandas DataFrame whose contents to write, but without its index.
+        df: A pandas DataFrame or an Arrow table whose contents to write, but without
+            its index.
         extension: A user specified extension to use for the file if not contained in
             `fname` already.
+        **parquet_options: Further keyword arguments for `pyarrow.parquet.write_table`,
+            like `compression` or `row_group_size`. Ignored for CSV files.
 
     Returns:
         None
@@ -63,9 +69,12 @@ def write_df(
     path = Path(f"{fname}.{extension}") if extension else Path(fname)
     # Write df to either a csv or parquet or raise if an invalid extension
     if path.suffix == ".csv":
+        df = df.to_pandas() if isinstance(df, pa.Table) else df
         return df.to_csv(path, index=False)
     elif path.suffix == ".parquet":
-        return df.to_parquet(path, index=False, engine="pyarrow")
+        if isinstance(df, pa.Table):
+            return pq.write_table(df, path, store_schema=False, **parquet_options)
+        return df.to_parquet(path, index=False, engine="pyarrow", **parquet_options)
     raise NotImplementedError(
         f"Invalid extension provided: '.{path.suffix[1:]}'. Supported extensions are `.csv` or `.parquet`."
     )
@@ -597,6 +606,30 @@ def as_random_distribution(self):
         )
 
 
+def global_random_generator() -> np.random.Generator:
+    """
+    Create a random generator seeded from numpy's global random state.
+
+    Used by the stochastic engine and the stochastic outcome delays when no generator
+    is given, so that seeding the global state, as
+    `seir._onerun_SEIR_with_random_seed` does with the seeds of
+    `_nslots_random_seeds`, reproduces a simulation exactly.
+
+    Returns:
+        A new random generator, whose seed is drawn from numpy's global random state.
+
+    Examples:
+        >>> import numpy as np
+        >>> from gempyor.utils import global_random_generator
+        >>> np.random.seed(42)
+        >>> a = global_random_generator().random()
+        >>> np.random.seed(42)
+        >>> a == global_random_generator().random()
+        True
+    """
+    return np.random.default_rng(np.random.randint(0, 2**32, dtype=np.uint64))
+
+
 def list_filenames(
     folder: str | bytes | os.PathLike = ".",
     filters: str | list[str] = [],
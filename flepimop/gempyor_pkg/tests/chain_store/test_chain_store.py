@@ -0,0 +1,78 @@
+from pathlib import Path
+
+import emcee
+import numpy as np
+import pytest
+
+from gempyor.chain_store import ChainStore
+
+NWALKERS, NDIM = 8, 3
+
+
+def log_prob_with_blobs(proposals: np.ndarray) -> list[tuple[float, np.ndarray]]:
+    return [
+        (-0.5 * float(np.sum(p**2)), np.array([-np.sum(p[:2] ** 2), -(p[2] ** 2)]))
+        for p in proposals
+    ]
+
+
+def run_sampler(
+    backend: emcee.backends.Backend, niter: int, initial_state: np.ndarray | None
+) -> emcee.EnsembleSampler:
+    sampler = emcee.EnsembleSampler(
+        NWALKERS, NDIM, log_prob_with_blobs, vectorize=True, backend=backend
+    )
+    if initial_state is not None:
+        sampler.random_state = np.random.RandomState(42).get_state()
+    sampler.run_mcmc(initial_state, niter)
+    return sampler
+
+
+@pytest.fixture
+def initial_state() -> np.ndarray:
+    return np.random.default_rng(0).normal(size=(NWALKERS, NDIM))
+
+
+def test_chain_store_matches_in_memory_backend(
+    tmp_path: Path, initial_state: np.ndarray
+) -> None:
+    filename = tmp_path / "backend.h5"
+    expected = run_sampler(emcee.backends.Backend(), 10, initial_state)
+    with ChainStore(filename, chunk_iterations=4, blob_names=["ab", "c"]) as store:
+        store.reset(NWALKERS, NDIM)
+        run_sampler(store, 10, initial_state)
+        for name in ["chain", "log_prob", "blobs"]:
+            assert np.array_equal(store.get_value(name), expected.get_value(name))
+        assert np.array_equal(store.accepted, expected.backend.accepted)
+        assert np.array_equal(store.get_last("chain", 3), expected.get_chain()[-3:])
+        assert np.array_equal(
+            store.get_walkers([1, 5], name="log_prob", discard=2),
+            expected.get_log_prob()[2:, [1, 5]],
+        )
+
+    # The file is readable by emcee, and the store reads it back
+    reader = emcee.backends.HDFBackend(filename, read_only=True)
+    assert reader.iteration == 10
+    assert np.array_equal(reader.get_chain(), expected.get_chain())
+    assert np.array_equal(reader.get_blobs(), expected.get_blobs())
+    store = ChainStore(filename, read_only=True)
+    assert store.iteration == 10
+    assert store.blob_names == ["ab", "c"]
+    assert np.array_equal(store.get_last_sample().coords, expected.get_chain()[-1])
+    with pytest.raises(RuntimeError, match="read-only"):
+        store.reset(NWALKERS, NDIM)
+    store.close()
+
+
+def test_chain_store_resumes_chains(tmp_path: Path, initial_state: np.ndarray) -> None:
+    filename = tmp_path / "backend.h5"
+    expected = run_sampler(emcee.backends.Backend(), 12, initial_state)
+    with ChainStore(filename, chunk_iterations=5) as store:
+        store.reset(NWALKERS, NDIM)
+        run_sampler(store, 7, initial_state)
+
+    with ChainStore(filename, chunk_iterations=5) as store:
+        assert store.iteration == 7
+        run_sampler(store, 5, None)
+        assert np.array_equal(store.get_chain(), expected.get_chain())
+        assert np.array_equal(store.get_blobs(), expected.get_blobs())
@@ -1,8 +1,9 @@
 import os
 
+import numpy as np
 import pytest
 
-from gempyor.inference import get_static_arguments
+from gempyor.inference import GempyorInference, get_static_arguments
 from gempyor.model_info import ModelInfo
 from gempyor.testing import create_confuse_configview_from_dict
 
@@ -54,3 +55,26 @@ def test_modinf_missing_compartments_runtime_error(monkeypatch: pytest.MonkeyPat
         match="^The `modinf` is required to have a parsed `compartments` attribute.$",
     ):
         get_static_arguments(modinf)
+
+
+def test_static_arguments_are_read_only(monkeypatch: pytest.MonkeyPatch) -> None:
+    monkeypatch.chdir(os.path.dirname(__file__))
+    gempyor_inference = GempyorInference(config_filepath="data/config_test.yml")
+    static_sim_arguments = get_static_arguments(gempyor_inference.modinf)
+
+    arrays = [
+        static_sim_arguments[key]
+        for key in [
+            "p_draw",
+            "transition_array",
+            "proportion_array",
+            "proportion_info",
+            "initial_conditions",
+            "seeding_amounts",
+        ]
+    ] + list(static_sim_arguments["seeding_data"].values())
+    for array in arrays:
+        assert isinstance(array, np.ndarray)
+        assert not array.flags.writeable
+    with pytest.raises(ValueError, match="read-only"):
+        static_sim_arguments["initial_conditions"][...] = 0.0
@@ -8,7 +8,7 @@ import pyarrow as pa
 import time
 import confuse
 
-from gempyor import utils, inference, seir, parameters
+from gempyor import utils, inference, seir, outcomes, parameters
 from gempyor.utils import config
 
 TEST_SETUP_NAME = "minimal_test"
@@ -74,3 +74,95 @@ class TestGempyorInference:
         # Test
         simulation_int = gempyor_inference.one_simulation(0)
         assert simulation_int == 0
+
+    def test_one_simulation_reuses_seir_states(self, monkeypatch):
+        os.chdir(os.path.dirname(__file__))
+        i = inference.GempyorInference(config_filepath=f"{DATA_DIR}/config_test.yml")
+        steps_SEIR = seir.steps_SEIR
+        calls = []
+        monkeypatch.setattr(
+            seir, "steps_SEIR", lambda *args: calls.append(1) or steps_SEIR(*args)
+        )
+
+        i.one_simulation(sim_id2write=0)
+        first_states, p_draw = i.lastsim_states, i.lastsim_p_draw
+        monkeypatch.setattr(i, "get_seir_parameters", lambda **kwargs: p_draw)
+
+        # Unchanged SEIR inputs reuse the states, changed ones integrate again
+        i.one_simulation(sim_id2write=0)
+        assert i.lastsim_states is first_states
+        assert len(calls) == 1
+        monkeypatch.setattr(i, "get_seir_parameters", lambda **kwargs: p_draw * 1.01)
+        i.one_simulation(sim_id2write=0)
+        assert i.lastsim_states is not first_states
+        assert len(calls) == 2
+
+        # The last two SEIR simulations are kept, like an accepted and a rejected one
+        monkeypatch.setattr(i, "get_seir_parameters", lambda **kwargs: p_draw)
+        i.one_simulation(sim_id2write=0)
+        assert i.lastsim_states is first_states
+        assert len(calls) == 2
+
+    def test_simulation_atomic_seir_cache_is_per_model(self, tmp_path, monkeypatch):
+        os.chdir(os.path.dirname(__file__))
+        # The second config only differs by a transition rate expression, so both
+        # models have the same reduced parameters, initial conditions and seeding
+        with open(f"{DATA_DIR}/config_test.yml") as f:
+            structure_config = f.read().replace(
+                'rate: ["sigma", 1]', 'rate: ["2 * sigma", 1]'
+            )
+        (tmp_path / "config_structure.yml").write_text(structure_config)
+        # Both models start with the same exposed individuals, as there is no seeding
+        p_draw, initial_conditions = None, None
+        simulations = []
+        for config_filepath in [
+            f"{DATA_DIR}/config_test.yml",
+            str(tmp_path / "config_structure.yml"),
+        ]:
+            i = inference.GempyorInference(config_filepath=config_filepath)
+            sim_arguments = inference.get_static_arguments(i.modinf)
+            if p_draw is None:
+                p_draw = sim_arguments["p_draw"]
+                initial_conditions = sim_arguments["initial_conditions"].copy()
+                initial_conditions[0] -= 10.0
+                initial_conditions[1] += 10.0
+            sim_arguments["p_draw"] = p_draw
+            sim_arguments["initial_conditions"] = initial_conditions
+            simulations.append((i, sim_arguments))
+
+        steps_SEIR = seir.steps_SEIR
+        calls = []
+        monkeypatch.setattr(
+            seir, "steps_SEIR", lambda *args: calls.append(1) or steps_SEIR(*args)
+        )
+        # The SEIR states are recorded as they are passed on to the outcomes
+        compute_outcomes = outcomes.compute_all_multioutcomes_array
+        states = []
+        monkeypatch.setattr(
+            outcomes,
+            "compute_all_multioutcomes_array",
+            lambda **kwargs: states.append(kwargs["bypass_seir_xr"])
+            or compute_outcomes(**kwargs),
+        )
+
+        def simulate(i, sim_arguments):
+            return inference.simulation_atomic(
+                **{k: v for k, v in sim_arguments.items() if not k.endswith("_df_ref")},
+                snpi_df_in=sim_arguments["snpi_df_ref"].copy(),
+                hnpi_df_in=sim_arguments["hnpi_df_ref"].copy(),
+                modinf=i.modinf,
+                seir_cache=i.seir_cache,
+                seir_cache_size=i.seir_cache_size,
+            )
+
+        for simulation in simulations:
+            simulate(*simulation)
+        assert len(calls) == 2
+        assert not states[0].equals(states[1])
+
+        # Each model reuses its own states
+        for simulation in simulations:
+            simulate(*simulation)
+        assert len(calls) == 2
+        assert states[2] is states[0]
+        assert states[3] is states[1]
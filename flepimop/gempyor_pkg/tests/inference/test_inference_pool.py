@@ -0,0 +1,65 @@
+import os
+
+import numpy as np
+import pytest
+
+from gempyor.inference_pool import InferencePool
+
+
+class MockInference:
+    """A picklable stand-in for `GempyorInference`."""
+
+    def __init__(self) -> None:
+        weights = np.arange(1.0, 4.0)
+        weights.setflags(write=False)
+        self.static_sim_arguments = {"weights": weights, "unique_strings": ["a", "b"]}
+        self.silent = True
+        self.save = False
+
+    def set_silent(self, silent: bool) -> None:
+        self.silent = silent
+
+    def set_save(self, save: bool) -> None:
+        self.save = save
+
+    def get_logloss_as_single_number(self, proposal: np.ndarray) -> float:
+        weights = self.static_sim_arguments["weights"]
+        assert not weights.flags.writeable
+        return float(-np.sum(weights * proposal**2)) - (1000.0 if self.save else 0.0)
+
+    def simulate_proposal(self, proposal: np.ndarray) -> tuple[int, np.ndarray]:
+        return os.getpid(), self.static_sim_arguments["weights"] * proposal
+
+
+@pytest.fixture
+def proposals() -> np.ndarray:
+    return np.random.default_rng(0).normal(size=(7, 3))
+
+
+def test_log_prob_matches_serial_evaluation(proposals: np.ndarray) -> None:
+    inference = MockInference()
+    expected = [inference.get_logloss_as_single_number(p) for p in proposals]
+    with InferencePool(inference, 2) as pool:
+        assert np.array_equal(pool.log_prob(proposals), expected)
+        inference.set_save(True)
+        assert np.array_equal(pool.log_prob(proposals), np.array(expected) - 1000.0)
+        assert pool.restarts == 0
+
+
+def test_simulate_uses_shared_static_arrays(proposals: np.ndarray) -> None:
+    inference = MockInference()
+    with InferencePool(inference, 2) as pool:
+        results = pool.simulate(proposals)
+    assert {pid for pid, _ in results} - {os.getpid()}
+    for proposal, (_, outcome) in zip(proposals, results):
+        assert np.array_equal(outcome, np.arange(1.0, 4.0) * proposal)
+    assert inference.static_sim_arguments["unique_strings"] == ["a", "b"]
+
+
+def test_workers_are_recycled_over_memory_limit(proposals: np.ndarray) -> None:
+    inference = MockInference()
+    with InferencePool(inference, 2, memory_limit=1) as pool:
+        first = pool.log_prob(proposals)
+        assert pool.restarts == 1
+        assert np.array_equal(pool.log_prob(proposals), first)
+        assert pool.restarts == 2
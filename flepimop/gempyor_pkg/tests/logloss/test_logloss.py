@@ -0,0 +1,92 @@
+from datetime import date
+from pathlib import Path
+from types import SimpleNamespace
+
+import numpy as np
+import pandas as pd
+import pytest
+import xarray as xr
+
+from gempyor.logloss import LogLoss
+from gempyor.testing import create_confuse_configview_from_dict
+
+
+@pytest.fixture
+def logloss(tmp_path: Path) -> LogLoss:
+    """A LogLoss whose ground truth spans more dates than the simulation."""
+    rng = np.random.default_rng(0)
+    gt_dates = pd.date_range(date(2024, 1, 1), date(2024, 3, 31))
+    gt = pd.DataFrame(
+        {
+            "date": np.repeat(gt_dates, 3),
+            "subpop": ["01", "02", "03"] * len(gt_dates),
+            "incidH": rng.poisson(20.0, 3 * len(gt_dates)),
+            "incidD": rng.poisson(5.0, 3 * len(gt_dates)),
+        }
+    )
+    gt.to_csv(tmp_path / "gt.csv", index=False)
+    inference_config = create_confuse_configview_from_dict(
+        {
+            "gt_data_path": "gt.csv",
+            "statistics": {
+                "hospitalizations": {
+                    "name": "hospitalizations",
+                    "sim_var": "incidH",
+                    "data_var": "incidH",
+                    "resample": {"freq": "W-SAT", "aggregator": "sum"},
+                    "likelihood": {"dist": "pois"},
+                },
+                "deaths": {
+                    "name": "deaths",
+                    "sim_var": "incidD",
+                    "data_var": "incidD",
+                    "likelihood": {"dist": "norm", "params": {"scale": 3.0}},
+                },
+            },
+        },
+        name="inference",
+    )
+    return LogLoss(
+        inference_config,
+        SimpleNamespace(subpop_names=["03", "01", "02"]),
+        SimpleNamespace(ti=date(2024, 1, 15), tf=date(2024, 3, 10)),
+        path_prefix=str(tmp_path),
+    )
+
+
+def test_array_and_dataframe_model_data_give_same_logloss(logloss: LogLoss) -> None:
+    # The simulation starts before and ends after the inference dates, and its subpops
+    # are not in the order of the inference
+    assert logloss.first_date == date(2024, 1, 15)
+    assert logloss.last_date == date(2024, 3, 10)
+    rng = np.random.default_rng(1)
+    dates = pd.date_range(date(2024, 1, 1), date(2024, 3, 31))
+    model_subpops = ["01", "02", "03"]
+    model_array = xr.DataArray(
+        rng.uniform(1.0, 30.0, (2, len(dates), len(model_subpops))),
+        coords={"outcome": ["incidD", "incidH"], "date": dates, "subpop": model_subpops},
+        dims=["outcome", "date", "subpop"],
+    )
+    model_df = model_array.to_dataset(dim="outcome").to_dataframe().reset_index()
+    model_df = model_df.set_index("date")
+
+    subpop_names = ["03", "01", "02"]
+    ll_total_array, logloss_array, reg_array = logloss.compute_logloss(
+        model_array, subpop_names
+    )
+    ll_total_df, logloss_df, reg_df = logloss.compute_logloss(model_df, subpop_names)
+
+    assert np.isfinite(ll_total_array)
+    assert ll_total_array == pytest.approx(ll_total_df)
+    assert reg_array == pytest.approx(reg_df)
+    assert list(logloss_array["statistic"].values) == ["hospitalizations", "deaths"]
+    assert list(logloss_array["subpop"].values) == subpop_names
+    xr.testing.assert_allclose(logloss_array, logloss_df)
+
+    # The dates outside of the inference dates do not contribute
+    outside = model_array.copy()
+    outside.loc[{"date": slice(None, "2024-01-14")}] = 1e6
+    outside.loc[{"date": slice("2024-03-11", None)}] = 1e6
+    assert logloss.compute_logloss(outside, subpop_names)[0] == pytest.approx(
+        ll_total_array
+    )
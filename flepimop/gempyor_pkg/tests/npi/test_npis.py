@@ -16,7 +16,8 @@ from pathlib import Path
 # import seaborn as sns
 import pyarrow.parquet as pq
 import pyarrow as pa
-from gempyor import file_paths, outcomes, seir
+from gempyor import file_paths, inference_parameter, outcomes, seir
+from gempyor.testing import create_confuse_configview_from_dict
 
 config_filepath_prefix = ""
 
@@ -284,3 +285,203 @@ def test_spatial_groups():
     assert (npi_wrote.getReduction("r3") == npi_read.getReduction("r3")).all().all()
     assert (npi_wrote.getReduction("r4") == npi_read.getReduction("r4")).all().all()
     assert (npi_wrote.getReduction("r5") == npi_read.getReduction("r5")).all().all()
+
+
+def test_reduction_array_matches_reduction():
+    inference_simulator = gempyor.GempyorInference(
+        config_filepath=f"{config_filepath_prefix}config_test_spatial_group_npi.yml",
+        run_id=105,
+        prefix="",
+        first_sim_index=1,
+        out_run_id=105,
+    )
+    npi = seir.build_npi_SEIR(
+        inference_simulator.modinf, load_ID=False, sim_id2load=None, config=config
+    )
+
+    for param in ["r1", "r2", "r3", "r4", "r5"]:
+        reduction = npi.getReduction(param)
+        reduction_array = npi.getReductionArray(param)
+        assert reduction_array.shape == (
+            inference_simulator.modinf.n_days,
+            inference_simulator.modinf.nsubpops,
+        )
+        assert np.array_equal(reduction_array, reduction.T.to_numpy())
+
+
+def test_intervals_to_array():
+    intervals = gempyor.NPI.helpers.make_intervals(
+        [
+            ("a", datetime.date(2021, 1, 2), datetime.date(2021, 1, 3), 0.5),
+            ("b", datetime.date(2021, 1, 1), datetime.date(2021, 1, 1), 0.25),
+            ("b", datetime.date(2021, 1, 4), datetime.date(2021, 1, 4), 0.75),
+        ],
+        ["a", "b"],
+        datetime.date(2021, 1, 1),
+        datetime.date(2021, 1, 4),
+    )
+    reduction = gempyor.NPI.helpers.intervals_to_array(intervals, 4, 2, 0.0)
+    assert np.array_equal(
+        reduction, np.array([[0.0, 0.25], [0.5, 0.0], [0.5, 0.0], [0.0, 0.75]])
+    )
+
+    with pytest.raises(ValueError, match=r".*not between global dates.*"):
+        gempyor.NPI.helpers.make_intervals(
+            [("a", datetime.date(2020, 12, 31), datetime.date(2021, 1, 3), 0.5)],
+            ["a", "b"],
+            datetime.date(2021, 1, 1),
+            datetime.date(2021, 1, 4),
+        )
+
+
+def test_compiled_modifier():
+    inference_simulator = gempyor.GempyorInference(
+        config_filepath=f"{config_filepath_prefix}config_test_spatial_group_npi.yml",
+        run_id=105,
+        prefix="",
+        first_sim_index=1,
+        out_run_id=105,
+    )
+    snpi_df = seir.build_npi_SEIR(
+        inference_simulator.modinf, load_ID=False, sim_id2load=None, config=config
+    ).getReductionDF()
+    compiled = gempyor.NPI.CompiledModifier(
+        seir.build_npi_SEIR(
+            inference_simulator.modinf,
+            load_ID=False,
+            sim_id2load=None,
+            config=config,
+            bypass_DF=snpi_df.copy(),
+        )
+    )
+
+    # change the value of some subpops and spatial groups
+    snpi_df_mod = snpi_df.copy()
+    changed = snpi_df_mod["subpop"].isin(["01000", "01000,02000", "09000,10000"])
+    snpi_df_mod.loc[changed, "value"] = 0.5
+    slots = [
+        compiled.slot(name, subpop)
+        for name, subpop in zip(
+            snpi_df_mod.loc[changed, "modifier_name"], snpi_df_mod.loc[changed, "subpop"]
+        )
+    ]
+    assert None not in slots
+    compiled.set_values(slots, np.full(len(slots), 0.5))
+    assert compiled.slot("mt_reduce", "not_a_subpop") is None
+
+    npi = seir.build_npi_SEIR(
+        inference_simulator.modinf,
+        load_ID=False,
+        sim_id2load=None,
+        config=config,
+        bypass_DF=snpi_df_mod.copy(),
+    )
+    for param in ["r1", "r2", "r3", "r4", "r5"]:
+        assert np.array_equal(
+            compiled.getReductionArray(param), npi.getReductionArray(param)
+        )
+    assert compiled.getReductionArray("not_a_param") == 1.0
+
+    compiled_df = compiled.getReductionDF().set_index(["modifier_name", "subpop"])
+    npi_df = npi.getReductionDF().set_index(["modifier_name", "subpop"])
+    assert np.array_equal(
+        compiled_df["value"].to_numpy(float),
+        npi_df.loc[compiled_df.index, "value"].to_numpy(float),
+    )
+
+
+class FixedTableModifier(gempyor.NPI.NPIBase):
+    "A modifier without periods, such as a plugin modifier, read from a fixed table"
+
+    def __init__(self, table, subpops, start_date, end_date, reduction=None):
+        super().__init__(name="fixed_table")
+        self.table = table
+        self.reduction = reduction
+        self.param_name = "r0"
+        self.subpops = subpops
+        self.start_date = start_date
+        self.end_date = end_date
+
+    def getReduction(self, param, default=None):
+        if param == self.param_name and self.reduction is not None:
+            return self.reduction
+        return default
+
+    def getReductionToWrite(self):
+        return self.table
+
+
+def test_compiled_modifier_without_periods_cannot_be_inferred():
+    npi = FixedTableModifier(
+        pd.DataFrame(
+            {
+                "subpop": ["01000", "02000"],
+                "modifier_name": ["fixed_table", "fixed_table"],
+                "start_date": ["2020-04-01", "2020-04-01"],
+                "end_date": ["2020-05-15", "2020-05-15"],
+                "parameter": ["r0", "r0"],
+                "value": [0.3, 0.4],
+            }
+        ),
+        ["01000", "02000"],
+        datetime.date(2020, 4, 1),
+        datetime.date(2020, 5, 15),
+    )
+    compiled = gempyor.NPI.CompiledModifier(npi)
+    assert compiled.slot("fixed_table", "01000") is None
+    assert compiled.is_opaque("fixed_table", "01000")
+    assert not compiled.is_opaque("other_modifier", "01000")
+
+    inferpar = inference_parameter.InferenceParameters(
+        global_config=create_confuse_configview_from_dict({}), subpop_names=[]
+    )
+    # A modifier that is not in the tree is left out, as `inject_proposal` does
+    inferpar.add_single_parameter(
+        ptype="seir_modifiers",
+        pname="other_modifier",
+        subpop="01000",
+        pdist=None,
+        lb=-1.0,
+        ub=1.0,
+    )
+    p_indices, slots = inferpar.get_modifier_slots("seir_modifiers", compiled)
+    assert len(p_indices) == len(slots) == 0
+
+    inferpar.add_single_parameter(
+        ptype="seir_modifiers",
+        pname="fixed_table",
+        subpop="02000",
+        pdist=None,
+        lb=-1.0,
+        ub=1.0,
+    )
+    with pytest.raises(ValueError, match="'fixed_table' of subpop '02000' cannot be"):
+        inferpar.get_modifier_slots("seir_modifiers", compiled)
+    with pytest.raises(ValueError, match="cannot be inferred"):
+        inferpar.inject_proposal_into_modifiers(np.array([0.1, 0.2]), npi_seir=compiled)
+
+
+def test_reduction_array_fallback_is_daily():
+    # A `[subpop, date]` reduction given only on the days where it changes
+    reduction = pd.DataFrame(
+        [[0.1, 0.3, 0.5], [0.2, 0.4, 0.6]],
+        index=["01000", "02000"],
+        columns=["2020-04-01", "2020-04-03", "2020-04-06"],
+    )
+    npi = FixedTableModifier(
+        pd.DataFrame(),
+        ["01000", "02000"],
+        datetime.date(2020, 4, 1),
+        datetime.date(2020, 4, 6),
+        reduction=reduction,
+    )
+    expected = np.array(
+        [[0.1, 0.2], [0.1, 0.2], [0.3, 0.4], [0.3, 0.4], [0.3, 0.4], [0.5, 0.6]]
+    )
+    assert np.array_equal(npi.getReductionArray("r0"), expected)
+    parameter = np.full((6, 2), 2.0)
+    assert np.array_equal(
+        gempyor.NPI.helpers.reduce_parameter(parameter, npi.getReductionArray("r0")),
+        gempyor.NPI.helpers.reduce_parameter(parameter, npi.getReduction("r0")),
+    )
+    assert npi.getReductionArray("gamma") is None
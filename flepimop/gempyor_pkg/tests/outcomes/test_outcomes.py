@@ -11,11 +11,13 @@ import numpy as np
 import datetime
 import matplotlib.pyplot as plt
 import glob, os, sys
+import pickle
 from pathlib import Path
 
 # import seaborn as sns
 import pyarrow.parquet as pq
 import pyarrow as pa
+import xarray as xr
 from gempyor import file_paths, model_info, outcomes
 
 config_filepath_prefix = ""  #'tests/outcomes/'
@@ -291,6 +293,241 @@ def test_multishift_notstochdelays():
     assert (outcomes.multishift(array, shifts, stoch_delay_flag=False) == expected).all()
 
 
+def test_multishift_stochdelays():
+    counts = np.zeros((10, 2))
+    counts[[1, 4]] = [[3.2, 5], [7, 1.6]]
+    shifts = np.tile([2, 7], (10, 1))
+
+    # Fixed integer delays move whole individuals, and drop those past the last day
+    expected = outcomes.multishift(np.round(counts), shifts, stoch_delay_flag=False)
+    delayed = outcomes.multishift(counts, shifts, rng=np.random.default_rng(1))
+    assert (delayed == expected).all()
+    assert delayed.sum() == 3 + 5 + 7
+    assert (outcomes.multishiftee(counts, shifts) == expected).all()
+
+    # With a kernel the delays are drawn, reproducibly from numpy's global state
+    wide = {"distribution": "gamma", "shape": 2.0}
+    np.random.seed(1)
+    delayed = outcomes.multishift(counts, shifts, kernel=wide)
+    np.random.seed(1)
+    assert (outcomes.multishift(counts, shifts, kernel=wide) == delayed).all()
+    assert (delayed == np.round(delayed)).all()
+    assert delayed.sum() <= np.round(counts).sum()
+
+
+def test_apply_delays_with_kernel():
+    rng = np.random.default_rng(42)
+    array = rng.integers(0, 100, size=(60, 3)).astype(float)
+    delays = np.tile([2, 5, 5], (60, 1))
+
+    # Without a kernel, or with a very narrow one, delays are plain shifts
+    expected = outcomes.multishift(array, delays, stoch_delay_flag=False)
+    assert (outcomes.apply_delays(array, delays) == expected).all()
+    narrow = {"distribution": "gamma", "shape": 1e8}
+    assert np.allclose(outcomes.apply_delays(array, delays, kernel=narrow), expected)
+
+    # Piecewise-constant delays are split by delay
+    delays[30:] += 3
+    expected = outcomes.multishift(array, delays, stoch_delay_flag=False)
+    assert np.allclose(outcomes.apply_delays(array, delays, kernel=narrow), expected)
+
+    # A wide kernel conserves the delayed counts and has the requested mean
+    wide = {"distribution": "lognormal", "sdlog": 0.5}
+    delayed = outcomes.apply_delays(np.eye(60)[:, :1], np.full((60, 1), 7), kernel=wide)
+    assert delayed[:, 0].sum() == pytest.approx(1.0, abs=1e-4)
+    assert (delayed[:, 0] * np.arange(60)).sum() == pytest.approx(7.0, abs=1e-3)
+    assert (delayed > 0).sum() > 5
+
+
+def test_apply_delays_stochastic():
+    counts = np.zeros((60, 2))
+    counts[5] = [10000, 20000]
+    delays = np.tile([7, 3], (60, 1))
+    wide = {"distribution": "gamma", "shape": 2.0}
+
+    # Counts are split into whole individuals and none are lost within the horizon
+    delayed = outcomes.apply_delays(counts, delays, wide, rng=np.random.default_rng(1))
+    assert (delayed == np.round(delayed)).all()
+    assert (delayed[:5] == 0).all()
+    assert delayed.sum(axis=0) == pytest.approx([10000, 20000], abs=2)
+
+    # The draws are reproducible from the generator and follow the delay distribution
+    again = outcomes.apply_delays(counts, delays, wide, rng=np.random.default_rng(1))
+    assert (delayed == again).all()
+    expected = outcomes.apply_delays(counts, delays, wide)
+    assert np.abs(delayed - expected).max() < 0.05 * expected.max()
+
+    # Fixed delays are exact whether drawn or not
+    assert (
+        outcomes.apply_delays(counts, delays, rng=np.random.default_rng(1))
+        == outcomes.multishift(counts, delays, stoch_delay_flag=False)
+    ).all()
+
+
+def test_discretized_delay_kernel_bad_parameters():
+    with pytest.raises(ValueError, match="Unknown delay kernel distribution 'weibull'"):
+        outcomes.discretized_delay_kernel(7.0, 10, "weibull", shape=2.0)
+    with pytest.raises(ValueError, match="takes exactly a 'shape' parameter"):
+        outcomes.discretized_delay_kernel(7.0, 10, "gamma", sdlog=2.0)
+
+
+def test_pull_seir_sources():
+    dates = pd.date_range("2020-01-01", periods=4)
+    subpops = ["A", "B"]
+    stages, ages = ["S", "I", "R"], ["young", "old"]
+    names = [f"{stage}_{age}" for stage in stages for age in ages]
+    rng = np.random.default_rng(1)
+    incidence = rng.random((len(dates), len(names), len(subpops)))
+    prevalence = rng.random((len(dates), len(names), len(subpops)))
+    states = xr.Dataset(
+        data_vars=dict(
+            incidence=(["date", "compartment", "subpop"], incidence),
+            prevalence=(["date", "compartment", "subpop"], prevalence),
+        ),
+        coords=dict(
+            date=dates,
+            mc_infection_stage=("compartment", [s for s in stages for _ in ages]),
+            mc_age=("compartment", ages * len(stages)),
+            mc_name=("compartment", names),
+            subpop=subpops,
+        ),
+    )
+    sources = {
+        "incidI": {"incidence": {"infection_stage": "I"}},
+        "incidIold": {"incidence": {"infection_stage": ["I"], "age": "old"}},
+        "prevSR": {"prevalence": {"infection_stage": ["S", "R"]}},
+    }
+    expected = {
+        "incidI": incidence[:, [2, 3]].sum(axis=1),
+        "incidIold": incidence[:, 3],
+        "prevSR": prevalence[:, [0, 1, 4, 5]].sum(axis=1),
+    }
+
+    # Same values from the states and from the shuffled seir output table
+    seir_df = pd.concat(
+        [
+            pd.DataFrame(
+                {
+                    "mc_value_type": vtype,
+                    "mc_infection_stage": np.tile(states["mc_infection_stage"], 4),
+                    "mc_age": np.tile(states["mc_age"], 4),
+                    "mc_name": np.tile(names, 4),
+                    "A": values[..., 0].ravel(),
+                    "B": values[..., 1].ravel(),
+                    "date": np.repeat(dates, len(names)),
+                }
+            )
+            for vtype, values in (("incidence", incidence), ("prevalence", prevalence))
+        ]
+    ).sample(frac=1.0, random_state=2)
+    for seir_sim in (states, seir_df):
+        pulled = outcomes.pull_seir_sources(seir_sim, dates, subpops, sources)
+        assert pulled.keys() == expected.keys()
+        for name, values in expected.items():
+            assert np.allclose(pulled[name], values)
+
+    with pytest.raises(ValueError, match="Cannot discern the source of outcome 'bad'"):
+        outcomes.pull_seir_sources(states, dates, subpops, {"bad": {"foo": {}}})
+
+
+def test_compute_all_multioutcomes_array():
+    os.chdir(os.path.dirname(__file__))
+    inference_simulator = gempyor.GempyorInference(
+        config_filepath=f"{config_filepath_prefix}config.yml",
+        run_id=1,
+        prefix="",
+        first_sim_index=1,
+    )
+    modinf = inference_simulator.modinf
+    parameters = outcomes.read_parameters_from_config(modinf)
+
+    outcomes_array, hpar = outcomes.compute_all_multioutcomes_array(
+        modinf=modinf, sim_id2write=1, parameters=parameters
+    )
+    assert outcomes_array.dims == ("outcome", "date", "subpop")
+    assert list(outcomes_array["outcome"].values) == [
+        "incidI",
+        "incidH",
+        "hosp_curr",
+        "incidD",
+        "incidICU",
+    ]
+    assert list(outcomes_array["subpop"].values) == modinf.subpop_struct.subpop_names
+
+    # The long table matches the array, ordered by subpop then date
+    outcomes_df, hpar_df = outcomes.compute_all_multioutcomes(
+        modinf=modinf, sim_id2write=1, parameters=parameters
+    )
+    pd.testing.assert_frame_equal(
+        outcomes_df, outcomes.dataframe_from_outcomes_array(outcomes_array)
+    )
+    pd.testing.assert_frame_equal(hpar_df, hpar)
+    for i, place in enumerate(modinf.subpop_struct.subpop_names):
+        place_df = outcomes_df[outcomes_df["subpop"] == place]
+        for outcome in outcomes_array["outcome"].values:
+            assert np.array_equal(
+                place_df[outcome].to_numpy(),
+                outcomes_array.sel(outcome=outcome, subpop=place).to_numpy(),
+            )
+
+
+def test_outcome_plan():
+    probability = {"distribution": "uniform", "low": 0.1, "high": 0.2}
+    parameters = {
+        "incidH": {"source": "incidI", "probability": probability, "delay": 7},
+        "incidD": {"source": "incidH_curr", "probability": 0.1, "delay": 2},
+        "incidI": {"source": {"incidence": {"infection_stage": "I1"}}, "delay": 0},
+        "all": {"sum": ["incidI", "incidD"]},
+    }
+    parameters["incidH"]["duration"] = 5
+    parameters["incidH"]["outcome_prevalence_name"] = "incidH_curr"
+    plan = outcomes.OutcomePlan(parameters)
+    assert plan.order == ["incidI", "incidH", "incidD", "all"]
+    assert plan.noutputs() == 5
+
+    # Samplers are rebuilt after unpickling and draw from the global random state
+    np.random.seed(42)
+    draws = [plan.sample("incidH", "probability") for _ in range(3)]
+    unpickled = pickle.loads(pickle.dumps(plan))
+    assert unpickled._samplers == {}
+    assert unpickled.order == plan.order
+    np.random.seed(42)
+    assert [unpickled.sample("incidH", "probability") for _ in range(3)] == draws
+
+    with pytest.raises(ValueError, match="the specified source 'incidX'"):
+        outcomes.OutcomePlan({"incidH": {"source": "incidX"}})
+    with pytest.raises(ValueError, match="the summed outcome 'incidX'"):
+        outcomes.OutcomePlan({"all": {"sum": ["incidX"]}})
+    with pytest.raises(ValueError, match="depend on each other in a cycle"):
+        outcomes.OutcomePlan({"a": {"source": "b"}, "b": {"source": "a"}})
+
+
+def test_read_seir_sim_with_plan():
+    os.chdir(os.path.dirname(__file__))
+    inference_simulator = gempyor.GempyorInference(
+        config_filepath=f"{config_filepath_prefix}config_mc_selection.yml",
+        run_id=1,
+        prefix="",
+        first_sim_index=1,
+    )
+    modinf = inference_simulator.modinf
+    plan = outcomes.OutcomePlan.from_model_info(modinf)
+    dates = pd.date_range(modinf.ti, modinf.tf, freq="D")
+    subpops = modinf.subpop_struct.subpop_names
+
+    seir_df = outcomes.read_seir_sim(modinf, sim_id=1)
+    filtered_df = outcomes.read_seir_sim(modinf, sim_id=1, plan=plan)
+    assert 0 < len(filtered_df) < len(seir_df)
+    assert set(filtered_df["mc_value_type"]) == {"incidence"}
+
+    # Only rows that do not source any outcome are left out
+    full = outcomes.pull_seir_sources(seir_df, dates, subpops, plan.seir_sources)
+    pushed_down = outcomes.pull_seir_sources(filtered_df, dates, subpops, plan.seir_sources)
+    assert full.keys() == pushed_down.keys()
+    for outcome_name in full:
+        assert np.array_equal(full[outcome_name], pushed_down[outcome_name])
+
+
 def test_outcomes_npi():
     os.chdir(os.path.dirname(__file__))
 
@@ -98,3 +98,85 @@ def test_ModelInfo_has_compartments_component():
     )
     assert type(s.compartments) == compartments.Compartments
     assert type(s.compartments) == compartments.Compartments
+
+
+def test_parse_parameters_compiles_formulas_once():
+    config.clear()
+    config.read(user=False)
+    config.set_file(f"{DATA_DIR}/config_compartmental_model_format.yml")
+    comp = compartments.Compartments(
+        seir_config=config["seir"], compartments_config=config["compartments"]
+    )
+    parameter_names = ["gamma", "R0", "alpha"]
+    formulas = ["R0 * gamma", "1*1", "alpha^2", "gamma"]
+    rng = np.random.default_rng(0)
+
+    compartments._compile_parameter_formulas.cache_clear()
+    for _ in range(3):
+        parameters = rng.uniform(size=(3, 10, 4))
+        parsed = comp.parse_parameters(parameters, parameter_names, formulas)
+        assert parsed.shape == (4, 10, 4)
+        assert np.allclose(parsed[0], parameters[1] * parameters[0])
+        assert np.array_equal(parsed[1], np.ones((10, 4)))
+        assert np.allclose(parsed[2], parameters[2] ** 2)
+        assert np.array_equal(parsed[3], parameters[0])
+    cache_info = compartments._compile_parameter_formulas.cache_info()
+    assert cache_info.misses == 1
+    assert cache_info.hits == 2
+
+    with pytest.raises(ValueError, match=r"^Number of parameter values does not match"):
+        comp.parse_parameters(parameters[:2], parameter_names, formulas)
+
+
+def test_get_transition_array_is_memoized_and_cached_on_disk(tmp_path, monkeypatch):
+    config.clear()
+    config.read(user=False)
+    config.set_file(f"{DATA_DIR}/config_compartmental_model_format.yml")
+    comp = compartments.Compartments(
+        seir_config=config["seir"], compartments_config=config["compartments"]
+    )
+    expected = comp.get_transition_array()
+    assert comp.get_transition_array() is expected
+
+    cached = compartments.Compartments(
+        seir_config=config["seir"],
+        compartments_config=config["compartments"],
+        cache_dir=tmp_path,
+    )
+    assert cached.get_transition_array()[0] == expected[0]
+    cache_files = list(tmp_path.iterdir())
+    assert [f.name for f in cache_files] == [
+        f"transition_array.{cached._structure_hash()}.npz"
+    ]
+
+    # A new object for the same model loads the saved arrays instead of rebuilding
+    def fail():
+        raise AssertionError("The transition array should be loaded from disk.")
+
+    loaded = compartments.Compartments(
+        seir_config=config["seir"],
+        compartments_config=config["compartments"],
+        cache_dir=tmp_path,
+    )
+    monkeypatch.setattr(loaded, "_build_transition_array", fail)
+    unique_strings, *arrays = loaded.get_transition_array()
+    assert unique_strings == expected[0]
+    for array, expected_array in zip(arrays, expected[1:]):
+        assert array.dtype == np.int64
+        assert np.array_equal(array, expected_array)
+
+    # Another model gets its own file
+    config.clear()
+    config.read(user=False)
+    config.set_file(f"{DATA_DIR}/config.yml")
+    other = compartments.Compartments(
+        seir_config=config["seir"],
+        compartments_config=config["compartments"],
+        cache_dir=tmp_path,
+    )
+    other.get_transition_array()
+    assert len(list(tmp_path.iterdir())) == 2
+
+    # Files saved by another version of the transition array files are not loaded
+    monkeypatch.setattr(compartments, "_TRANSITION_CACHE_VERSION", -1)
+    assert other._structure_hash() not in {f.name.split(".")[1] for f in tmp_path.iterdir()}
@@ -12,7 +12,7 @@ import pyarrow.parquet as pq
 
 from gempyor import model_info, seir, NPI, file_paths, subpopulation_structure
 
-from gempyor.utils import config
+from gempyor.utils import config, write_df
 
 DATA_DIR = os.path.dirname(__file__) + "/data"
 os.chdir(os.path.dirname(__file__))
@@ -213,6 +213,278 @@ def test_constant_population_rk4jit_integration():
         assert completepop - 1e-3 < totalpop < completepop + 1e-3
 
 
+@ignore_non_csv_mobility_warning
+def test_steps_SEIR_batch_matches_steps_SEIR():
+    config.set_file(f"{DATA_DIR}/config_seir_integration_method_rk4_2.yml")
+
+    modinf = model_info.ModelInfo(
+        config=config,
+        nslots=1,
+        seir_modifiers_scenario="None",
+        write_csv=False,
+        first_sim_index=1,
+        in_run_id="test",
+        in_prefix="",
+        out_run_id="test",
+        out_prefix="",
+    )
+
+    seeding_data, seeding_amounts = modinf.get_seeding_data(sim_id=100)
+    initial_conditions = modinf.initial_conditions.get_from_config(
+        sim_id=100, modinf=modinf
+    )
+    (
+        unique_strings,
+        transition_array,
+        proportion_array,
+        proportion_info,
+    ) = modinf.compartments.get_transition_array()
+
+    batch_parameters = []
+    for _ in range(3):
+        params = modinf.parameters.parameters_quick_draw(modinf.n_days, modinf.nsubpops)
+        batch_parameters.append(
+            modinf.compartments.parse_parameters(
+                params, modinf.parameters.pnames, unique_strings
+            )
+        )
+    batch_initial_conditions = np.stack([initial_conditions] * 3)
+    batch_initial_conditions[1] *= 0.5
+    batch_seeding_amounts = np.stack(
+        [seeding_amounts, 2 * seeding_amounts, seeding_amounts]
+    )
+
+    states = seir.steps_SEIR_batch(
+        modinf,
+        np.stack(batch_parameters),
+        transition_array,
+        proportion_array,
+        proportion_info,
+        batch_initial_conditions,
+        seeding_data,
+        batch_seeding_amounts,
+    )
+
+    assert states["prevalence"].dims == ("batch", "date", "compartment", "subpop")
+    assert states["incidence"].shape == (
+        3,
+        modinf.n_days,
+        modinf.compartments.get_ncomp(),
+        modinf.nsubpops,
+    )
+    for member in range(3):
+        member_states = seir.steps_SEIR(
+            modinf,
+            batch_parameters[member],
+            transition_array,
+            proportion_array,
+            proportion_info,
+            batch_initial_conditions[member],
+            seeding_data,
+            batch_seeding_amounts[member],
+        )
+        assert np.array_equal(
+            states["prevalence"][member].to_numpy(), member_states["prevalence"].to_numpy()
+        )
+        assert np.array_equal(
+            states["incidence"][member].to_numpy(), member_states["incidence"].to_numpy()
+        )
+
+    with pytest.raises(ValueError, match=r"^The batch has 3 parameter sets, but 2"):
+        seir.steps_SEIR_batch(
+            modinf,
+            np.stack(batch_parameters),
+            transition_array,
+            proportion_array,
+            proportion_info,
+            batch_initial_conditions[:2],
+            seeding_data,
+            batch_seeding_amounts,
+        )
+
+    with pytest.raises(ValueError, match=r"^The batch members have parameters of shape"):
+        seir.steps_SEIR_batch(
+            modinf,
+            np.stack(batch_parameters)[:, :, 1:],
+            transition_array,
+            proportion_array,
+            proportion_info,
+            batch_initial_conditions,
+            seeding_data,
+            batch_seeding_amounts,
+        )
+
+    nan_initial_conditions = batch_initial_conditions.copy()
+    nan_initial_conditions[2, 0, 0] = np.nan
+    with pytest.raises(
+        ValueError,
+        match=r"^The initial conditions of batch members \[2\] are not finite\.$",
+    ):
+        seir.steps_SEIR_batch(
+            modinf,
+            np.stack(batch_parameters),
+            transition_array,
+            proportion_array,
+            proportion_info,
+            nan_initial_conditions,
+            seeding_data,
+            batch_seeding_amounts,
+        )
+
+    negative_parameters = np.stack(batch_parameters)
+    negative_parameters[0, 0, 3, 1] = -1.0
+    negative_parameters[2, 1, 5:, 0] = -1.0
+    with pytest.raises(
+        ValueError,
+        match=(
+            r"^There are negative parameters in batch members \[0, 2\]: "
+            rf"member 0 in subpops {modinf.subpop_struct.subpop_names[1]} starting from "
+            rf"date {modinf.dates[3].date()}; member 2 in subpops "
+            rf"{modinf.subpop_struct.subpop_names[0]} starting from date "
+            rf"{modinf.dates[5].date()}\.$"
+        ),
+    ):
+        seir.steps_SEIR_batch(
+            modinf,
+            negative_parameters,
+            transition_array,
+            proportion_array,
+            proportion_info,
+            batch_initial_conditions,
+            seeding_data,
+            batch_seeding_amounts,
+        )
+
+
+@ignore_non_csv_mobility_warning
+@pytest.mark.parametrize("method", ("rk4", "euler"))
+def test_steps_SEIR_parallel_integration_method(method):
+    config.set_file(f"{DATA_DIR}/config_seir_integration_method_rk4_2.yml")
+
+    modinf = model_info.ModelInfo(
+        config=config,
+        nslots=1,
+        seir_modifiers_scenario="None",
+        write_csv=False,
+        first_sim_index=1,
+        in_run_id="test",
+        in_prefix="",
+        out_run_id="test",
+        out_prefix="",
+    )
+
+    seeding_data, seeding_amounts = modinf.get_seeding_data(sim_id=100)
+    initial_conditions = modinf.initial_conditions.get_from_config(
+        sim_id=100, modinf=modinf
+    )
+    (
+        unique_strings,
+        transition_array,
+        proportion_array,
+        proportion_info,
+    ) = modinf.compartments.get_transition_array()
+    params = modinf.parameters.parameters_quick_draw(modinf.n_days, modinf.nsubpops)
+    parsed_parameters = modinf.compartments.parse_parameters(
+        params, modinf.parameters.pnames, unique_strings
+    )
+
+    results = {}
+    for integration_method in (method, f"{method}.parallel"):
+        modinf.seir_config["integration"]["method"].set(integration_method)
+        results[integration_method] = seir.steps_SEIR(
+            modinf,
+            parsed_parameters,
+            transition_array,
+            proportion_array,
+            proportion_info,
+            initial_conditions,
+            seeding_data,
+            seeding_amounts,
+        )
+
+    for variable in ("prevalence", "incidence"):
+        assert np.allclose(
+            results[method][variable].to_numpy(),
+            results[f"{method}.parallel"][variable].to_numpy(),
+            rtol=1e-12,
+            atol=1e-9,
+        )
+
+
+@ignore_non_csv_mobility_warning
+def test_steps_SEIR_adaptive_integration_method():
+    config.set_file(f"{DATA_DIR}/config_seir_integration_method_rk4_2.yml")
+
+    modinf = model_info.ModelInfo(
+        config=config,
+        nslots=1,
+        seir_modifiers_scenario="None",
+        write_csv=False,
+        first_sim_index=1,
+        in_run_id="test",
+        in_prefix="",
+        out_run_id="test",
+        out_prefix="",
+    )
+
+    seeding_data, seeding_amounts = modinf.get_seeding_data(sim_id=100)
+    initial_conditions = modinf.initial_conditions.get_from_config(
+        sim_id=100, modinf=modinf
+    )
+    (
+        unique_strings,
+        transition_array,
+        proportion_array,
+        proportion_info,
+    ) = modinf.compartments.get_transition_array()
+    params = modinf.parameters.parameters_quick_draw(modinf.n_days, modinf.nsubpops)
+    parsed_parameters = modinf.compartments.parse_parameters(
+        params, modinf.parameters.pnames, unique_strings
+    )
+    args = (
+        parsed_parameters,
+        transition_array,
+        proportion_array,
+        proportion_info,
+        initial_conditions,
+        seeding_data,
+        seeding_amounts,
+    )
+
+    fixed_step = seir.steps_SEIR(modinf, *args)
+    modinf.seir_config["integration"]["method"].set("rk45")
+    modinf.seir_config["integration"]["rtol"].set("1e-8")
+    modinf.seir_config["integration"]["atol"].set("1e-6")
+    adaptive = seir.steps_SEIR(modinf, *args)
+
+    for variable in ("prevalence", "incidence"):
+        assert adaptive[variable].shape == fixed_step[variable].shape
+        assert np.allclose(
+            adaptive[variable].to_numpy(),
+            fixed_step[variable].to_numpy(),
+            rtol=1e-3,
+            atol=1.0,
+        )
+
+    with pytest.raises(
+        ValueError, match=r"^The 'rk45' integration method does not support batches\.$"
+    ):
+        seir.steps_SEIR_batch(
+            modinf,
+            parsed_parameters[np.newaxis],
+            transition_array,
+            proportion_array,
+            proportion_info,
+            initial_conditions[np.newaxis],
+            seeding_data,
+            seeding_amounts[np.newaxis],
+        )
+
+    modinf.seir_config["integration"]["rtol"].set(0)
+    with pytest.raises(ValueError, match=r"^The integration tolerances must be positive"):
+        seir.steps_SEIR(modinf, *args)
+
+
 @ignore_non_csv_mobility_warning
 def test_steps_SEIR_nb_simple_spread_with_txt_matrices():
     os.chdir(os.path.dirname(__file__))
@@ -861,3 +1133,69 @@ def test_parallel_compartments_no_vacc():
             ].max()["10001"]
             == 0
         )
+
+
+def test_write_seir_matches_states2Df(tmp_path):
+    os.chdir(os.path.dirname(__file__))
+    config.clear()
+    config.read(user=False)
+
+    config.set_file(f"{DATA_DIR}/config_parallel.yml")
+    config["seir"]["output"]["compression"].set("zstd")
+    config["seir"]["output"]["row_group_size"].set(1000)
+
+    run_id = "test_parallel"
+    modinf = model_info.ModelInfo(
+        config=config,
+        nslots=1,
+        seir_modifiers_scenario="Scenario_vacc",
+        write_parquet=True,
+        first_sim_index=1,
+        in_run_id=run_id,
+        in_prefix="",
+        out_run_id=run_id,
+        out_prefix="",
+    )
+
+    seeding_data, seeding_amounts = modinf.get_seeding_data(sim_id=100)
+    initial_conditions = modinf.initial_conditions.get_from_config(
+        sim_id=100, modinf=modinf
+    )
+    params = modinf.parameters.parameters_quick_draw(modinf.n_days, modinf.nsubpops)
+    (
+        unique_strings,
+        transition_array,
+        proportion_array,
+        proportion_info,
+    ) = modinf.compartments.get_transition_array()
+    parsed_parameters = modinf.compartments.parse_parameters(
+        params, modinf.parameters.pnames, unique_strings
+    )
+    states = seir.steps_SEIR(
+        modinf,
+        parsed_parameters,
+        transition_array,
+        proportion_array,
+        proportion_info,
+        initial_conditions,
+        seeding_data,
+        seeding_amounts,
+    )
+
+    seir.write_seir(1, modinf, states)
+    fname = modinf.get_output_filename(ftype="seir", sim_id=1)
+    write_df(tmp_path / "expected.parquet", seir.states2Df(modinf, states))
+
+    table = pq.read_table(fname)
+    expected = pq.read_table(tmp_path / "expected.parquet")
+    assert table.column_names == expected.column_names
+    for name in table.column_names:
+        assert table.schema.field(name).type in (
+            expected.schema.field(name).type,
+            pa.string(),
+        )
+    pd.testing.assert_frame_equal(table.to_pandas(), expected.to_pandas())
+
+    metadata = pq.read_metadata(fname)
+    assert metadata.num_row_groups == -(-table.num_rows // 1000)
+    assert metadata.row_group(0).column(0).compression == "ZSTD"
@@ -470,6 +470,53 @@ class TestStatistic:
                 mock_inputs.model_data[mock_inputs.config["sim_var"]]
             )
 
+    @pytest.mark.parametrize(
+        ("freq", "aggregator", "skipna", "transpose"),
+        list(
+            product(
+                ("W-SAT", "MS"), ("sum", "mean", "max", "min"), (False, True), (False, True)
+            )
+        ),
+    )
+    def test_apply_resample_with_missing_values(
+        self, freq: str, aggregator: str, skipna: bool, transpose: bool
+    ) -> None:
+        # Setup
+        rng = np.random.default_rng(42)
+        values = rng.poisson(10.0, size=(100, 3)).astype(float)
+        values[rng.random(values.shape) < 0.2] = np.nan
+        values[14:21, 0] = np.nan
+        data = xr.DataArray(
+            values,
+            coords={
+                "date": pd.date_range(date(2024, 1, 1), periods=100),
+                "subpop": ["01", "02", "03"],
+            },
+            dims=["date", "subpop"],
+            name="incidH",
+        )
+        if transpose:
+            data = data.transpose()
+        statistic = Statistic(
+            "total_hospitalizations",
+            create_confuse_configview_from_dict(
+                {
+                    "sim_var": "incidH",
+                    "data_var": "incidH",
+                    "likelihood": {"dist": "pois"},
+                    "resample": {"freq": freq, "aggregator": aggregator, "skipna": skipna},
+                },
+                name="total_hospitalizations",
+            ),
+        )
+
+        # Tests, twice as the resampling plan is reused
+        expected_resampled_data = getattr(data.resample(date=freq), aggregator)(
+            skipna=skipna
+        )
+        for _ in range(2):
+            assert statistic.apply_resample(data).identical(expected_resampled_data)
+
     @pytest.mark.parametrize("factory", all_valid_factories)
     def test_apply_scale(self, factory: Callable[[], MockStatisticInput]) -> None:
         # Setup
@@ -665,3 +712,21 @@ class TestStatistic:
         else:
             # No regularizations on logistic loss
             assert regularization == 0.0
+
+    @pytest.mark.parametrize("factory", all_valid_factories)
+    def test_compute_transformed_logloss(
+        self, factory: Callable[[], MockStatisticInput]
+    ) -> None:
+        mock_inputs = factory()
+        statistic = mock_inputs.create_statistic_instance()
+        log_likelihood, regularization = statistic.compute_logloss(
+            mock_inputs.model_data, mock_inputs.gt_data
+        )
+        transformed_log_likelihood, transformed_regularization = (
+            statistic.compute_transformed_logloss(
+                statistic.apply_transforms(mock_inputs.model_data[statistic.sim_var]),
+                statistic.apply_transforms(mock_inputs.gt_data[statistic.data_var]),
+            )
+        )
+        assert transformed_log_likelihood.identical(log_likelihood)
+        assert transformed_regularization == regularization
@@ -1,20 +1,18 @@
 """Unit tests for `gempyor.steps_rk4.rk4_integration`."""
 
 from typing import Literal
-from unittest.mock import patch
 
 import numba as nb
 import numpy as np
 import pytest
+import scipy.interpolate
+import scipy.sparse
 
-from gempyor.steps_rk4 import rk4_integration
+from gempyor import steps_rk4
+from gempyor.steps_rk4 import precompile, rk4_integration
 
 
-@pytest.mark.parametrize("method", ("euler", "stochastic", "rk4"))
-def test_stochastic_simulation_works_with_legacy_integration_method(
-    method: Literal["euler", "stochastic", "rk4"],
-) -> None:
-    """Test that simulation works all the integration engines."""
+def _legacy_integration_inputs() -> dict:
     # These inputs are modeled after those produced by `config_sample_2pop.yml`.
     seeding_data = nb.typed.Dict.empty(
         key_type=nb.types.unicode_type,
@@ -24,36 +22,295 @@ def test_stochastic_simulation_works_with_legacy_integration_method(
     seeding_data["seeding_destinations"] = np.zeros(0, dtype=np.int64)
     seeding_data["seeding_subpops"] = np.zeros(0, dtype=np.int64)
     seeding_data["day_start_idx"] = np.zeros(214, dtype=np.int64)
+    return {
+        "ncompartments": 4,
+        "nspatial_nodes": 2,
+        "ndays": 213,
+        "parameters": np.ones((4, 213, 2)),
+        "dt": 0.25,
+        "transitions": np.array([[0, 1, 2], [1, 2, 3], [1, 2, 3], [0, 2, 3], [2, 3, 4]]),
+        "proportion_info": np.array([[0, 1, 2, 3], [1, 2, 3, 4], [0, 0, 0, 0]]),
+        "transition_sum_compartments": np.array([0, 2, 1, 2]),
+        "initial_conditions": np.array(
+            [
+                [8.995e03, 1.000e03],
+                [5.000e00, 0.000e00],
+                [0.000e00, 0.000e00],
+                [0.000e00, 0.000e00],
+            ]
+        ),
+        "seeding_data": seeding_data,
+        "seeding_amounts": np.array([], dtype=np.float64),
+        "mobility_data": np.array([100.0, 20.0]),
+        "mobility_row_indices": np.array([1, 0], dtype=np.int32),
+        "mobility_data_indices": np.array([0, 1, 2], dtype=np.int32),
+        "population": np.array([9000, 1000]),
+    }
+
+
+@pytest.mark.parametrize("method", ("euler", "stochastic", "rk4"))
+def test_stochastic_simulation_works_with_legacy_integration_method(
+    method: Literal["euler", "stochastic", "rk4"],
+) -> None:
+    """Test that simulation works all the integration engines."""
+    result = rk4_integration(**_legacy_integration_inputs(), method=method, silent=True)
+    assert isinstance(result, tuple)
+
+
+@pytest.mark.parametrize("method", ("euler", "rk4"))
+def test_kernels_are_not_recompiled_between_calls(
+    method: Literal["euler", "rk4"],
+) -> None:
+    """Test that the module level kernels are compiled once and then reused."""
+    first = rk4_integration(**_legacy_integration_inputs(), method=method, silent=True)
+    signatures = {
+        name: len(getattr(steps_rk4, name).signatures)
+        for name in ("_mixing_operator", "_integrate_steps")
+    }
+    second = rk4_integration(**_legacy_integration_inputs(), method=method, silent=True)
+    for name, count in signatures.items():
+        assert len(getattr(steps_rk4, name).signatures) == count
+    assert np.array_equal(first[0], second[0])
+    assert np.array_equal(first[1], second[1])
+
+
+def test_unknown_method_raises_value_error() -> None:
+    """Test that an unknown integration method is rejected before integrating."""
+    with pytest.raises(ValueError, match=r"^Did not understand method == foobar$"):
+        rk4_integration(**_legacy_integration_inputs(), method="foobar", silent=True)
+
+
+def test_precompile_compiles_kernels() -> None:
+    """Test that `precompile` leaves the integration kernels compiled."""
+    assert precompile() is None
+    for name in (
+        "_mixing_operator",
+        "_integrate_steps",
+        "_smooth_two_day_steps",
+        "_integrate_adaptive",
+    ):
+        assert len(getattr(steps_rk4, name).signatures) >= 1
+
+
+@pytest.mark.parametrize("method", ("euler", "rk4"))
+@pytest.mark.parametrize("dt", (0.1, 0.25, 1.0, 2.0))
+def test_progress_reporting_does_not_change_result(
+    method: Literal["euler", "rk4"], dt: float
+) -> None:
+    """Test that integrating day by day for progress matches a single compiled call."""
+    inputs = _legacy_integration_inputs()
+    inputs["dt"] = dt
+    inputs["seeding_data"]["seeding_sources"] = np.array([0, 0], dtype=np.int64)
+    inputs["seeding_data"]["seeding_destinations"] = np.array([1, 1], dtype=np.int64)
+    inputs["seeding_data"]["seeding_subpops"] = np.array([0, 1], dtype=np.int64)
+    inputs["seeding_data"]["day_start_idx"][10:] = 1
+    inputs["seeding_data"]["day_start_idx"][20:] = 2
+    inputs["seeding_amounts"] = np.array([5.0, 3.0])
+    silent = rk4_integration(**inputs, method=method, silent=True)
+    verbose = rk4_integration(**inputs, method=method, silent=False)
+    assert np.array_equal(silent[0], verbose[0])
+    assert np.array_equal(silent[1], verbose[1])
+
+
+@pytest.mark.parametrize("ndays", (5, 6, 213))
+def test_smooth_two_day_steps_matches_linear_interpolation(ndays: int) -> None:
+    """Test that the compiled smoothing matches `scipy.interpolate.interp1d`."""
+    rng = np.random.default_rng(123)
+    states = rng.uniform(size=(ndays, 3, 2))
+    states_daily_incid = rng.uniform(size=(ndays, 3, 2))
+    smoothed, smoothed_incid = steps_rk4._smooth_two_day_steps(states, states_daily_incid)
+    expected = scipy.interpolate.interp1d(
+        np.arange(ndays, step=2),
+        states[::2, :, :],
+        axis=0,
+        kind="linear",
+        bounds_error=False,
+        fill_value="extrapolate",
+    )(np.arange(ndays))
+    assert np.array_equal(smoothed, expected)
+    expected_incid = states_daily_incid / 2
+    expected_incid[1::2, :, :] = expected_incid[:-1:2, :, :]
+    assert np.array_equal(smoothed_incid, expected_incid)
+
+
+def test_mixing_operator_matches_dense_mobility_coupling() -> None:
+    """Test the precomputed mixing operator against its dense definition."""
+    rng = np.random.default_rng(321)
+    nspatial_nodes = 5
+    population = rng.integers(1_000, 10_000, size=nspatial_nodes)
+    mobility = rng.uniform(0.0, 100.0, size=(nspatial_nodes, nspatial_nodes))
+    mobility[rng.uniform(size=mobility.shape) < 0.5] = 0.0
+    np.fill_diagonal(mobility, 0.0)
+    mobility = scipy.sparse.csr_matrix(mobility)
+    mixing_data, mixing_indices, mixing_indptr = steps_rk4._mixing_operator(
+        nspatial_nodes,
+        mobility.data.astype(np.float64),
+        mobility.indices,
+        mobility.indptr,
+        population,
+    )
+    mixing = scipy.sparse.csr_matrix(
+        (mixing_data, mixing_indices, mixing_indptr),
+        shape=(nspatial_nodes, nspatial_nodes),
+    ).toarray()
+    proportion_who_move = np.minimum(
+        np.asarray(mobility.sum(axis=1)).ravel() / population, 1.0
+    )
+    expected = np.diag(1.0 - steps_rk4.percent_day_away * proportion_who_move)
+    expected += steps_rk4.percent_day_away * mobility.toarray() / population[:, None]
+    assert np.allclose(mixing, expected)
+
 
-    def jit_wraps(*args, **kwargs):
-        return nb.jit(*args, **kwargs)
-
-    with patch("gempyor.steps_rk4.jit", wraps=jit_wraps) as jit_patch:
-        result = rk4_integration(
-            ncompartments=4,
-            nspatial_nodes=2,
-            ndays=213,
-            parameters=np.ones((4, 213, 2)),
-            dt=0.25,
-            transitions=np.array([[0, 1, 2], [1, 2, 3], [1, 2, 3], [0, 2, 3], [2, 3, 4]]),
-            proportion_info=np.array([[0, 1, 2, 3], [1, 2, 3, 4], [0, 0, 0, 0]]),
-            transition_sum_compartments=np.array([0, 2, 1, 2]),
-            initial_conditions=np.array(
-                [
-                    [8.995e03, 1.000e03],
-                    [5.000e00, 0.000e00],
-                    [0.000e00, 0.000e00],
-                    [0.000e00, 0.000e00],
-                ]
-            ),
-            seeding_data=seeding_data,
-            seeding_amounts=np.array([], dtype=np.float64),
-            mobility_data=np.array([100.0, 20.0]),
-            mobility_row_indices=np.array([1, 0], dtype=np.int32),
-            mobility_data_indices=np.array([0, 1, 2], dtype=np.int32),
-            population=np.array([9000, 1000]),
+@pytest.mark.parametrize("method", ("euler", "rk4"))
+def test_parallel_engine_is_reproducible_across_thread_counts(
+    method: Literal["euler", "rk4"],
+) -> None:
+    """Test the thread parallel engine against itself and the serial engine."""
+    serial = rk4_integration(**_legacy_integration_inputs(), method=method, silent=True)
+    results = []
+    original_num_threads = nb.get_num_threads()
+    try:
+        for num_threads in range(1, nb.config.NUMBA_NUM_THREADS + 1):
+            nb.set_num_threads(num_threads)
+            results.append(
+                rk4_integration(
+                    **_legacy_integration_inputs(),
+                    method=method,
+                    silent=True,
+                    parallel=True,
+                )
+            )
+    finally:
+        nb.set_num_threads(original_num_threads)
+    for result in results:
+        np.testing.assert_array_equal(result[0], serial[0])
+        np.testing.assert_array_equal(result[1], serial[1])
+
+
+@pytest.mark.parametrize("method", ("euler", "rk4"))
+def test_parallel_batch_matches_serial_members(method: Literal["euler", "rk4"]) -> None:
+    """Test the batch split across threads against its members integrated one by one."""
+    inputs = _legacy_integration_inputs()
+    scales = np.array([1.0, 0.5, 1.5, 0.8])
+    batch_inputs = dict(
+        inputs,
+        parameters=scales[:, None, None, None] * inputs["parameters"],
+        initial_conditions=np.stack([inputs["initial_conditions"]] * len(scales)),
+        seeding_amounts=np.stack([inputs["seeding_amounts"]] * len(scales)),
+    )
+    states, states_daily_incid = steps_rk4.rk4_integration_batch(
+        **batch_inputs, method=method, silent=True, parallel=True
+    )
+    for member, scale in enumerate(scales):
+        expected = rk4_integration(
+            **dict(inputs, parameters=scale * inputs["parameters"]),
             method=method,
             silent=True,
         )
-        assert jit_patch.call_count == (2 if method == "stochastic" else 3)
-    assert isinstance(result, tuple)
+        np.testing.assert_array_equal(states[member], expected[0])
+        np.testing.assert_array_equal(states_daily_incid[member], expected[1])
+
+
+def test_parallel_stochastic_engine_raises_value_error() -> None:
+    """Test that the stochastic method refuses the thread parallel engine."""
+    with pytest.raises(
+        ValueError, match=r"^The stochastic method does not have a parallel engine\.$"
+    ):
+        rk4_integration(
+            **_legacy_integration_inputs(), method="stochastic", silent=True, parallel=True
+        )
+
+
+def _rk45_integration_inputs() -> dict:
+    inputs = _legacy_integration_inputs()
+    inputs.pop("dt")
+    inputs["parameters"] *= np.array([0.3, 0.2, 0.1, 1.0])[:, None, None]
+    inputs["parameters"][0, 100:, :] *= 0.5
+    inputs["seeding_data"]["seeding_sources"] = np.array([0, 0], dtype=np.int64)
+    inputs["seeding_data"]["seeding_destinations"] = np.array([1, 1], dtype=np.int64)
+    inputs["seeding_data"]["seeding_subpops"] = np.array([0, 1], dtype=np.int64)
+    inputs["seeding_data"]["day_start_idx"][10:] = 1
+    inputs["seeding_data"]["day_start_idx"][20:] = 2
+    inputs["seeding_amounts"] = np.array([5.0, 3.0])
+    return inputs
+
+
+@pytest.mark.parametrize("parallel", (False, True))
+def test_rk45_integration_matches_fine_rk4(parallel: bool) -> None:
+    """Test the adaptive step engine against the fixed step engine with a small `dt`."""
+    expected = rk4_integration(
+        **_rk45_integration_inputs(), dt=1 / 64, method="rk4", silent=True
+    )
+    states, states_daily_incid = steps_rk4.rk45_integration(
+        **_rk45_integration_inputs(), rtol=1e-9, atol=1e-6, parallel=parallel
+    )
+    assert states.shape == states_daily_incid.shape == expected[0].shape
+    assert np.allclose(states, expected[0], rtol=1e-5, atol=1e-2)
+    assert np.allclose(states_daily_incid, expected[1], rtol=1e-5, atol=1e-2)
+    assert np.allclose(states.sum(axis=1), states[0].sum(axis=0))
+
+
+def test_rk45_integration_tolerances_bound_error() -> None:
+    """Test that tightening the tolerances of the adaptive engine reduces its error."""
+    expected = rk4_integration(
+        **_rk45_integration_inputs(), dt=1 / 64, method="rk4", silent=True
+    )
+    errors = []
+    for rtol, atol in ((1e-3, 1.0), (1e-6, 1e-3)):
+        _, states_daily_incid = steps_rk4.rk45_integration(
+            **_rk45_integration_inputs(), rtol=rtol, atol=atol
+        )
+        errors.append(np.abs(states_daily_incid - expected[1]).max())
+    assert errors[1] < errors[0]
+
+
+def _stochastic_integration_inputs() -> dict:
+    inputs = _legacy_integration_inputs()
+    inputs["ndays"] = 60
+    inputs["parameters"] = 0.3 * inputs["parameters"][:, :60, :]
+    inputs["seeding_data"]["day_start_idx"] = np.zeros(61, dtype=np.int64)
+    inputs["initial_conditions"][1] = 100.0
+    return inputs
+
+
+def test_stochastic_engine_is_reproducible_from_seeds() -> None:
+    """Test that the stochastic draws are governed by the given or global seed."""
+    explicit = [
+        rk4_integration(
+            **_stochastic_integration_inputs(),
+            method="stochastic",
+            silent=True,
+            rng=np.random.default_rng(seed),
+        )
+        for seed in (1, 1, 2)
+    ]
+    assert np.array_equal(explicit[0][0], explicit[1][0])
+    assert np.array_equal(explicit[0][1], explicit[1][1])
+    assert not np.array_equal(explicit[0][1], explicit[2][1])
+    assert np.array_equal(explicit[0][1], np.round(explicit[0][1]))
+
+    seeded = []
+    for silent in (True, False):
+        np.random.seed(123)
+        seeded.append(
+            rk4_integration(
+                **_stochastic_integration_inputs(), method="stochastic", silent=silent
+            )
+        )
+    assert np.array_equal(seeded[0][0], seeded[1][0])
+    assert np.array_equal(seeded[0][1], seeded[1][1])
+
+
+def test_stochastic_engine_mean_matches_euler() -> None:
+    """Test that the binomial tau-leaps average out to the deterministic euler steps."""
+    rng = np.random.default_rng(42)
+    prevalences = [
+        rk4_integration(
+            **_stochastic_integration_inputs(), method="stochastic", silent=True, rng=rng
+        )[0]
+        for _ in range(200)
+    ]
+    expected = rk4_integration(
+        **_stochastic_integration_inputs(), method="euler", silent=True
+    )[0]
+    assert np.allclose(np.mean(prevalences, axis=0), expected, rtol=0.05, atol=5.0)
@@ -0,0 +1,19 @@
+"""Unit tests for `gempyor.utils.global_random_generator`."""
+
+import numpy as np
+import pytest
+
+from gempyor.utils import global_random_generator
+
+
+@pytest.mark.parametrize("seed", [0, 42, 2**32 - 1])
+def test_global_random_generator(seed: int) -> None:
+    """Test that the generator is reproduced by seeding numpy's global state."""
+    np.random.seed(seed)
+    draws1 = global_random_generator().random(5)
+    draws2 = global_random_generator().random(5)
+    assert not np.array_equal(draws1, draws2)
+
+    np.random.seed(seed)
+    assert np.array_equal(global_random_generator().random(5), draws1)
+    assert np.array_equal(global_random_generator().random(5), draws2)